@@ -4,27 +4,31 @@
 import badgrlog
 import datetime
 
+from django.conf import settings
+from django.db.models import Q
 from django.utils import timezone
 from rest_framework import permissions
 from rest_framework.response import Response
 from rest_framework import serializers
 from rest_framework import status
 
-from backpack.models import BackpackCollection, BackpackBadgeShare, BackpackCollectionShare
+from backpack.models import BackpackCollection, BackpackBadgeShare, BackpackCollectionShare, BackpackImportJob
 from backpack.serializers_v1 import CollectionSerializerV1, LocalBadgeInstanceUploadSerializerV1
 from backpack.serializers_v2 import BackpackAssertionSerializerV2, BackpackCollectionSerializerV2, \
-    BackpackImportSerializerV2, BackpackAssertionAcceptanceSerializerV2
-from entity.api import BaseEntityListView, BaseEntityDetailView
-from issuer.models import BadgeInstance
+    BackpackImportSerializerV2, BackpackAssertionAcceptanceSerializerV2, BackpackImportJobSerializerV2
+from backpack.tasks import enqueue_badge_import
+from entity.api import BaseEntityListView, BaseEntityDetailView, UncachedPaginatedViewMixin
+from issuer.models import BadgeInstance, RECIPIENT_TYPE_EMAIL
 from issuer.permissions import AuditedModelOwner, VerifiedEmailMatchesRecipientIdentifier, BadgrOAuthTokenHasScope
 from issuer.public_api import ImagePropertyDetailView
 from apispec_drf.decorators import apispec_list_operation, apispec_post_operation, apispec_get_operation, \
     apispec_delete_operation, apispec_put_operation, apispec_operation
 from mainsite.permissions import AuthenticatedWithVerifiedIdentifier
+from mainsite.utils import respond_async_requested
 
 logger = badgrlog.BadgrLogger()
 
-class BackpackAssertionList(BaseEntityListView):
+class BackpackAssertionList(UncachedPaginatedViewMixin, BaseEntityListView):
     model = BadgeInstance
     v1_serializer_class = LocalBadgeInstanceUploadSerializerV1
     v2_serializer_class = BackpackAssertionSerializerV2
@@ -40,8 +44,9 @@ class BackpackAssertionList(BaseEntityListView):
         'include_revoked': {'v1': 'false', 'v2': 'false'},
         'include_pending': {'v1': 'false', 'v2': 'false'},
     }
+    ordering = 'pk'
 
-    def get_objects(self, request, **kwargs):
+    def get_queryset(self, request, **kwargs):
         version = kwargs.get('version', 'v1')
         include_expired = request.query_params.get(
             'include_expired', self.include_defaults['include_expired'][version]
@@ -53,15 +58,28 @@ class BackpackAssertionList(BaseEntityListView):
             'include_pending', self.include_defaults['include_pending'][version]
         ).lower() in ['1', 'true']
 
-        def badge_filter(b):
-            if ((b.acceptance == BadgeInstance.ACCEPTANCE_REJECTED) or
-                    (not include_expired and b.expires_at != None and b.expires_at < timezone.now()) or
-                    (not include_revoked and b.revoked) or
-                    (not include_pending and b.pending)):
-                return False
-            return True
-
-        return list(filter(badge_filter, self.request.user.cached_badgeinstances()))
+        # assertions to a verified identifier are never pending; an assertion to one of the user's unverified
+        # emails is only listed if they imported it (see BadgeInstance.pending and
+        # VerifiedEmailMatchesRecipientIdentifier)
+        verified_identifiers = set(request.user.all_verified_recipient_identifiers)
+        # handed to the serializer, so it can tell which assertions are pending without a lookup per assertion
+        self.verified_recipient_identifiers = verified_identifiers
+        recipient_filter = Q(recipient_identifier__in=verified_identifiers)
+        if include_pending:
+            unverified_identifiers = set(request.user.all_recipient_identifiers) - verified_identifiers
+            if unverified_identifiers:
+                recipient_filter |= Q(
+                    recipient_identifier__in=unverified_identifiers, recipient_type=RECIPIENT_TYPE_EMAIL,
+                    source_url__isnull=False
+                ) & ~Q(source_url='')
+
+        queryset = BadgeInstance.objects.filter(recipient_filter).exclude(
+            acceptance=BadgeInstance.ACCEPTANCE_REJECTED)
+        if not include_expired:
+            queryset = queryset.filter(Q(expires_at__isnull=True) | Q(expires_at__gte=timezone.now()))
+        if not include_revoked:
+            queryset = queryset.filter(revoked=False)
+        return queryset
 
     @apispec_list_operation('Assertion',
         summary="Get a list of Assertions in authenticated user's backpack ",
@@ -118,6 +136,7 @@ class BackpackAssertionList(BaseEntityListView):
     def get_context_data(self, **kwargs):
         context = super(BackpackAssertionList, self).get_context_data(**kwargs)
         context['format'] = self.request.query_params.get('json_format', 'v1')  # for /v1/earner/badges compat
+        context['verified_recipient_identifiers'] = getattr(self, 'verified_recipient_identifiers', None)
         return context
 
 
@@ -302,7 +321,15 @@ class BackpackImportBadge(BaseEntityListView):
                         },
                     }
                 },
-            }
+            },
+            {
+                "in": "header",
+                "name": "Prefer",
+                "type": "string",
+                "required": False,
+                "description": "Send respond-async to get a 202 with a BackpackImportJob to poll instead of waiting "
+                               "for the badge to be verified",
+            },
         ]
     )
     def post(self, request, **kwargs):
@@ -310,6 +337,11 @@ class BackpackImportBadge(BaseEntityListView):
         serializer_class = self.get_serializer_class()
         serializer = serializer_class(data=request.data, context=context)
         serializer.is_valid(raise_exception=True)
+
+        if respond_async_requested(request) or getattr(settings, 'BADGE_IMPORT_ASYNC', False):
+            job = enqueue_badge_import(request.user, **serializer.validated_data)
+            return import_job_accepted_response(job, context)
+
         new_instance = serializer.save(created_by=request.user)
         self.log_create(new_instance)
 
@@ -317,6 +349,28 @@ class BackpackImportBadge(BaseEntityListView):
         return Response(response_serializer.data, status=status.HTTP_201_CREATED)
 
 
+def import_job_accepted_response(job, context):
+    response_serializer = BackpackImportJobSerializerV2(job, context=context)
+    return Response(response_serializer.data, status=status.HTTP_202_ACCEPTED, headers={'Location': job.status_url})
+
+
+class BackpackImportJobDetail(BaseEntityDetailView):
+    model = BackpackImportJob
+    v2_serializer_class = BackpackImportJobSerializerV2
+    permission_classes = (AuthenticatedWithVerifiedIdentifier, AuditedModelOwner, BadgrOAuthTokenHasScope)
+    http_method_names = ('get',)
+    valid_scopes = {
+        'get': ['r:backpack', 'rw:backpack', 'https://purl.imsglobal.org/spec/ob/v2p1/scope/assertion.create'],
+    }
+
+    @apispec_get_operation('BackpackImportJob',
+                           summary='Get the progress of an asynchronous badge import',
+                           tags=['Backpack']
+                           )
+    def get(self, request, **kwargs):
+        return super(BackpackImportJobDetail, self).get(request, **kwargs)
+
+
 class ShareBackpackAssertion(BaseEntityDetailView):
     model = BadgeInstance
     permission_classes = (permissions.AllowAny,)  # this is AllowAny to support tracking sharing links in emails
@@ -1,18 +1,25 @@
+import binascii
+import hashlib
+from base64 import b64decode, b64encode
 from collections import OrderedDict
 
 from apispec_drf.decorators import apispec_get_operation, apispec_post_operation
 from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
 from django.shortcuts import reverse
 from django.utils.dateparse import parse_datetime
 from django.views.generic.base import RedirectView
 from rest_framework import status
+from rest_framework.exceptions import NotFound
 from rest_framework.generics import ListCreateAPIView, GenericAPIView
 from rest_framework.pagination import LimitOffsetPagination
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
-from rest_framework.utils.urls import replace_query_param
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 from rest_framework.views import APIView
 
+from backpack.tasks import enqueue_badge_import
 from backpack.serializers_bcv1 import BackpackProfilesSerializerBC, BadgeConnectAssertionsSerializer, \
     BadgeConnectImportSerializer, BadgeConnectManifestSerializer
 from badgeuser.models import BadgeUser
@@ -21,6 +28,7 @@ from issuer.models import BadgeInstance
 from issuer.permissions import BadgrOAuthTokenHasScope, VerifiedEmailMatchesRecipientIdentifier
 from mainsite.permissions import AuthenticatedWithVerifiedIdentifier
 from mainsite.models import BadgrApp
+from mainsite.utils import respond_async_requested
 
 
 BADGE_CONNECT_SCOPES = [
@@ -92,30 +100,114 @@ class BadgeConnectManifestRedirectView(RedirectView):
 
 
 class BadgeConnectPagination(LimitOffsetPagination):
-    def get_first_link(self):
-        url = self.request.build_absolute_uri()
-        url = replace_query_param(url, self.limit_query_param, self.limit)
+    """
+    Pages through assertions newest first, ordered by (updated_at, pk).
 
-        return replace_query_param(url, self.offset_query_param, 0)
-    def get_last_link(self):
-        offset = self.count // self.limit
-        if offset != 0 and self.count % (offset * self.limit) == 0:
-            offset -= 1
-        offset *= self.limit
+    A page may still be requested by offset, but the next and prev links carry an opaque keyset cursor, so following
+    them costs the same however deep the page is. The last link is a cursor too: it reads the oldest assertions in
+    ascending order. The total behind it, and behind the X-Total-Count header, is cached briefly per query rather
+    than counted on every request.
+    """
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+    CURSOR_NEXT = 'n'
+    CURSOR_PREV = 'p'
+    CURSOR_LAST = 'l'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+        self.offset = self.get_offset(request)
+        self.count = self.get_cached_count(queryset)
+
+        newest_first = queryset.order_by('-updated_at', '-pk')
+        oldest_first = queryset.order_by('updated_at', 'pk')
+        cursor = self.decode_cursor(request)
+
+        if cursor is None:
+            results = list(newest_first[self.offset:self.offset + self.limit + 1])
+            self.has_next = len(results) > self.limit
+            self.has_previous = self.offset > 0
+            results = results[:self.limit]
+        elif cursor[0] == self.CURSOR_NEXT:
+            position = Q(updated_at__lt=cursor[1]) | Q(updated_at=cursor[1], pk__lt=cursor[2])
+            results = list(newest_first.filter(position)[:self.limit + 1])
+            self.has_next = len(results) > self.limit
+            self.has_previous = True
+            results = results[:self.limit]
+        elif cursor[0] == self.CURSOR_PREV:
+            position = Q(updated_at__gt=cursor[1]) | Q(updated_at=cursor[1], pk__gt=cursor[2])
+            results = list(oldest_first.filter(position)[:self.limit + 1])
+            self.has_previous = len(results) > self.limit
+            self.has_next = True
+            results = list(reversed(results[:self.limit]))
+        else:
+            last_page_size = self.count % self.limit or self.limit
+            results = list(reversed(oldest_first[:last_page_size]))
+            self.has_next = False
+            self.has_previous = self.count > last_page_size
+
+        self.page = results
+        return results
+
+    def get_cached_count(self, queryset):
+        key = 'badge_connect_count_{}'.format(hashlib.md5(str(queryset.query).encode('utf-8')).hexdigest())
+        count = cache.get(key)
+        if count is None:
+            count = queryset.count()
+            cache.set(key, count, getattr(settings, 'BADGE_CONNECT_COUNT_CACHE_TIMEOUT', 60))
+        return count
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            direction, updated_at, pk = b64decode(encoded.encode('ascii'), altchars=b'-_').decode('ascii').split('|')
+            if direction == self.CURSOR_LAST:
+                return direction, None, None
+            updated_at = parse_datetime(updated_at)
+            if direction not in (self.CURSOR_NEXT, self.CURSOR_PREV) or updated_at is None:
+                raise ValueError(direction)
+            return direction, updated_at, int(pk)
+        except (TypeError, ValueError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, direction, instance=None):
+        if instance is None:
+            position = '|'
+        else:
+            position = '{}|{}'.format(instance.updated_at.isoformat(), instance.pk)
+        encoded = b64encode('{}|{}'.format(direction, position).encode('ascii'), altchars=b'-_').decode('ascii')
 
         url = self.request.build_absolute_uri()
         url = replace_query_param(url, self.limit_query_param, self.limit)
+        url = remove_query_param(url, self.offset_query_param)
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(self.CURSOR_NEXT, self.page[-1])
 
-        return replace_query_param(url, self.offset_query_param, offset)
     def get_previous_link(self):
-        if self.offset <= 0:
+        if not self.has_previous:
             return None
+        if not self.page:
+            return self.get_first_link()
+        return self.encode_cursor(self.CURSOR_PREV, self.page[0])
 
+    def get_first_link(self):
         url = self.request.build_absolute_uri()
         url = replace_query_param(url, self.limit_query_param, self.limit)
+        url = remove_query_param(url, self.cursor_query_param)
+        return replace_query_param(url, self.offset_query_param, 0)
+
+    def get_last_link(self):
+        return self.encode_cursor(self.CURSOR_LAST)
 
-        offset = self.offset - self.limit
-        return replace_query_param(url, self.offset_query_param, offset)
     def get_paginated_response(self, data):
         links = []
         if self.get_next_link():
@@ -124,7 +216,7 @@ class BadgeConnectPagination(LimitOffsetPagination):
         links.append('<%s>; rel="last"' % self.get_last_link())
         if self.get_previous_link():
             links.append('<%s>; rel="prev"' % self.get_previous_link())
-        headers = dict(Link=','.join(links))
+        headers = {'Link': ','.join(links), 'X-Total-Count': str(self.count)}
         return Response(data, headers=headers)
 
 
@@ -140,7 +232,7 @@ class BadgeConnectAssertionListView(ListCreateAPIView):
     http_method_names = ('get', 'post')
 
     def get_queryset(self):
-        qs = BadgeInstance.objects.filter(recipient_identifier__in=self.request.user.all_recipient_identifiers).order_by('-updated_at')
+        qs = BadgeInstance.objects.filter(recipient_identifier__in=self.request.user.all_recipient_identifiers).order_by('-updated_at', '-pk')
         if self.request.query_params.get('since', None):
             qs = qs.filter(updated_at__gte=parse_datetime(self.request.query_params.get('since')))
         return qs
@@ -166,6 +258,12 @@ class BadgeConnectAssertionListView(ListCreateAPIView):
                'type': 'integer',
                'description': 'Indicate the index of the first record to return (zero indexed).'
            },
+           {
+               "in": "query",
+               'name': 'cursor',
+               'type': 'string',
+               'description': 'An opaque position taken from the next, prev or last Link header.'
+           },
            {
                "in": "query",
                'name': 'limit',
@@ -193,9 +291,25 @@ class BadgeConnectAssertionListView(ListCreateAPIView):
                 'schema': {'$ref': '#/definitions/BadgeConnectImportResult'},
                 'description': "Successfully created"
             }),
+            ("202", {
+                'schema': {'$ref': '#/definitions/BadgeConnectImportResult'},
+                'description': "Import started, poll the BackpackImportJob in the Location header. Sent when the "
+                               "request has a Prefer: respond-async header"
+            }),
         ])
     )
     def post(self, request, **kwargs):
+        if respond_async_requested(request) or getattr(settings, 'BADGE_IMPORT_ASYNC', False):
+            serializer = self.get_serializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            job = enqueue_badge_import(request.user, url=serializer.validated_data['id'])
+            return Response({
+                "status": {
+                    "error": None,
+                    "statusCode": 202,
+                    "statusText": 'Accepted',
+                },
+            }, status=status.HTTP_202_ACCEPTED, headers={'Location': job.status_url})
         return super(BadgeConnectAssertionListView, self).post(request, **kwargs)
 
 
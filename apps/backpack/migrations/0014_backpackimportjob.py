@@ -0,0 +1,39 @@
+# Generated by Django 2.2.14 on 2026-10-19 12:00
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('issuer', '0058_badgeinstance_updated_at_index'),
+        ('backpack', '0013_auto_20200608_0452'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BackpackImportJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entity_version', models.PositiveIntegerField(default=1)),
+                ('entity_id', models.CharField(default=None, max_length=254, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('updated_at', models.DateTimeField(auto_now=True, db_index=True)),
+                ('status', models.CharField(choices=[('Pending', 'Pending'), ('Running', 'Running'), ('Succeeded', 'Succeeded'), ('Failed', 'Failed')], default='Pending', max_length=254)),
+                ('url', models.URLField(blank=True, max_length=1024, null=True)),
+                ('image', models.FileField(blank=True, null=True, upload_to='uploads/imports')),
+                ('assertion', jsonfield.fields.JSONField(blank=True, null=True)),
+                ('errors', jsonfield.fields.JSONField(blank=True, null=True)),
+                ('badgeinstance', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='issuer.BadgeInstance')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('updated_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
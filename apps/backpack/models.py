@@ -6,17 +6,21 @@ from collections import OrderedDict
 
 import cachemodel
 from basic_models.models import CreatedUpdatedAt
-from django.urls import reverse
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
 from django.db import models, transaction
 from django.db.models import Q
+from django.urls import reverse
+from jsonfield import JSONField
 
 from entity.models import BaseVersionedEntity
 from issuer.models import BaseAuditedModelDeletedWithUser, BadgeInstance
 from backpack.sharing import SharingManager
-from issuer.utils import CURRENT_OBI_VERSION, get_obi_context, add_obi_version_ifneeded
+from issuer.utils import CURRENT_OBI_VERSION, OBI_VERSION_CONTEXT_IRIS, get_obi_context, add_obi_version_ifneeded
 from mainsite.managers import SlugOrJsonIdCacheModelManager
 from mainsite.models import BadgrApp
-from mainsite.utils import OriginSetting
+from mainsite.utils import OriginSetting, PublicUrl
 
 
 class BackpackCollection(BaseAuditedModelDeletedWithUser, BaseVersionedEntity):
@@ -33,18 +37,22 @@ class BackpackCollection(BaseAuditedModelDeletedWithUser, BaseVersionedEntity):
     cached = SlugOrJsonIdCacheModelManager(slug_kwarg_name='entity_id', slug_field_name='entity_id')
 
     def publish(self):
+        # BadgeInstance.publish() publishes every collection it belongs to, which discards their rendered json too
         super(BackpackCollection, self).publish()
         self.publish_by('share_hash')
+        self.invalidate_cached_json()
         self.created_by.publish()
 
     def delete(self, *args, **kwargs):
         super(BackpackCollection, self).delete(*args, **kwargs)
         self.publish_delete('share_hash')
+        self.invalidate_cached_json()
         self.created_by.publish()
 
     def save(self, **kwargs):
         if self.pk:
-            BackpackCollectionBadgeInstance.objects.filter(
+            # drop this collection's rejected or revoked badges; other collections are cleaned when they are saved
+            BackpackCollectionBadgeInstance.objects.filter(collection=self).filter(
                 Q(badgeinstance__acceptance=BadgeInstance.ACCEPTANCE_REJECTED) | Q(badgeinstance__revoked=True)
             ).delete()
         super(BackpackCollection, self).save(**kwargs)
@@ -63,6 +71,25 @@ class BackpackCollection(BaseAuditedModelDeletedWithUser, BaseVersionedEntity):
             badgeinstance__acceptance__in=(BadgeInstance.ACCEPTANCE_ACCEPTED,BadgeInstance.ACCEPTANCE_UNACCEPTED)
         )
 
+    @cachemodel.cached_method(auto_publish=True)
+    def cached_preview(self):
+        """
+        The opengraph data served to bots, recomputed whenever the collection is published.
+        """
+        preview = {
+            'title': self.name,
+            'description': self.description,
+            'public_url': self.share_url,
+            'image_url': '',
+        }
+        first_assertion_id = self.assertions.filter(
+            revoked=False,
+            acceptance__in=(BadgeInstance.ACCEPTANCE_ACCEPTED, BadgeInstance.ACCEPTANCE_UNACCEPTED)
+        ).order_by('issued_on', 'pk').values_list('entity_id', flat=True).first()
+        if first_assertion_id is not None:
+            preview['image_url'] = PublicUrl.url('badgeinstance_image', first_assertion_id) + '?type=png'
+        return preview
+
     @property
     def owner(self):
         from badgeuser.models import BadgeUser
@@ -79,12 +106,13 @@ class BackpackCollection(BaseAuditedModelDeletedWithUser, BaseVersionedEntity):
             self.share_hash = str(binascii.hexlify(os.urandom(16)), 'utf-8')
         elif not value and self.share_hash:
             self.publish_delete('share_hash')
+            self.invalidate_cached_json()
             self.share_hash = ''
 
     @property
     def share_url(self):
         if self.published:
-            return OriginSetting.HTTP+reverse('collection_json', kwargs={'entity_id': self.share_hash})
+            return PublicUrl.url('collection_json', self.share_hash)
 
     def get_share_url(self, **kwargs):
         return self.share_url
@@ -99,41 +127,40 @@ class BackpackCollection(BaseAuditedModelDeletedWithUser, BaseVersionedEntity):
         Update this collection's list of BackpackCollectionBadgeInstance from a list of BadgeInstance EntityRelatedFieldV2 serializer data
         :param value: list of BadgeInstance instances or list of BadgeInstance entity_id strings.
         """
-        def _is_in_requested_badges(entity_id):
-            if entity_id in value:
-                return True
-            try:
-                if entity_id in [i.entity_id for i in value]:
-                    return True
-            except AttributeError:
-                pass
-            return False
+        requested_ids = []
+        requested_entity_ids = []
+        for badge_reference in value:
+            if isinstance(badge_reference, BadgeInstance):
+                requested_ids.append(badge_reference.pk)
+            else:
+                requested_entity_ids.append(badge_reference)
+        if requested_entity_ids:
+            # unknown entity_ids are ignored
+            pks_by_entity_id = dict(BadgeInstance.objects.filter(
+                entity_id__in=requested_entity_ids).values_list('entity_id', 'pk'))
+            requested_ids.extend(pks_by_entity_id[e] for e in requested_entity_ids if e in pks_by_entity_id)
+        requested_ids = list(OrderedDict.fromkeys(requested_ids))
 
         with transaction.atomic():
-            existing_badges = {b.entity_id: b for b in self.badge_items}
+            existing_ids = set(BackpackCollectionBadgeInstance.objects.filter(
+                collection=self).values_list('badgeinstance_id', flat=True))
+
             # add missing badges
-            for badge_reference in value:
-                try:
-                    if isinstance(badge_reference, BadgeInstance):
-                        badgeinstance = badge_reference
-                    else:
-                        badgeinstance = BadgeInstance.cached.get(entity_id=badge_reference)
-                except BadgeInstance.DoesNotExist:
-                    pass
-                else:
-                    if badgeinstance.entity_id not in list(existing_badges.keys()):
-                        BackpackCollectionBadgeInstance.cached.get_or_create(
-                            collection=self,
-                            badgeinstance=badgeinstance
-                        )
+            BackpackCollectionBadgeInstance.objects.bulk_create([
+                BackpackCollectionBadgeInstance(collection=self, badgeinstance_id=badgeinstance_id)
+                for badgeinstance_id in requested_ids if badgeinstance_id not in existing_ids
+            ])
 
             # remove badges no longer in collection
-            for badge_entity_id, badgeinstance in list(existing_badges.items()):
-                if not _is_in_requested_badges(badge_entity_id):
-                    BackpackCollectionBadgeInstance.objects.filter(
-                        collection=self,
-                        badgeinstance=badgeinstance
-                    ).delete()
+            removed_ids = existing_ids.difference(requested_ids)
+            if removed_ids:
+                BackpackCollectionBadgeInstance.objects.filter(
+                    collection=self,
+                    badgeinstance_id__in=removed_ids
+                ).delete()
+
+        # bulk_create and queryset deletes skip BackpackCollectionBadgeInstance.publish
+        self.publish()
 
     def get_json(self, obi_version=CURRENT_OBI_VERSION, expand_badgeclass=False, expand_issuer=False, include_extra=True):
         obi_version, context_iri = get_obi_context(obi_version)
@@ -157,6 +184,33 @@ class BackpackCollection(BaseAuditedModelDeletedWithUser, BaseVersionedEntity):
 
         return json
 
+    @staticmethod
+    def _json_cache_key(share_hash, obi_version, expand_badgeclass, expand_issuer):
+        return "backpack_collection_json_{}_{}_{:d}{:d}".format(share_hash, obi_version, expand_badgeclass, expand_issuer)
+
+    def get_cached_json(self, obi_version=CURRENT_OBI_VERSION, expand_badgeclass=False, expand_issuer=False):
+        """
+        The public get_json() document of a shared collection, rendered once per obi version and expansion until the
+        collection or one of its assertions is published. Edits to an expanded badgeclass or issuer do not publish the
+        collection, so they show up once BACKPACK_COLLECTION_JSON_CACHE_TIMEOUT expires.
+        """
+        obi_version, context_iri = get_obi_context(obi_version)
+        key = self._json_cache_key(self.share_hash, obi_version, expand_badgeclass, expand_issuer)
+        json = cache.get(key)
+        if json is None:
+            json = self.get_json(obi_version=obi_version, expand_badgeclass=expand_badgeclass, expand_issuer=expand_issuer)
+            cache.set(key, json, timeout=getattr(settings, 'BACKPACK_COLLECTION_JSON_CACHE_TIMEOUT', 3600))
+        return json
+
+    def invalidate_cached_json(self):
+        if self.share_hash:
+            cache.delete_many([
+                self._json_cache_key(self.share_hash, obi_version, expand_badgeclass, expand_issuer)
+                for obi_version in OBI_VERSION_CONTEXT_IRIS
+                for expand_badgeclass in (False, True)
+                for expand_issuer in (False, True)
+            ])
+
     @property
     def cached_badgrapp(self):
         creator = self.cached_creator
@@ -190,6 +244,92 @@ class BackpackCollectionBadgeInstance(cachemodel.CacheModel):
         return BackpackCollection.cached.get(id=self.collection_id)
 
 
+class BackpackImportJob(BaseAuditedModelDeletedWithUser, BaseVersionedEntity):
+    """
+    A badge import that is verified and saved by backpack.tasks.run_badge_import instead of inside the request.
+    Exactly one of url, image or assertion is set.
+    """
+    entity_class_name = 'BackpackImportJob'
+
+    STATUS_PENDING = 'Pending'
+    STATUS_RUNNING = 'Running'
+    STATUS_SUCCEEDED = 'Succeeded'
+    STATUS_FAILED = 'Failed'
+    STATUS_CHOICES = (
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_SUCCEEDED, 'Succeeded'),
+        (STATUS_FAILED, 'Failed'),
+    )
+    UNFINISHED_STATUSES = (STATUS_PENDING, STATUS_RUNNING)
+
+    status = models.CharField(max_length=254, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    url = models.URLField(max_length=1024, blank=True, null=True)
+    image = models.FileField(upload_to='uploads/imports', blank=True, null=True)
+    assertion = JSONField(blank=True, null=True)
+    badgeinstance = models.ForeignKey('issuer.BadgeInstance', blank=True, null=True, related_name='+',
+                                      on_delete=models.SET_NULL)
+    errors = JSONField(blank=True, null=True)
+
+    cached = SlugOrJsonIdCacheModelManager(slug_kwarg_name='entity_id', slug_field_name='entity_id')
+
+    @property
+    def finished(self):
+        return self.status not in self.UNFINISHED_STATUSES
+
+    @property
+    def status_url(self):
+        return OriginSetting.HTTP + reverse('v2_api_backpack_import_job', kwargs={'entity_id': self.entity_id})
+
+    @property
+    def cached_badgeinstance(self):
+        if self.badgeinstance_id:
+            return BadgeInstance.cached.get(id=self.badgeinstance_id)
+
+    def run(self):
+        """
+        Verify and save the requested badge the way BackpackImportSerializerV2 does, recording the outcome on this job.
+        """
+        from issuer.helpers import BadgeCheckHelper
+
+        self.status = self.STATUS_RUNNING
+        self.save()
+
+        try:
+            if self.image:
+                self.image.open('rb')
+            instance, created = BadgeCheckHelper.get_or_create_assertion(
+                url=self.url or None,
+                imagefile=self.image if self.image else None,
+                assertion=self.assertion or None,
+                created_by=self.created_by)
+        except ValidationError as e:
+            self.status = self.STATUS_FAILED
+            self.errors = e.messages
+        else:
+            if not created and instance.acceptance == BadgeInstance.ACCEPTANCE_ACCEPTED:
+                self.status = self.STATUS_FAILED
+                self.errors = [{'name': "DUPLICATE_BADGE", 'description': "You already have this badge in your backpack"}]
+            else:
+                if not created:
+                    instance.acceptance = BadgeInstance.ACCEPTANCE_ACCEPTED
+                    instance.save()
+                self.status = self.STATUS_SUCCEEDED
+            self.badgeinstance = instance
+        finally:
+            if self.image:
+                # the upload is only needed for verification
+                self.image.delete(save=False)
+
+        self.save()
+        return self.badgeinstance
+
+    def fail(self, name, description):
+        self.status = self.STATUS_FAILED
+        self.errors = [{'name': name, 'description': description}]
+        self.save()
+
+
 class BaseSharedModel(cachemodel.CacheModel, CreatedUpdatedAt):
     SHARE_PROVIDERS = [(p.provider_code, p.provider_name) for code,p in list(SharingManager.ManagerProviders.items())]
     provider = models.CharField(max_length=254, choices=SHARE_PROVIDERS)
@@ -28,7 +28,7 @@ class LocalBadgeInstanceUploadSerializerV1(serializers.Serializer):
     acceptance = serializers.CharField(default='Accepted')
     narrative = MarkdownCharField(required=False, read_only=True)
     evidence_items = EvidenceItemSerializer(many=True, required=False, read_only=True)
-    pending = serializers.ReadOnlyField()
+    pending = serializers.SerializerMethodField()
 
     extensions = serializers.DictField(source='extension_items', read_only=True)
 
@@ -36,6 +36,9 @@ class LocalBadgeInstanceUploadSerializerV1(serializers.Serializer):
     # id = serializers.IntegerField(read_only=True)
     # json = V1InstanceSerializer(read_only=True)
 
+    def get_pending(self, obj):
+        return obj.is_pending(self.context.get('verified_recipient_identifiers'))
+
     def to_representation(self, obj):
         """
         If the APIView initialized the serializer with the extra context
@@ -7,7 +7,7 @@ from django.core.exceptions import ValidationError as DjangoValidationError
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError as RestframeworkValidationError
 
-from backpack.models import BackpackCollection
+from backpack.models import BackpackCollection, BackpackImportJob
 from badgeuser.models import BadgeUser
 from entity.serializers import DetailSerializerV2, EntityRelatedFieldV2
 from issuer.helpers import BadgeCheckHelper
@@ -36,7 +36,7 @@ class BackpackAssertionSerializerV2(DetailSerializerV2, OriginalJsonSerializerMi
     revoked = HumanReadableBooleanField(read_only=True)
     revocationReason = serializers.CharField(source='revocation_reason', read_only=True)
     expires = DateTimeWithUtcZAtEndField(source='expires_at', required=False)
-    pending = serializers.ReadOnlyField()
+    pending = serializers.SerializerMethodField()
 
     class Meta(DetailSerializerV2.Meta):
         model = BadgeInstance
@@ -148,6 +148,9 @@ class BackpackAssertionSerializerV2(DetailSerializerV2, OriginalJsonSerializerMi
             ])
         })
 
+    def get_pending(self, obj):
+        return obj.is_pending(self.context.get('verified_recipient_identifiers'))
+
     def to_representation(self, instance):
         representation = super(BackpackAssertionSerializerV2, self).to_representation(instance)
         request_kwargs = self.context['kwargs']
@@ -275,3 +278,46 @@ class BackpackImportSerializerV2(DetailSerializerV2):
         except DjangoValidationError as e:
             raise RestframeworkValidationError(e.messages)
         return instance
+
+
+class BackpackImportJobSerializerV2(DetailSerializerV2):
+    status = serializers.CharField(read_only=True)
+    createdAt = DateTimeWithUtcZAtEndField(source='created_at', read_only=True)
+    assertion = EntityRelatedFieldV2(source='cached_badgeinstance', read_only=True)
+    errors = serializers.JSONField(read_only=True)
+
+    class Meta(DetailSerializerV2.Meta):
+        model = BackpackImportJob
+        apispec_definition = ('BackpackImportJob', {
+            'properties': OrderedDict([
+                ('entityId', {
+                    'type': "string",
+                    'format': "string",
+                    'description': "Unique identifier for this import",
+                }),
+                ('entityType', {
+                    'type': "string",
+                    'format': "string",
+                    'description': "\"BackpackImportJob\"",
+                }),
+                ('status', {
+                    'type': "string",
+                    'enum': [s[0] for s in BackpackImportJob.STATUS_CHOICES],
+                    'description': "Progress of the import",
+                }),
+                ('createdAt', {
+                    'type': 'string',
+                    'format': 'ISO8601 timestamp',
+                    'description': "Timestamp when the import was requested",
+                }),
+                ('assertion', {
+                    'type': 'string',
+                    'format': 'entityId',
+                    'description': "The imported Assertion, once the import has succeeded",
+                }),
+                ('errors', {
+                    'type': 'array',
+                    'description': "Why the import failed",
+                }),
+            ])
+        })
@@ -0,0 +1,80 @@
+# encoding: utf-8
+import datetime
+
+from celery.exceptions import SoftTimeLimitExceeded
+from celery.utils.log import get_task_logger
+from django.conf import settings
+from django.utils import timezone
+from rest_framework.exceptions import Throttled
+
+from mainsite.celery import app
+
+logger = get_task_logger(__name__)
+
+# run imports on a dedicated queue so slow remote hosts only tie up the workers consuming it; its worker --concurrency
+# bounds how many imports fetch at once
+badge_import_task_queue_name = getattr(settings, 'BADGE_IMPORT_TASK_QUEUE_NAME', 'default')
+
+
+def enqueue_badge_import(created_by, url=None, image=None, assertion=None):
+    """
+    Create a BackpackImportJob for one of url, image or assertion and schedule run_badge_import for it.
+
+    Raises rest_framework.exceptions.Throttled if created_by already has BADGE_IMPORT_MAX_UNFINISHED_PER_USER imports
+    waiting or running. Jobs older than BADGE_IMPORT_TIME_LIMIT plus BADGE_IMPORT_QUEUE_SLACK seconds don't count: their
+    worker was killed or the task was lost, and they would otherwise hold the user's quota forever.
+    """
+    from backpack.models import BackpackImportJob
+
+    max_unfinished = getattr(settings, 'BADGE_IMPORT_MAX_UNFINISHED_PER_USER', 10)
+    abandoned_after = datetime.timedelta(seconds=(
+        getattr(settings, 'BADGE_IMPORT_TIME_LIMIT', 90) + getattr(settings, 'BADGE_IMPORT_QUEUE_SLACK', 60 * 10)))
+    unfinished = BackpackImportJob.objects.filter(
+        created_by=created_by, status__in=BackpackImportJob.UNFINISHED_STATUSES,
+        created_at__gte=timezone.now() - abandoned_after).count()
+    if unfinished >= max_unfinished:
+        raise Throttled(detail="Too many badge imports in progress, try again when they have finished.")
+
+    job = BackpackImportJob(created_by=created_by, url=url, assertion=assertion)
+    if image is not None:
+        job.image.save(image.name, image, save=False)
+    job.save()
+
+    run_badge_import.delay(job_pk=job.pk)
+    return job
+
+
+@app.task(bind=True, queue=badge_import_task_queue_name,
+          soft_time_limit=getattr(settings, 'BADGE_IMPORT_SOFT_TIME_LIMIT', 60),
+          time_limit=getattr(settings, 'BADGE_IMPORT_TIME_LIMIT', 90),
+          rate_limit=getattr(settings, 'BADGE_IMPORT_RATE_LIMIT', None))
+def run_badge_import(self, job_pk):
+    from backpack.models import BackpackImportJob
+
+    try:
+        job = BackpackImportJob.objects.get(pk=job_pk)
+    except BackpackImportJob.DoesNotExist:
+        return {
+            'success': False,
+            'error': "Unknown import job pk={}".format(job_pk)
+        }
+
+    if job.status != BackpackImportJob.STATUS_PENDING:
+        return {
+            'success': False,
+            'error': "Import job {} is already {}".format(job.entity_id, job.status)
+        }
+
+    try:
+        job.run()
+    except SoftTimeLimitExceeded:
+        job.fail('IMPORT_TIMEOUT', "Verifying the badge took too long")
+    except Exception:
+        logger.exception("Badge import job {} failed".format(job.entity_id))
+        job.fail('IMPORT_FAILED', "Unable to import the badge")
+
+    return {
+        'success': job.status == BackpackImportJob.STATUS_SUCCEEDED,
+        'job': job.entity_id,
+        'status': job.status,
+    }
@@ -7,13 +7,17 @@ import os
 import dateutil.parser
 import responses
 import mock
-from django.db import IntegrityError
+from django.core.cache import cache
+from django.db import IntegrityError, connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from openbadges.verifier.openbadges_context import (OPENBADGES_CONTEXT_V2_URI, OPENBADGES_CONTEXT_V1_URI,
                                                     OPENBADGES_CONTEXT_V2_DICT)
 from openbadges_bakery import bake, unbake
 
-from backpack.models import BackpackBadgeShare
+from backpack.models import BackpackBadgeShare, BackpackImportJob
 from badgeuser.models import CachedEmailAddress, UserRecipientIdentifier
 from issuer.models import BadgeClass, Issuer, BadgeInstance
 from mainsite.tests.base import BadgrTestCase, SetupIssuerHelper
@@ -815,6 +819,60 @@ class TestBadgeUploads(BadgrTestCase):
         self.assertEqual(len(get_response.data), 0, "The backpack should be empty")
         self.assertEqual(BadgeInstance.objects.count(), 0)
 
+    @responses.activate
+    def test_can_import_badge_asynchronously(self):
+        setup_resources([
+            {'url': 'http://a.com/assertion-embedded1', 'filename': '2_0_assertion_embedded_badgeclass.json'},
+            {'url': OPENBADGES_CONTEXT_V2_URI, 'response_body': json.dumps(OPENBADGES_CONTEXT_V2_DICT)},
+            {'url': 'http://a.com/badgeclass_image', 'filename': "unbaked_image.png", 'mode': 'rb'},
+        ])
+        test_user = self.setup_user(email='verified@example.com', authenticate=True)
+        CachedEmailAddress.objects.add_email(test_user, 'test@example.com')
+
+        with mock.patch('mainsite.blacklist.api_query_is_in_blacklist',
+                        new=lambda a, b: False):
+            response = self.client.post('/v2/backpack/import', {'url': 'http://a.com/assertion-embedded1'},
+                                        format='json', HTTP_PREFER='respond-async')
+        self.assertEqual(response.status_code, 202)
+        job_url = response['Location']
+        self.assertIn(response.data['result'][0]['entityId'], job_url)
+
+        # tasks run eagerly under test, so the import has already finished
+        response = self.client.get(job_url)
+        self.assertEqual(response.status_code, 200)
+        job = response.data['result'][0]
+        self.assertEqual(job['status'], BackpackImportJob.STATUS_SUCCEEDED)
+        self.assertEqual(job['assertion'], BadgeInstance.objects.get().entity_id)
+
+        response = self.client.post('/v2/backpack/import', {'url': 'http://a.com/missing-assertion'},
+                                    format='json', HTTP_PREFER='respond-async')
+        self.assertEqual(response.status_code, 202)
+        job = self.client.get(response['Location']).data['result'][0]
+        self.assertEqual(job['status'], BackpackImportJob.STATUS_FAILED)
+        self.assertIsNone(job['assertion'])
+        self.assertTrue(job['errors'])
+
+        self.setup_user(email='other@example.com', authenticate=True)
+        response = self.client.get(job_url)
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(BADGE_IMPORT_MAX_UNFINISHED_PER_USER=1)
+    def test_abandoned_import_jobs_dont_count_against_limit(self):
+        test_user = self.setup_user(email='test@example.com', authenticate=True)
+        job = BackpackImportJob.objects.create(created_by=test_user, url='http://a.com/stuck')
+
+        with mock.patch('backpack.tasks.run_badge_import.delay'):
+            response = self.client.post('/v2/backpack/import', {'url': 'http://a.com/assertion'},
+                                        format='json', HTTP_PREFER='respond-async')
+            self.assertEqual(response.status_code, 429)
+
+            BackpackImportJob.objects.filter(pk=job.pk).update(
+                created_at=timezone.now() - datetime.timedelta(days=1))
+            response = self.client.post('/v2/backpack/import', {'url': 'http://a.com/assertion'},
+                                        format='json', HTTP_PREFER='respond-async')
+            self.assertEqual(response.status_code, 202)
+
+
 class TestDeleteLocalAssertion(BadgrTestCase, SetupIssuerHelper):
     @responses.activate
     def test_can_delete_local(self):
@@ -1248,3 +1306,54 @@ class TestInclusionFlags(BadgrTestCase, SetupIssuerHelper):
         self.assertEqual(result.status_code, 200)
         self.assertEqual(len(result.data.get('result')), 1)
 
+    def test_backpack_list_cursor_pagination(self):
+        test_user = self.setup_user(email='test@example.com', authenticate=True)
+        test_issuer_one = self.setup_issuer(name="Test Issuer 1", owner=test_user)
+        test_badgeclass_one = self.setup_badgeclass(name='Test Badgeclass 1', issuer=test_issuer_one)
+        assertions = [test_badgeclass_one.issue(recipient_id='test@example.com', recipient_type='email')
+                      for _ in range(3)]
+
+        result = self.client.get('/v2/backpack/assertions?num=2')
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual([a['entityId'] for a in result.data.get('result')], [a.entity_id for a in assertions[:2]])
+        self.assertIn('rel="next"', result['Link'])
+
+        next_url = result['Link'].split('>; rel="next"')[0].lstrip('<')
+        result = self.client.get(next_url)
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual([a['entityId'] for a in result.data.get('result')], [assertions[2].entity_id])
+
+    def test_backpack_list_identifier_lookups_dont_grow_with_assertions(self):
+        test_user = self.setup_user(email='test@example.com', authenticate=True)
+        test_issuer = self.setup_issuer(owner=test_user)
+        test_badgeclass = self.setup_badgeclass(issuer=test_issuer)
+        identifier_tables = (CachedEmailAddress._meta.db_table, UserRecipientIdentifier._meta.db_table)
+
+        def list_identifier_queries():
+            # pending used to look up each assertion's identifier, which is only a query once the cache is cold
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                result = self.client.get('/v2/backpack/assertions?include_pending=true')
+            self.assertEqual(result.status_code, 200)
+            return result.data['result'], [q for q in queries.captured_queries
+                                           if any(table in q['sql'] for table in identifier_tables)]
+
+        def issue_to_new_email(i, verified=True):
+            email = 'test{}@example.com'.format(i)
+            CachedEmailAddress(email=email, verified=verified, user=test_user).save()
+            return test_badgeclass.issue(recipient_id=email)
+
+        for i in range(2):
+            issue_to_new_email(i)
+        small_list, small_queries = list_identifier_queries()
+
+        for i in range(2, 6):
+            issue_to_new_email(i)
+        imported = issue_to_new_email(6, verified=False)
+        BadgeInstance.objects.filter(pk=imported.pk).update(source_url='http://a.com/imported-assertion')
+        large_list, large_queries = list_identifier_queries()
+
+        self.assertEqual(len(small_list), 2)
+        self.assertEqual(len(large_list), 7)
+        self.assertEqual(len(large_queries), len(small_queries))
+        self.assertEqual([a['entityId'] for a in large_list if a['pending']], [imported.entity_id])
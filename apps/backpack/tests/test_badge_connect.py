@@ -3,6 +3,7 @@ import base64
 import hashlib
 import json
 import random
+import re
 import string
 from urllib import parse
 
@@ -401,6 +402,9 @@ class BadgeConnectAPITests(BadgrTestCase, SetupIssuerHelper):
         self.assertJSONEqual(force_text(response.content), expected_response)
 
 
+    def link_header(self, response):
+        return {rel: url for url, rel in re.findall(r'<([^>]+)>; rel="(\w+)"', response['Link'])}
+
     def test_assertions_pagination(self):
         self.user = self.setup_user(authenticate=True)
 
@@ -414,48 +418,51 @@ class BadgeConnectAPITests(BadgrTestCase, SetupIssuerHelper):
                 test_badgeclass = self.setup_badgeclass(issuer=test_issuer)
                 assertions.append(test_badgeclass.issue(self.user.email,
                                                         notify=False))
-        response = self.client.get('/bcv1/assertions?limit=10&offset=0')
-        self.assertEqual(len(response.data['results']), 10)
-        self.assertTrue(response.has_header('Link'))
-        self.assertTrue('<http://testserver/bcv1/assertions?limit=10&offset=10>; rel="next"' in response['Link'])
-        self.assertTrue('<http://testserver/bcv1/assertions?limit=10&offset=20>; rel="last"' in response['Link'])
-        self.assertTrue('<http://testserver/bcv1/assertions?limit=10&offset=0>; rel="first"' in response['Link'])
-        for x in range(0, 10):
-            self.assertEqual(response.data['results'][x]['id'], assertions[24 - x].jsonld_id)
+        newest_first = [a.jsonld_id for a in reversed(assertions)]
 
+        response = self.client.get('/bcv1/assertions?limit=10&offset=0')
+        self.assertEqual([r['id'] for r in response.data['results']], newest_first[:10])
+        self.assertEqual(response['X-Total-Count'], '25')
+        links = self.link_header(response)
+        self.assertEqual(links['first'], 'http://testserver/bcv1/assertions?limit=10&offset=0')
+        self.assertNotIn('prev', links)
+        last_link = links['last']
+
+        # next and prev links are keyset cursors
+        response = self.client.get(links['next'])
+        self.assertEqual([r['id'] for r in response.data['results']], newest_first[10:20])
+        links = self.link_header(response)
+        self.assertIn('cursor=', links['next'])
+        self.assertIn('prev', links)
+
+        response = self.client.get(links['next'])
+        self.assertEqual([r['id'] for r in response.data['results']], newest_first[20:])
+        links = self.link_header(response)
+        self.assertNotIn('next', links)
+
+        response = self.client.get(links['prev'])
+        self.assertEqual([r['id'] for r in response.data['results']], newest_first[10:20])
+
+        response = self.client.get(last_link)
+        self.assertEqual([r['id'] for r in response.data['results']], newest_first[20:])
+        self.assertNotIn('next', self.link_header(response))
+
+        # offsets are still honored
         response = self.client.get('/bcv1/assertions?limit=10&offset=10')
-        self.assertEqual(len(response.data['results']), 10)
-        self.assertTrue(response.has_header('Link'))
-        self.assertTrue('<http://testserver/bcv1/assertions?limit=10&offset=20>; rel="next"' in response['Link'])
-        self.assertTrue('<http://testserver/bcv1/assertions?limit=10&offset=20>; rel="last"' in response['Link'])
-        self.assertTrue('<http://testserver/bcv1/assertions?limit=10&offset=0>; rel="first"' in response['Link'])
-        self.assertTrue('<http://testserver/bcv1/assertions?limit=10&offset=0>; rel="prev"' in response['Link'])
-        for x in range(0, 10):
-            self.assertEqual(response.data['results'][x]['id'], assertions[24 - (x + 10)].jsonld_id)
-
-        response = self.client.get('/bcv1/assertions?limit=10&offset=20')
-        self.assertEqual(len(response.data['results']), 5)
-        self.assertTrue(response.has_header('Link'))
-        self.assertTrue('<http://testserver/bcv1/assertions?limit=10&offset=20>; rel="last"' in response['Link'])
-        self.assertTrue('<http://testserver/bcv1/assertions?limit=10&offset=0>; rel="first"' in response['Link'])
-        self.assertTrue('<http://testserver/bcv1/assertions?limit=10&offset=10>; rel="prev"' in response['Link'])
-        for x in range(0, 5):
-            self.assertEqual(response.data['results'][x]['id'], assertions[24 - (x + 20)].jsonld_id)
+        self.assertEqual([r['id'] for r in response.data['results']], newest_first[10:20])
+        self.assertIn('prev', self.link_header(response))
+
+        response = self.client.get('/bcv1/assertions?limit=10&cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 404)
 
         since = parse.quote(DateTimeField().to_representation(assertions[5].created_at))
         response = self.client.get('/bcv1/assertions?limit=10&offset=0&since=' + since)
-        self.assertEqual(len(response.data['results']), 10)
-        self.assertTrue('<http://testserver/bcv1/assertions?limit=10&offset=10&since=%s>; rel="next"' % since in response['Link'])
-        self.assertTrue('<http://testserver/bcv1/assertions?limit=10&offset=10&since=%s>; rel="last"' % since in response['Link'])
-        self.assertTrue('<http://testserver/bcv1/assertions?limit=10&offset=0&since=%s>; rel="first"' % since in response['Link'])
-        for x in range(0, 10):
-            self.assertEqual(response.data['results'][x]['id'], assertions[24 - x].jsonld_id)
-
-        response = self.client.get('/bcv1/assertions?limit=10&offset=10&since=' + since)
-        self.assertEqual(len(response.data['results']), 10)
-        self.assertTrue(response.has_header('Link'))
-        self.assertTrue('<http://testserver/bcv1/assertions?limit=10&offset=10&since=%s>; rel="last"' % since in response['Link'])
-        self.assertTrue('<http://testserver/bcv1/assertions?limit=10&offset=0&since=%s>; rel="first"' % since in response['Link'])
-        self.assertTrue('<http://testserver/bcv1/assertions?limit=10&offset=0&since=%s>; rel="prev"' % since in response['Link'])
-        for x in range(0, 10):
-            self.assertEqual(response.data['results'][x]['id'], assertions[24 - (x + 10)].jsonld_id)
+        self.assertEqual([r['id'] for r in response.data['results']], newest_first[:10])
+        self.assertEqual(response['X-Total-Count'], '20')
+        links = self.link_header(response)
+        self.assertIn('since=%s' % since, links['next'])
+        self.assertTrue(links['first'].endswith('offset=0&since=%s' % since))
+
+        response = self.client.get(links['next'])
+        self.assertEqual([r['id'] for r in response.data['results']], newest_first[10:20])
+        self.assertNotIn('next', self.link_header(response))
@@ -1,3 +1,6 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
 from badgeuser.models import BadgeUser, CachedEmailAddress
 from issuer.models import BadgeClass, Issuer, BadgeInstance
 from mainsite.tests.base import BadgrTestCase
@@ -270,6 +273,39 @@ class TestCollections(BadgrTestCase):
         self.assertEqual(collection.cached_badgeinstances().count(), 2)
         self.assertEqual([i.entity_id for i in collection.cached_badgeinstances()], [self.local_badge_instance_2.entity_id, self.local_badge_instance_3.entity_id])
 
+    def test_collection_badge_sync_is_set_based(self):
+        small_collection, collection = BackpackCollection.objects.all()[1:3]
+        badges = [BadgeInstance.objects.create(
+            recipient_identifier="test@example.com",
+            badgeclass=self.badge_class,
+            issuer=self.issuer,
+            image="uploads/badges/local_badgeinstance_174e70bf-b7a8-4b71-8125-c34d1a994a7c.png",
+            acceptance=BadgeInstance.ACCEPTANCE_ACCEPTED
+        ) for i in range(30)]
+        small_collection.badge_items = [b.entity_id for b in badges[:2]]
+        collection.badge_items = [b.entity_id for b in badges[:20]]
+
+        # the number of queries does not depend on the size of the collection
+        with CaptureQueriesContext(connection) as small_sync:
+            small_collection.badge_items = [b.entity_id for b in badges[1:3]]
+        with CaptureQueriesContext(connection) as large_sync:
+            collection.badge_items = [b.entity_id for b in badges[10:30]]
+        self.assertEqual(len(large_sync.captured_queries), len(small_sync.captured_queries))
+        self.assertEqual(set(i.entity_id for i in collection.cached_badgeinstances()),
+                         set(b.entity_id for b in badges[10:30]))
+        self.assertEqual(set(i.entity_id for i in small_collection.cached_badgeinstances()),
+                         set(b.entity_id for b in badges[1:3]))
+
+    def test_saving_a_collection_only_cleans_its_own_badges(self):
+        BackpackCollectionBadgeInstance.objects.create(collection=self.collection, badgeinstance=self.local_badge_instance_1)
+        other_collection = BackpackCollection.objects.exclude(pk=self.collection.pk).first()
+        BackpackCollectionBadgeInstance.objects.create(collection=other_collection, badgeinstance=self.local_badge_instance_1)
+        BadgeInstance.objects.filter(pk=self.local_badge_instance_1.pk).update(revoked=True)
+
+        self.collection.save()
+        self.assertFalse(BackpackCollectionBadgeInstance.objects.filter(collection=self.collection).exists())
+        self.assertTrue(BackpackCollectionBadgeInstance.objects.filter(collection=other_collection).exists())
+
     def test_can_add_remove_collection_badges_via_collection_detail_api(self):
         """
         A PUT request to the CollectionDetail view should be able to update the list of badges
@@ -5,10 +5,11 @@ from django.conf.urls import url
 
 from backpack.api import BackpackAssertionList, BackpackAssertionDetail, BackpackCollectionList, \
     BackpackCollectionDetail, BackpackAssertionDetailImage, BackpackImportBadge, ShareBackpackCollection, \
-    ShareBackpackAssertion
+    ShareBackpackAssertion, BackpackImportJobDetail
 
 urlpatterns = [
     url(r'^import$', BackpackImportBadge.as_view(), name='v2_api_backpack_import_badge'),
+    url(r'^import/(?P<entity_id>[^/]+)$', BackpackImportJobDetail.as_view(), name='v2_api_backpack_import_job'),
 
     url(r'^assertions$', BackpackAssertionList.as_view(), name='v2_api_backpack_assertion_list'),
     url(r'^assertions/(?P<entity_id>[^/]+)$', BackpackAssertionDetail.as_view(), name='v2_api_backpack_assertion_detail'),
@@ -25,6 +25,7 @@ from entity.models import BaseVersionedEntity
 from issuer.models import Issuer, BadgeInstance, BaseAuditedModel, BaseAuditedModelDeletedWithUser
 from badgeuser.managers import CachedEmailAddressManager, BadgeUserManager
 from badgeuser.utils import generate_badgr_username
+from mainsite.cached_collections import cached_pk_list
 from mainsite.models import ApplicationInfo
 
 
@@ -445,7 +446,7 @@ class BadgeUser(BaseVersionedEntity, AbstractUser, cachemodel.CacheModel):
     def cached_badgeclasses(self):
         return chain.from_iterable(issuer.cached_badgeclasses() for issuer in self.cached_issuers())
 
-    @cachemodel.cached_method(auto_publish=True)
+    @cached_pk_list(auto_publish=True)
     def cached_badgeinstances(self):
         return BadgeInstance.objects.filter(recipient_identifier__in=self.all_recipient_identifiers)
 
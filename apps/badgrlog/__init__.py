@@ -1,5 +1,6 @@
 # Created by wiggins@concentricsky.com on 8/27/15.
 
 from .badgrlogger import BadgrLogger
+from .pipeline import pipeline_stats  # noqa: F401
 from .events import *
 
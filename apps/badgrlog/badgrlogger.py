@@ -1,17 +1,32 @@
 # Created by wiggins@concentricsky.com on 8/27/15.
 
 import logging
+import random
+
+from django.conf import settings
+
 from .events.base import BaseBadgrEvent
+from .pipeline import get_event_pipeline
 
 
 class BadgrLogger(object):
     def __init__(self, name='Badgr.Events'):
+        self.name = name
         self.logger = logging.getLogger(name)
 
     def event(self, event):
         if not isinstance(event, BaseBadgrEvent):
             raise NotImplementedError()
-        obj = event.compacted()
-        self.logger.info(obj)
 
+        pipeline = get_event_pipeline()
+        sample_rate = getattr(settings, 'BADGRLOG_SAMPLE_RATES', {}).get(event.get_type(), 1.0)
+        if sample_rate < 1.0 and random.random() >= sample_rate:
+            if pipeline is not None:
+                pipeline.sampled_out()
+            return
 
+        obj = event.compacted()
+        if pipeline is None:
+            self.logger.info(obj)
+        else:
+            pipeline.emit(self.name, obj)
@@ -0,0 +1,190 @@
+# encoding: utf-8
+"""
+Asynchronous delivery of badgr events.
+
+When the BADGRLOG_PIPELINE setting is present, BadgrLogger.event compacts the event and appends it to a bounded ring
+buffer instead of logging it. A background thread drains the buffer in batches into a sink, so handler and file I/O
+never happen on the request thread. If the buffer is full the oldest buffered event is dropped and counted.
+
+    BADGRLOG_PIPELINE = {
+        'SINK': 'badgrlog.pipeline.NDJSONFileSink',     # default: badgrlog.pipeline.LoggingSink
+        'OPTIONS': {'path': '/var/log/badgr/events.ndjson'},
+        'BUFFER_SIZE': 10000,
+        'BATCH_SIZE': 500,
+        'FLUSH_INTERVAL': 1.0,
+    }
+
+A sink is any class with a write(records) method taking a list of (logger_name, event_dict) tuples.
+
+Frequent events can be sampled with BADGRLOG_SAMPLE_RATES, a dict of event type to the fraction of those events to
+keep, e.g. {'BadgeClassImageRetrievedEvent': 0.1}. Sampling applies whether or not the pipeline is configured, and
+happens before an event is compacted.
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.utils.module_loading import import_string
+
+
+class LoggingSink(object):
+    """
+    Hands events to the stdlib logger they were emitted for, as BadgrLogger does when the pipeline is off.
+    """
+    def write(self, records):
+        for name, data in records:
+            logging.getLogger(name).info(data)
+
+
+class NDJSONFileSink(object):
+    """
+    Appends each event to a file as one line of json.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, records):
+        lines = ''.join(json.dumps(data, default=str) + '\n' for name, data in records)
+        with open(self.path, 'a') as f:
+            f.write(lines)
+
+
+class EventPipeline(object):
+    def __init__(self, sink, buffer_size=10000, batch_size=500, flush_interval=1.0):
+        self.sink = sink
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer = deque(maxlen=buffer_size)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self.counters = self._new_counters()
+
+    @staticmethod
+    def _new_counters():
+        return {
+            'emitted': 0,
+            'sampled_out': 0,
+            'dropped': 0,
+            'written': 0,
+            'sink_errors': 0,
+        }
+
+    def emit(self, logger_name, data):
+        with self._lock:
+            if len(self._buffer) == self._buffer.maxlen:
+                self.counters['dropped'] += 1
+            self._buffer.append((logger_name, data))
+            self.counters['emitted'] += 1
+            buffered = len(self._buffer)
+        self._ensure_thread()
+        if buffered >= self.batch_size:
+            self._wakeup.set()
+
+    def sampled_out(self):
+        with self._lock:
+            self.counters['sampled_out'] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['buffered'] = len(self._buffer)
+        return stats
+
+    def flush(self):
+        """
+        Write everything buffered so far to the sink.
+        """
+        while True:
+            with self._lock:
+                batch = [self._buffer.popleft() for i in range(min(self.batch_size, len(self._buffer)))]
+            if not batch:
+                return
+            try:
+                self.sink.write(batch)
+            except Exception:
+                with self._lock:
+                    self.counters['sink_errors'] += 1
+            else:
+                with self._lock:
+                    self.counters['written'] += len(batch)
+
+    def _ensure_thread(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='badgrlog-pipeline', daemon=True)
+                self._thread.start()
+
+    def _after_fork_in_child(self):
+        # the flush thread doesn't survive a fork, the parent may have held the lock while forking, and what's buffered
+        # belongs to the parent; the child starts over with its own
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._buffer = deque(maxlen=self._buffer.maxlen)
+        self._thread = None
+        self.counters = self._new_counters()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def get_event_pipeline():
+    """
+    :return: this process's EventPipeline, or None if BADGRLOG_PIPELINE isn't configured
+    """
+    global _pipeline
+    config = getattr(settings, 'BADGRLOG_PIPELINE', None)
+    if config is None:
+        return None
+    if _pipeline is None:
+        with _pipeline_lock:
+            if _pipeline is None:
+                sink_class = import_string(config.get('SINK', 'badgrlog.pipeline.LoggingSink'))
+                pipeline = EventPipeline(
+                    sink_class(**config.get('OPTIONS', {})),
+                    buffer_size=config.get('BUFFER_SIZE', 10000),
+                    batch_size=config.get('BATCH_SIZE', 500),
+                    flush_interval=config.get('FLUSH_INTERVAL', 1.0))
+                atexit.register(pipeline.flush)
+                _pipeline = pipeline
+    return _pipeline
+
+
+def pipeline_stats():
+    """
+    :return: the counters of this process's EventPipeline, or None if it isn't configured
+    """
+    pipeline = get_event_pipeline()
+    return pipeline.stats() if pipeline is not None else None
+
+
+def _reset_event_pipeline(setting, **kwargs):
+    global _pipeline
+    if setting == 'BADGRLOG_PIPELINE' and _pipeline is not None:
+        _pipeline.flush()
+        _pipeline = None
+
+
+def _after_fork_in_child():
+    global _pipeline_lock
+    _pipeline_lock = threading.Lock()
+    if _pipeline is not None:
+        _pipeline._after_fork_in_child()
+
+
+setting_changed.connect(_reset_event_pipeline)
+os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -29,6 +29,30 @@ class BaseEntityView(APIView):
             return self.v2_serializer_class
         return getattr(self, 'serializer_class', None)
 
+    def project_queryset(self, queryset, serializer_class=None):
+        """
+        Limit the columns loaded by queryset to those the serializer reads.
+
+        Serializers declare Meta.projected_fields (loaded with .only()) or Meta.deferred_fields (skipped with
+        .defer()). Touching a deferred field on an instance falls back to fetching it from the database.
+
+        The issuer serializers defer old_json, a legacy json column that can be large and that none of them read.
+        """
+        if not hasattr(queryset, 'defer'):
+            return queryset  # already evaluated or a cached list
+
+        if serializer_class is None:
+            serializer_class = self.get_serializer_class()
+        meta = getattr(serializer_class, 'Meta', None)
+
+        projected_fields = getattr(meta, 'projected_fields', None)
+        if projected_fields:
+            return queryset.only(*projected_fields)
+        deferred_fields = getattr(meta, 'deferred_fields', None)
+        if deferred_fields:
+            return queryset.defer(*deferred_fields)
+        return queryset
+
     def get_logger(self):
         if self.logger:
             return self.logger
@@ -198,7 +222,7 @@ class UncachedPaginatedViewMixin(object):
         raise NotImplementedError
 
     def get_objects(self, request, **kwargs):
-        queryset = self.get_queryset(request=request, **kwargs)
+        queryset = self.project_queryset(self.get_queryset(request=request, **kwargs))
         per_page = self.get_page_size(request)
 
         # only paginate on request
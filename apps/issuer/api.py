@@ -18,7 +18,7 @@ import badgrlog
 from entity.api import BaseEntityListView, BaseEntityDetailView, VersionedObjectMixin, BaseEntityView, \
     UncachedPaginatedViewMixin
 from entity.serializers import BaseSerializerV2, V2ErrorSerializer
-from issuer.models import Issuer, BadgeClass, BadgeInstance, IssuerStaff
+from issuer.models import Issuer, BadgeClass, BadgeInstance, IssuerStaff, RECIPIENT_TYPE_EMAIL
 from issuer.permissions import (MayIssueBadgeClass, MayEditBadgeClass, IsEditor, IsEditorButOwnerForDelete,
                                 IsStaff, ApprovedIssuersOnly, BadgrOAuthTokenHasScope,
                                 BadgrOAuthTokenHasEntityScope, AuthorizationIsBadgrOAuthToken)
@@ -30,6 +30,7 @@ from apispec_drf.decorators import apispec_get_operation, apispec_put_operation,
     apispec_delete_operation, apispec_list_operation, apispec_post_operation
 from mainsite.permissions import AuthenticatedWithVerifiedIdentifier, IsServerAdmin
 from mainsite.serializers import CursorPaginatedListSerializer
+from mainsite import blacklist
 from mainsite.models import AccessTokenProxy
 
 logger = badgrlog.BadgrLogger()
@@ -249,8 +250,8 @@ class BadgeClassDetail(BaseEntityDetailView):
         if response.status_code == 200 and getattr(settings, 'BADGERANK_NOTIFY_ON_FIRST_ASSERTION', True):
             badgeclass = self.get_object(request, **kwargs)
             if badgeclass.recipient_count() > 0:
-                from issuer.tasks import notify_badgerank_of_badgeclass
-                notify_badgerank_of_badgeclass.delay(badgeclass_pk=badgeclass.pk)
+                from issuer.tasks import enqueue_badgerank_notification
+                enqueue_badgerank_notification(badgeclass.pk)
         return response
 
 
@@ -313,6 +314,11 @@ class BatchAssertionsIssue(VersionedObjectMixin, BaseEntityView):
                                            field_errors=serializer._errors,
                                            validation_errors=[])
             return Response(serializer.data, status=status.HTTP_400_BAD_REQUEST)
+
+        # check every recipient against the blacklist in one batch, so each new assertion's check is a cache hit
+        blacklist.api_query_are_in_blacklist(
+            (a.get('recipient_type', RECIPIENT_TYPE_EMAIL), a['recipient_identifier'])
+            for a in serializer.validated_data if a.get('recipient_identifier'))
         new_instances = serializer.save(created_by=request.user)
         for new_instance in new_instances:
             self.log_create(new_instance)
@@ -725,7 +731,7 @@ class AssertionsChangedSince(BaseEntityView):
                 err.is_valid(raise_exception=False)
                 return Response(err.data, status=HTTP_400_BAD_REQUEST)
 
-        queryset = self.get_queryset(request, since=since)
+        queryset = self.project_queryset(self.get_queryset(request, since=since), serializer_class=BadgeInstanceSerializerV2)
         context = self.get_context_data(**kwargs)
         serializer = PaginatedAssertionsSinceSerializer(
             queryset=queryset,
@@ -777,7 +783,7 @@ class BadgeClassesChangedSince(BaseEntityView):
                 err.is_valid(raise_exception=False)
                 return Response(err.data, status=HTTP_400_BAD_REQUEST)
 
-        queryset = self.get_queryset(request, since=since)
+        queryset = self.project_queryset(self.get_queryset(request, since=since), serializer_class=BadgeClassSerializerV2)
         context = self.get_context_data(**kwargs)
         serializer = PaginatedBadgeClassesSinceSerializer(
             queryset=queryset,
@@ -829,7 +835,7 @@ class IssuersChangedSince(BaseEntityView):
                 err.is_valid(raise_exception=False)
                 return Response(err.data, status=HTTP_400_BAD_REQUEST)
 
-        queryset = self.get_queryset(request, since=since)
+        queryset = self.project_queryset(self.get_queryset(request, since=since), serializer_class=IssuerSerializerV2)
         context = self.get_context_data(**kwargs)
         serializer = PaginatedIssuersSinceSerializer(
             queryset=queryset,
@@ -1,139 +1,180 @@
 # encoding: utf-8
 
 
-import uuid
-from collections import MutableMapping
+import datetime
 
 import openbadges
+import requests
 from django.conf import settings
 from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.db import transaction, IntegrityError
 
-import requests_cache
 from requests_cache.backends import BaseCache
 
 import logging
+from issuer.jsonld_contexts import bundled_context_paths, get_bundled_context
 from issuer.models import Issuer, BadgeClass, BadgeInstance
-from issuer.utils import OBI_VERSION_CONTEXT_IRIS
 from mainsite.utils import first_node_match
 import json
 
 
 logger = logging.getLogger(__name__)
 
-class DjangoCacheDict(MutableMapping):
-    """TODO: Fix this class, its broken!"""
-    _keymap_cache_key = "DjangoCacheDict_keys"
-
-    def __init__(self, namespace, id=None, timeout=None):
+class BundledContextsMixin(object):
+    """
+    Makes a requests_cache backend answer GETs for the JSON-LD contexts in issuer.jsonld_contexts from memory, so only
+    contexts that aren't bundled are fetched.
+    """
+    _bundled_context_keys = None
+
+    def _bundled_context_url(self, key):
+        if self._bundled_context_keys is None:
+            self._bundled_context_keys = {self._url_to_key(url): url for url in bundled_context_paths()}
+        return self._bundled_context_keys.get(key)
+
+    def get_response_and_time(self, key, default=(None, None)):
+        url = self._bundled_context_url(key)
+        if url is None:
+            return super(BundledContextsMixin, self).get_response_and_time(key, default=default)
+
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response.encoding = 'utf-8'
+        response.headers['Content-Type'] = 'application/ld+json'
+        response._content = get_bundled_context(url).encode('utf-8')
+        response.request = requests.Request('GET', url).prepare()
+        return response, datetime.datetime.utcnow()
+
+
+class OpenBadgesContextCache(BundledContextsMixin, BaseCache):
+    """
+    The in-memory requests_cache backend used to validate badge extensions. The Open Badges contexts are bundled, so
+    creating one no longer fetches anything.
+    """
+    pass
+
+
+class DjangoCacheRequestsCacheBackend(BundledContextsMixin, BaseCache):
+    """
+    A requests_cache backend that keeps responses in the Django cache, so every worker shares one copy of each remote
+    Open Badges document.
+
+    Each response and each redirect mapping is stored under its own cache key, so concurrent writers never
+    read-modify-write a shared key map. Responses stay in the cache for stale_timeout seconds after they expire; an
+    expired response that carried an ETag or Last-Modified header is revalidated with a conditional GET and reused if
+    the server answers 304 Not Modified.
+    """
+    def __init__(self, namespace='requests-cache', expire_after=300, stale_timeout=60 * 60 * 24,
+                 max_response_size=512 * 1024, revalidate_timeout=(3.05, 10), **options):
+        super(DjangoCacheRequestsCacheBackend, self).__init__(**options)
         self.namespace = namespace
-        self._timeout = timeout
-
-        if id is None:
-            id = uuid.uuid4().hexdigest()
-        self._id = id
-        self.keymap_cache_key = self._keymap_cache_key+"_"+self._id
-
-    def build_key(self, *args):
-        return "{keymap_cache_key}{namespace}{key}".format(
-            keymap_cache_key=self.keymap_cache_key,
-            namespace=self.namespace,
-            key="".join(args)
-        ).encode("utf-8")
-
-    def timeout(self):
-        return self._timeout
-
-    def _keymap(self):
-        keymap = cache.get(self.keymap_cache_key)
-        if keymap is None:
-            return []
-        return keymap
-
-    def __getitem__(self, key):
-        result = cache.get(self.build_key(key))
-        if result is None:
-            raise KeyError
-        return result
-
-    def __setitem__(self, key, value):
-        built_key = self.build_key(key)
-        cache.set(built_key, value, timeout=self.timeout())
-
-        # this probably needs locking...
-        keymap = self._keymap()
-        keymap.append(built_key)
-        cache.set(self.keymap_cache_key, keymap, timeout=None)
-
-    def __delitem__(self, key):
-        built_key = self.build_key(key)
-        cache.delete(built_key)
-
-        # this probably needs locking...
-        keymap = self._keymap()
-        keymap.remove(built_key)
-        cache.set(self.keymap_cache_key, keymap, timeout=None)
-
-    def __len__(self):
-        keymap = self._keymap()
-        return len(keymap)
-
-    def __iter__(self):
-        keymap = self._keymap()
-        for key in keymap:
-            yield cache.get(key)
-
-    def __str__(self):
-        return '<{}>'.format(self.keymap_cache_key)
+        self.expire_after = datetime.timedelta(seconds=expire_after) if expire_after is not None else None
+        self.stale_timeout = stale_timeout
+        self.max_response_size = max_response_size
+        self.revalidate_timeout = revalidate_timeout
+        self._session = None
+
+    @property
+    def generation_key(self):
+        return "{}:generation".format(self.namespace)
+
+    def _cache_key(self, kind, key):
+        generation = cache.get(self.generation_key, 1)
+        return "{}:{}:{}:{}".format(self.namespace, generation, kind, key)
+
+    def _timeout(self):
+        if self.expire_after is None:
+            return None
+        return int(self.expire_after.total_seconds()) + self.stale_timeout
+
+    def _store(self, key, reduced_response):
+        cache.set(self._cache_key('response', key), (reduced_response, datetime.datetime.utcnow()),
+                  timeout=self._timeout())
+
+    def _get_entry(self, key):
+        entry = cache.get(self._cache_key('response', key))
+        if entry is None:
+            response_key = cache.get(self._cache_key('redirect', key))
+            if response_key is not None:
+                key = response_key
+                entry = cache.get(self._cache_key('response', key))
+        return key, entry
+
+    @property
+    def session(self):
+        if self._session is None:
+            self._session = requests.Session()
+        return self._session
+
+    def _revalidate(self, key, response):
+        """
+        Ask the origin whether an expired response is still current.
+
+        :return: the stored or refreshed response and its timestamp, or None if it couldn't be revalidated
+        """
+        validators = {}
+        if response.headers.get('ETag'):
+            validators['If-None-Match'] = response.headers['ETag']
+        if response.headers.get('Last-Modified'):
+            validators['If-Modified-Since'] = response.headers['Last-Modified']
+        if not validators or response.request is None:
+            return None
 
-    def clear(self):
-        self._id = uuid.uuid4().hexdigest()
-        self.keymap_cache_key = self._keymap_cache_key+"_"+self._id
+        conditional_request = response.request.copy()
+        conditional_request.headers.update(validators)
+        try:
+            revalidated = self.session.send(conditional_request, timeout=self.revalidate_timeout)
+        except requests.RequestException:
+            return None
 
+        if revalidated.status_code == 304:
+            self._store(key, response)
+        elif revalidated.status_code == 200 and len(revalidated.content) <= self.max_response_size:
+            response = self.reduce_response(revalidated)
+            self._store(key, response)
+        else:
+            return None
+        return self.restore_response(response), datetime.datetime.utcnow()
 
-class OpenBadgesContextCache(BaseCache):
-    OPEN_BADGES_CONTEXT_V2_URI = OBI_VERSION_CONTEXT_IRIS.get('2_0')
-    OPEN_BADGE_CONTEXT_CACHE_KEY = 'OPEN_BADGE_CONTEXT_CACHE_KEY'
-    FORTY_EIGHT_HOURS_IN_SECONDS = 60 * 60 * 24 * 2
+    def save_response(self, key, response):
+        if len(response.content) > self.max_response_size:
+            return
+        self._store(key, self.reduce_response(response))
 
-    def __init__(self, *args, **kwargs):
-        super(OpenBadgesContextCache, self).__init__(*args, **kwargs)
+    def add_key_mapping(self, new_key, key_to_response):
+        cache.set(self._cache_key('redirect', new_key), key_to_response, timeout=self._timeout())
 
-        cached_context = self._get_cached_content()
+    def get_response_and_time(self, key, default=(None, None)):
+        key, entry = self._get_entry(key)
+        if entry is None:
+            return default
+        response, created_at = entry
 
-        if cached_context:
-            self._intialize_instance_attributes(cached_context)
-        else:
-            self._set_cached_content()
-            self._intialize_instance_attributes(self._get_cached_content())
-
-    def _get_cached_content(self):
-        return cache.get(self.OPEN_BADGE_CONTEXT_CACHE_KEY, None)
-
-    def _set_cached_content(self):
-        self.session = requests_cache.CachedSession(backend='memory', expire_after=300)
-        response = self.session.get(self.OPEN_BADGES_CONTEXT_V2_URI, headers={'Accept': 'application/ld+json, application/json'})
-        if response.status_code == 200:
-            cache.set(
-                self.OPEN_BADGE_CONTEXT_CACHE_KEY,
-                {
-                    'keys_map': self.session.cache.keys_map.copy(),
-                    'response': self.session.cache.responses.copy()
-                },
-                timeout=self.FORTY_EIGHT_HOURS_IN_SECONDS
-            )
-
-    def _intialize_instance_attributes(self, cached):
-        self.keys_map = cached.get('keys_map', None)
-        self.responses = cached.get('response', None)
-
-
-class DjangoCacheRequestsCacheBackend(BaseCache):
-    def __init__(self, namespace='requests-cache', **options):
-        super(DjangoCacheRequestsCacheBackend, self).__init__(**options)
-        self.responses = DjangoCacheDict(namespace, 'responses')
-        self.keys_map = DjangoCacheDict(namespace, 'urls')
+        if self.expire_after is not None and datetime.datetime.utcnow() - created_at > self.expire_after:
+            revalidated = self._revalidate(key, response)
+            if revalidated is not None:
+                return revalidated
+        # an expired response is returned as is and the session refetches it
+        return self.restore_response(response), created_at
+
+    def delete(self, key):
+        cache.delete_many([self._cache_key('response', key), self._cache_key('redirect', key)])
+
+    def has_key(self, key):
+        return self._get_entry(key)[1] is not None
+
+    def clear(self):
+        # start a new generation of keys rather than finding every entry, the old ones expire on their own
+        try:
+            cache.incr(self.generation_key)
+        except ValueError:
+            cache.set(self.generation_key, 2, timeout=None)
+
+    def remove_old_entries(self, created_before):
+        # entries expire from the Django cache on their own, and revalidation needs the stale ones
+        pass
 
 
 class BadgeCheckHelper(object):
@@ -169,8 +210,10 @@ class BadgeCheckHelper(object):
     @classmethod
     def cache_instance(cls):
         if cls._cache_instance is None:
-            # TODO: note this class is broken and does not work correctly!
-            cls._cache_instance = DjangoCacheRequestsCacheBackend(namespace='badgr_requests_cache')
+            cls._cache_instance = DjangoCacheRequestsCacheBackend(
+                namespace='badgr_requests_cache',
+                expire_after=getattr(settings, 'BADGECHECK_CACHE_EXPIRE_AFTER', 300),
+                stale_timeout=getattr(settings, 'BADGECHECK_CACHE_STALE_TIMEOUT', 60 * 60 * 24))
         return cls._cache_instance
 
     @classmethod
@@ -178,7 +221,8 @@ class BadgeCheckHelper(object):
         return getattr(settings, 'BADGECHECK_OPTIONS', {
             'include_original_json': True,
             'use_cache': True,
-            # 'cache_backend': cls.cache_instance()  #  just use locmem cache for now
+            'cache_backend': cls.cache_instance(),
+            'cache_expire_after': getattr(settings, 'BADGECHECK_CACHE_EXPIRE_AFTER', 300),
         })
 
     @classmethod
@@ -207,6 +251,9 @@ class BadgeCheckHelper(object):
                     query = json.dumps(query)
                 except (TypeError, ValueError):
                     raise ValidationError("Could not parse dict to json")
+            if imagefile is None:
+                from issuer.prefetch import prefetch_badge_graph
+                prefetch_badge_graph(query)
             response = openbadges.verify(query, recipient_profile=badgecheck_recipient_profile, **cls.badgecheck_options())
         except ValueError as e:
             raise ValidationError([{'name': "INVALID_BADGE", 'description': str(e)}])
@@ -252,8 +299,8 @@ class BadgeCheckHelper(object):
                         getattr(settings, 'BADGERANK_NOTIFY_ON_BADGECLASS_CREATE', True) or
                         getattr(settings, 'BADGERANK_NOTIFY_ON_FIRST_ASSERTION', True)
                 ):
-                    from issuer.tasks import notify_badgerank_of_badgeclass
-                    notify_badgerank_of_badgeclass.delay(badgeclass_pk=badgeclass.pk)
+                    from issuer.tasks import enqueue_badgerank_notification
+                    enqueue_badgerank_notification(badgeclass.pk)
                 return BadgeInstance.objects.get_or_create_from_ob2(
                     badgeclass, assertion_obo,
                     recipient_identifier=recipient_identifier, recipient_type=recipient_type,
@@ -0,0 +1,45 @@
+# encoding: utf-8
+"""
+JSON-LD contexts shipped with badgr, so verifying a badge doesn't have to fetch them.
+
+issuer.helpers.BundledContextsMixin answers requests for these urls from memory. More documents can be bundled with the
+BADGR_JSONLD_CONTEXTS setting, a dict of url to json file path. Extension contexts aren't shipped: each one names a
+validationSchema that is fetched as well, and both are published and revised independently of the Open Badges spec, so
+a deployment that needs extension validation offline maps the context and schema urls it accepts to local copies.
+"""
+import os
+
+from django.conf import settings
+
+
+CONTEXTS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+BUNDLED_CONTEXTS = {
+    'https://w3id.org/openbadges/v1': 'openbadges-v1.json',
+    'http://w3id.org/openbadges/v1': 'openbadges-v1.json',
+    'https://openbadgespec.org/v1/context.json': 'openbadges-v1.json',
+    'https://w3id.org/openbadges/v2': 'openbadges-v2.json',
+    'http://w3id.org/openbadges/v2': 'openbadges-v2.json',
+    'https://openbadgespec.org/v2/context.json': 'openbadges-v2.json',
+}
+
+_documents = {}
+
+
+def bundled_context_paths():
+    paths = {url: os.path.join(CONTEXTS_DIRECTORY, filename) for url, filename in list(BUNDLED_CONTEXTS.items())}
+    paths.update(getattr(settings, 'BADGR_JSONLD_CONTEXTS', {}))
+    return paths
+
+
+def get_bundled_context(url):
+    """
+    :return: the text of the context document bundled for url, or None if url isn't bundled
+    """
+    path = bundled_context_paths().get(url)
+    if path is None:
+        return None
+    if path not in _documents:
+        with open(path, 'rb') as f:
+            _documents[path] = f.read().decode('utf-8')
+    return _documents[path]
@@ -14,7 +14,7 @@ from django.urls import resolve, Resolver404
 
 from issuer.utils import sanitize_id
 from mainsite.utils import fetch_remote_file_to_storage, list_of, OriginSetting
-from pathway.tasks import award_badges_for_pathway_completion
+from pathway.tasks import enqueue_completion_check
 
 
 def resolve_source_url_referencing_local_object(source_url):
@@ -99,8 +99,8 @@ class BadgeClassManager(BaseOpenBadgeObjectManager):
         obj.save()
 
         if getattr(settings, 'BADGERANK_NOTIFY_ON_BADGECLASS_CREATE', True):
-            from issuer.tasks import notify_badgerank_of_badgeclass
-            notify_badgerank_of_badgeclass.delay(badgeclass_pk=obj.pk)
+            from issuer.tasks import enqueue_badgerank_notification
+            enqueue_badgerank_notification(obj.pk)
 
         return obj
 
@@ -345,7 +345,7 @@ class BadgeInstanceManager(BaseOpenBadgeObjectManager):
                     )
 
         if check_completions:
-            award_badges_for_pathway_completion.delay(badgeinstance_pk=new_instance.pk)
+            enqueue_completion_check(new_instance.recipient_identifier, new_instance.badgeclass_id)
 
         if not notify and getattr(settings, 'GDPR_COMPLIANCE_NOTIFY_ON_FIRST_AWARD'):
             # always notify if this is the first time issuing to a recipient if configured for GDPR compliance
@@ -358,7 +358,7 @@ class BadgeInstanceManager(BaseOpenBadgeObjectManager):
         if badgeclass.recipient_count() == 1 and (
                 not getattr(settings, 'BADGERANK_NOTIFY_ON_BADGECLASS_CREATE', True) and
                 getattr(settings, 'BADGERANK_NOTIFY_ON_FIRST_ASSERTION', True)):
-            from issuer.tasks import notify_badgerank_of_badgeclass
-            notify_badgerank_of_badgeclass.delay(badgeclass_pk=badgeclass.pk)
+            from issuer.tasks import enqueue_badgerank_notification
+            enqueue_badgerank_notification(badgeclass.pk)
 
         return new_instance
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.14 on 2026-10-19 12:00
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('issuer', '0057_badgeinstance_backpack_index'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='badgeinstance',
+            index_together={('recipient_identifier', 'badgeclass', 'revoked'), ('recipient_identifier', 'revoked', 'expires_at'), ('recipient_identifier', 'updated_at')},
+        ),
+    ]
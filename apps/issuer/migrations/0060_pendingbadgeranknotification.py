@@ -0,0 +1,22 @@
+# Generated by Django 2.2.14 on 2026-10-19 12:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('issuer', '0059_earnernotification'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingBadgeRankNotification',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('badgeclass', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='issuer.BadgeClass')),
+            ],
+        ),
+    ]
@@ -10,14 +10,12 @@ from itertools import chain
 
 import cachemodel
 import os
-from allauth.account.adapter import get_adapter
 from django.apps import apps
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
 from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage
-from django.urls import reverse
 from django.db import models, transaction
 from django.db.models import ProtectedError
 from json import loads as json_loads
@@ -29,11 +27,13 @@ from django.utils import timezone
 import badgrlog
 from entity.models import BaseVersionedEntity
 from issuer.managers import BadgeInstanceManager, IssuerManager, BadgeClassManager, BadgeInstanceEvidenceManager
+from mainsite.cached_collections import cached_pk_list
 from mainsite.managers import SlugOrJsonIdCacheModelManager
 from mainsite.mixins import HashUploadedImage, ResizeUploadedImage, ScrubUploadedSvgImage
-from mainsite.models import BadgrApp, EmailBlacklist
+from mainsite.models import BadgrApp
+from mainsite.renderers import dumps_json
 from mainsite import blacklist
-from mainsite.utils import OriginSetting, generate_entity_uri
+from mainsite.utils import PublicUrl, freeze_json, generate_entity_uri
 from .utils import (add_obi_version_ifneeded, CURRENT_OBI_VERSION, generate_rebaked_filename,
                     generate_sha256_hashstring, get_obi_context, parse_original_datetime, UNVERSIONED_BAKED_VERSION)
 
@@ -87,12 +87,28 @@ class OriginalJsonMixin(models.Model):
     class Meta:
         abstract = True
 
+    def __getstate__(self):
+        state = super(OriginalJsonMixin, self).__getstate__()
+        # parsed payloads are rebuilt on demand, don't ship them to the cache
+        parsed_keys = [k for k in state if k.startswith('_parsed_')]
+        if parsed_keys:
+            state = {k: v for k, v in state.items() if k not in parsed_keys}
+        return state
+
     def get_original_json(self):
+        """
+        Return original_json parsed into read-only dicts and lists, or None if it is empty or not valid JSON.
+        The parsed value is memoized until original_json is reassigned.
+        """
         if self.original_json:
-            try:
-                return json_loads(self.original_json)
-            except (TypeError, ValueError) as e:
-                pass
+            parsed = self.__dict__.get('_parsed_original_json')
+            if parsed is None or parsed[0] is not self.original_json:
+                try:
+                    value = freeze_json(json_loads(self.original_json))
+                except (TypeError, ValueError) as e:
+                    value = None
+                parsed = self._parsed_original_json = (self.original_json, value)
+            return parsed[1]
 
     def get_filtered_json(self, excluded_fields=()):
         original = self.get_original_json()
@@ -129,9 +145,24 @@ class BaseOpenBadgeObjectModel(OriginalJsonMixin, cachemodel.CacheModel):
     def cached_extensions(self):
         return self.get_extensions_manager().all()
 
+    def get_extensions_json(self):
+        """
+        Return an OrderedDict of extension name to parsed payload. A payload is only reparsed when the extension's
+        original_json changes.
+        """
+        previous = self.__dict__.get('_parsed_extensions', {})
+        parsed = OrderedDict()
+        for extension in self.cached_extensions():
+            raw, payload = previous.get(extension.name, (None, None))
+            if raw is None or raw != extension.original_json:
+                raw, payload = extension.original_json, extension.get_original_json()
+            parsed[extension.name] = (raw, payload)
+        self._parsed_extensions = parsed
+        return OrderedDict((name, payload) for name, (raw, payload) in parsed.items())
+
     @property
     def extension_items(self):
-        return {e.name: json_loads(e.original_json) for e in self.cached_extensions()}
+        return dict(self.get_extensions_json())
 
     @extension_items.setter
     def extension_items(self, value):
@@ -160,9 +191,8 @@ class BaseOpenBadgeObjectModel(OriginalJsonMixin, cachemodel.CacheModel):
                     extension.delete()
 
 
-class BaseOpenBadgeExtension(cachemodel.CacheModel):
+class BaseOpenBadgeExtension(OriginalJsonMixin, cachemodel.CacheModel):
     name = models.CharField(max_length=254)
-    original_json = models.TextField(blank=True, null=True, default=None)
 
     def __str__(self):
         return self.name
@@ -247,17 +277,17 @@ class Issuer(ResizeUploadedImage,
         return ret
 
     def get_absolute_url(self):
-        return reverse('issuer_json', kwargs={'entity_id': self.entity_id})
+        return PublicUrl.path('issuer_json', self.entity_id)
 
     @property
     def public_url(self):
-        return OriginSetting.HTTP+self.get_absolute_url()
+        return PublicUrl.url('issuer_json', self.entity_id)
 
     @property
     def jsonld_id(self):
         if self.source_url:
             return self.source_url
-        return OriginSetting.HTTP + self.get_absolute_url()
+        return PublicUrl.url('issuer_json', self.entity_id)
 
     @property
     def editors(self):
@@ -311,7 +341,7 @@ class Issuer(ResizeUploadedImage,
         UserModel = get_user_model()
         return UserModel.objects.filter(issuerstaff__issuer=self, issuerstaff__role=IssuerStaff.ROLE_EDITOR)
 
-    @cachemodel.cached_method(auto_publish=True)
+    @cached_pk_list(auto_publish=True)
     def cached_badgeclasses(self):
         return self.badgeclasses.all().order_by("created_at")
 
@@ -343,27 +373,24 @@ class Issuer(ResizeUploadedImage,
             email=self.email,
             description=self.description))
         if self.image:
-            image_url = OriginSetting.HTTP + reverse('issuer_image', kwargs={'entity_id': self.entity_id})
+            image_url = PublicUrl.url('issuer_image', self.entity_id)
             json['image'] = image_url
             if self.original_json:
                 image_info = self.get_original_json().get('image', None)
                 if isinstance(image_info, dict):
-                    json['image'] = image_info
-                    json['image']['id'] = image_url
+                    json['image'] = dict(image_info, id=image_url)
 
         # source url
         if self.source_url:
             if obi_version == '1_1':
                 json["source_url"] = self.source_url
-                json["hosted_url"] = OriginSetting.HTTP + self.get_absolute_url()
+                json["hosted_url"] = PublicUrl.url('issuer_json', self.entity_id)
             elif obi_version == '2_0':
                 json["sourceUrl"] = self.source_url
-                json["hostedUrl"] = OriginSetting.HTTP + self.get_absolute_url()
+                json["hostedUrl"] = PublicUrl.url('issuer_json', self.entity_id)
 
         # extensions
-        if len(self.cached_extensions()) > 0:
-            for extension in self.cached_extensions():
-                json[extension.name] = json_loads(extension.original_json)
+        json.update(self.get_extensions_json())
 
         # pass through imported json
         if include_extra:
@@ -521,18 +548,18 @@ class BadgeClass(ResizeUploadedImage,
         rebake_all_assertions_for_badge_class.delay(self.pk, limit=batch_size, replay=True)
 
     def get_absolute_url(self):
-        return reverse('badgeclass_json', kwargs={'entity_id': self.entity_id})
+        return PublicUrl.path('badgeclass_json', self.entity_id)
 
 
     @property
     def public_url(self):
-        return OriginSetting.HTTP+self.get_absolute_url()
+        return PublicUrl.url('badgeclass_json', self.entity_id)
 
     @property
     def jsonld_id(self):
         if self.source_url:
             return self.source_url
-        return OriginSetting.HTTP + self.get_absolute_url()
+        return PublicUrl.url('badgeclass_json', self.entity_id)
 
     @property
     def issuer_jsonld_id(self):
@@ -541,7 +568,7 @@ class BadgeClass(ResizeUploadedImage,
     def get_criteria_url(self):
         if self.criteria_url:
             return self.criteria_url
-        return OriginSetting.HTTP+reverse('badgeclass_criteria', kwargs={'entity_id': self.entity_id})
+        return PublicUrl.url('badgeclass_criteria', self.entity_id)
 
     @property
     def description_nonnull(self):
@@ -669,15 +696,14 @@ class BadgeClass(ResizeUploadedImage,
 
         # image
         if self.image:
-            image_url = OriginSetting.HTTP + reverse('badgeclass_image', kwargs={'entity_id': self.entity_id})
+            image_url = PublicUrl.url('badgeclass_image', self.entity_id)
             json['image'] = image_url
             if self.original_json:
                 original_json = self.get_original_json()
                 if original_json is not None:
                     image_info = original_json.get('image', None)
                     if isinstance(image_info, dict):
-                        json['image'] = image_info
-                        json['image']['id'] = image_url
+                        json['image'] = dict(image_info, id=image_url)
 
         # criteria
         if obi_version == '1_1':
@@ -693,10 +719,10 @@ class BadgeClass(ResizeUploadedImage,
         if self.source_url:
             if obi_version == '1_1':
                 json["source_url"] = self.source_url
-                json["hosted_url"] = OriginSetting.HTTP + self.get_absolute_url()
+                json["hosted_url"] = PublicUrl.url('badgeclass_json', self.entity_id)
             elif obi_version == '2_0':
                 json["sourceUrl"] = self.source_url
-                json["hostedUrl"] = OriginSetting.HTTP + self.get_absolute_url()
+                json["hostedUrl"] = PublicUrl.url('badgeclass_json', self.entity_id)
 
         # alignment / tags
         if obi_version == '2_0':
@@ -704,9 +730,7 @@ class BadgeClass(ResizeUploadedImage,
             json['tags'] = list(t.name for t in self.cached_tags())
 
         # extensions
-        if len(self.cached_extensions()) > 0:
-            for extension in self.cached_extensions():
-                json[extension.name] = json_loads(extension.original_json)
+        json.update(self.get_extensions_json())
 
         # pass through imported json
         if include_extra:
@@ -798,6 +822,8 @@ class BadgeInstance(BaseAuditedModel,
     class Meta:
         index_together = (
                 ('recipient_identifier', 'badgeclass', 'revoked'),
+                ('recipient_identifier', 'revoked', 'expires_at'),
+                ('recipient_identifier', 'updated_at'),
         )
 
     @property
@@ -834,13 +860,13 @@ class BadgeInstance(BaseAuditedModel,
         return BadgeClass.cached.get(pk=self.badgeclass_id)
 
     def get_absolute_url(self):
-        return reverse('badgeinstance_json', kwargs={'entity_id': self.entity_id})
+        return PublicUrl.path('badgeinstance_json', self.entity_id)
 
     @property
     def jsonld_id(self):
         if self.source_url:
             return self.source_url
-        return OriginSetting.HTTP + self.get_absolute_url()
+        return PublicUrl.url('badgeinstance_json', self.entity_id)
 
     @property
     def badgeclass_jsonld_id(self):
@@ -852,7 +878,7 @@ class BadgeInstance(BaseAuditedModel,
 
     @property
     def public_url(self):
-        return OriginSetting.HTTP+self.get_absolute_url()
+        return PublicUrl.url('badgeinstance_json', self.entity_id)
 
     @property
     def owners(self):
@@ -865,6 +891,16 @@ class BadgeInstance(BaseAuditedModel,
             does not exist or is unverified the BadgeInstance is
             considered "pending"
         """
+        return self.is_pending()
+
+    def is_pending(self, verified_recipient_identifiers=None):
+        """
+        :param verified_recipient_identifiers: when serializing a user's own assertions, the set of that user's verified
+            identifiers; every other identifier of theirs exists and is unverified, so no lookup is needed
+        """
+        if verified_recipient_identifiers is not None:
+            return bool(self.source_url) and self.recipient_identifier not in verified_recipient_identifiers
+
         from badgeuser.models import CachedEmailAddress, UserRecipientIdentifier
         try:
             if self.recipient_type == RECIPIENT_TYPE_EMAIL:
@@ -897,7 +933,7 @@ class BadgeInstance(BaseAuditedModel,
                 badgeclass_name, ext = os.path.splitext(self.badgeclass.image.file.name)
                 new_image = io.BytesIO()
                 bake(image_file=self.cached_badgeclass.image.file,
-                     assertion_json_string=json_dumps(self.get_json(obi_version=UNVERSIONED_BAKED_VERSION), indent=2),
+                     assertion_json_string=dumps_json(self.get_json(obi_version=UNVERSIONED_BAKED_VERSION), indent=2).decode('utf-8'),
                      output_file=new_image)
                 self.image.save(name='assertion-{id}{ext}'.format(id=self.entity_id, ext=ext),
                                 content=ContentFile(new_image.read()),
@@ -921,7 +957,7 @@ class BadgeInstance(BaseAuditedModel,
         new_image = io.BytesIO()
         bake(
             image_file=self.cached_badgeclass.image.file,
-            assertion_json_string=json_dumps(self.get_json(obi_version=obi_version), indent=2),
+            assertion_json_string=dumps_json(self.get_json(obi_version=obi_version), indent=2).decode('utf-8'),
             output_file=new_image
         )
 
@@ -973,6 +1009,11 @@ class BadgeInstance(BaseAuditedModel,
         self.image.delete()
         self.save()
 
+        # stored pathway completion state assumes this badge is still held
+        from pathway.completion import clear_completion_state
+        for element in self.cached_badgeclass.cached_pathway_elements():
+            clear_completion_state(element.pathway_id, self.recipient_identifier)
+
         # remove BadgeObjectiveAwards from badgebook if needed
         if apps.is_installed('badgebook'):
             try:
@@ -988,30 +1029,24 @@ class BadgeInstance(BaseAuditedModel,
 
     def notify_earner(self, badgr_app=None, renotify=False):
         """
-        Sends an email notification to the badge earner.
-        This process involves creating a badgeanalysis.models.OpenBadge
+        Queues an email notification to the badge earner in the outbox. The send_earner_notifications task renders
+        and sends it once the current transaction commits.
         returns the EarnerNotification instance.
-
-        TODO: consider making this an option on initial save and having a foreign key to
-        the notification model instance (which would link through to the OpenBadge)
         """
         if self.recipient_type != RECIPIENT_TYPE_EMAIL:
             return
 
-        try:
-            EmailBlacklist.objects.get(email=self.recipient_identifier)
-        except EmailBlacklist.DoesNotExist:
-            # Allow sending, as this email is not blacklisted.
-            pass
-        else:
-            logger.event(badgrlog.BlacklistEarnerNotNotifiedEvent(self))
-            return
+        notification = EarnerNotification.objects.create(badgeinstance=self, badgr_app=badgr_app, renotify=renotify)
 
-        if badgr_app is None:
-            badgr_app = self.cached_issuer.cached_badgrapp
-        if badgr_app is None:
-            badgr_app = BadgrApp.objects.get_current(None)
+        from issuer.tasks import schedule_earner_notifications
+        transaction.on_commit(schedule_earner_notifications)
+        return notification
 
+    def get_earner_notification_email(self, badgr_app, renotify=False, recipient_verified=False):
+        """
+        :param recipient_verified: whether the recipient identifier is a verified email address of a badgr account
+        :return: (template_name, context) of the email notifying the earner of this badge
+        """
         try:
             if self.issuer.image:
                 issuer_image_url = self.issuer.public_url + '/image'
@@ -1044,16 +1079,11 @@ class BadgeInstance(BaseAuditedModel,
             raise e
 
         template_name = 'issuer/email/notify_earner'
-        try:
-            from badgeuser.models import CachedEmailAddress
-            CachedEmailAddress.objects.get(email=self.recipient_identifier, verified=True)
+        if recipient_verified:
             template_name = 'issuer/email/notify_account_holder'
             email_context['site_url'] = badgr_app.email_confirmation_redirect
-        except CachedEmailAddress.DoesNotExist:
-            pass
 
-        adapter = get_adapter()
-        adapter.send_mail(template_name, self.recipient_identifier, context=email_context)
+        return template_name, email_context
 
     def get_extensions_manager(self):
         return self.badgeinstanceextension_set
@@ -1095,13 +1125,12 @@ class BadgeInstance(BaseAuditedModel,
             ('badge', add_obi_version_ifneeded(self.cached_badgeclass.jsonld_id, obi_version)),
         ])
 
-        image_url = OriginSetting.HTTP + reverse('badgeinstance_image', kwargs={'entity_id': self.entity_id})
+        image_url = PublicUrl.url('badgeinstance_image', self.entity_id)
         json['image'] = image_url
         if self.original_json:
             image_info = self.get_original_json().get('image', None)
             if isinstance(image_info, dict):
-                json['image'] = image_info
-                json['image']['id'] = image_url
+                json['image'] = dict(image_info, id=image_url)
 
         if expand_badgeclass:
             json['badge'] = self.cached_badgeclass.get_json(obi_version=obi_version, include_extra=include_extra)
@@ -1133,10 +1162,10 @@ class BadgeInstance(BaseAuditedModel,
         if self.source_url:
             if obi_version == '1_1':
                 json["source_url"] = self.source_url
-                json["hosted_url"] = OriginSetting.HTTP + self.get_absolute_url()
+                json["hosted_url"] = PublicUrl.url('badgeinstance_json', self.entity_id)
             elif obi_version == '2_0':
                 json["sourceUrl"] = self.source_url
-                json["hostedUrl"] = OriginSetting.HTTP + self.get_absolute_url()
+                json["hostedUrl"] = PublicUrl.url('badgeinstance_json', self.entity_id)
 
         # evidence
         if self.evidence_url:
@@ -1173,9 +1202,7 @@ class BadgeInstance(BaseAuditedModel,
             }
 
         # extensions
-        if len(self.cached_extensions()) > 0:
-            for extension in self.cached_extensions():
-                json[extension.name] = json_loads(extension.original_json)
+        json.update(self.get_extensions_json())
 
         # pass through imported json
         if include_extra:
@@ -1269,7 +1296,7 @@ class BadgeInstance(BaseAuditedModel,
             badgeclass_name, ext = os.path.splitext(self.badgeclass.image.file.name)
             new_image = io.BytesIO()
             bake(image_file=self.cached_badgeclass.image.file,
-                 assertion_json_string=json_dumps(json_to_bake, indent=2),
+                 assertion_json_string=dumps_json(json_to_bake, indent=2).decode('utf-8'),
                  output_file=new_image)
             baked_image.image.save(
                 name='assertion-{id}-{version}{ext}'.format(id=self.entity_id, ext=ext, version=obi_version),
@@ -1288,6 +1315,45 @@ def _baked_badge_instance_filename_generator(instance, filename):
     )
 
 
+class EarnerNotification(models.Model):
+    """
+    An email to a badge earner waiting in the outbox, or the record of one that has been handled.
+    """
+    STATUS_PENDING = 'Pending'
+    STATUS_SENDING = 'Sending'
+    STATUS_SENT = 'Sent'
+    STATUS_SUPPRESSED = 'Suppressed'
+    STATUS_FAILED = 'Failed'
+    STATUS_CHOICES = (
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENDING, 'Sending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_SUPPRESSED, 'Suppressed'),
+        (STATUS_FAILED, 'Failed'),
+    )
+
+    badgeinstance = models.ForeignKey(BadgeInstance, on_delete=models.CASCADE)
+    badgr_app = models.ForeignKey('mainsite.BadgrApp', blank=True, null=True, on_delete=models.SET_NULL)
+    renotify = models.BooleanField(default=False)
+    status = models.CharField(max_length=254, choices=STATUS_CHOICES, default=STATUS_PENDING, db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    claimed_at = models.DateTimeField(blank=True, null=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return "{} to {}".format(self.status, self.badgeinstance.recipient_identifier)
+
+
+class PendingBadgeRankNotification(models.Model):
+    """
+    A badgeclass waiting to be submitted to BadgeRank by issuer.tasks.flush_badgerank_notifications. There is at most
+    one row per badgeclass, so a badgeclass that is already waiting is not submitted twice.
+    """
+    badgeclass = models.OneToOneField(BadgeClass, on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
 class BadgeInstanceBakedImage(cachemodel.CacheModel):
     badgeinstance = models.ForeignKey('issuer.BadgeInstance',
                                       on_delete=models.CASCADE)
@@ -0,0 +1,141 @@
+# encoding: utf-8
+"""
+Concurrent prefetching of the remote documents an Open Badges verification is going to read.
+
+openbadges.verify walks assertion -> badgeclass -> issuer and fetches each node and image one at a time. Before it
+runs, prefetch_badge_graph fetches the same urls with a bounded thread pool through the shared requests cache backend,
+starting on each reference as soon as the document that names it arrives. Verification then reads warm cache entries,
+so its network time is the longest chain of references instead of the sum of every fetch.
+
+Prefetching is only an optimization: failures are ignored and left for badgecheck to report.
+"""
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import requests
+import requests_cache
+from django.conf import settings
+
+from issuer.helpers import BadgeCheckHelper
+
+
+# the Accept header badgecheck sends for graph nodes and images; the cache key ignores headers, so prefetching with any
+# other value could store a different representation under the same key
+NODE_ACCEPT = 'application/ld+json, application/json, image/png, image/svg+xml'
+
+# properties whose value is another node (or an image) that badgecheck fetches when it's given as a url
+REFERENCE_PROPERTIES = ('badge', 'issuer', 'image')
+
+
+def _is_url(value):
+    return isinstance(value, str) and value.startswith(('http://', 'https://'))
+
+
+def referenced_urls(node):
+    """
+    The urls badgecheck will fetch to resolve the references of node, including those of embedded nodes.
+    """
+    if not isinstance(node, dict):
+        return
+    for prop in REFERENCE_PROPERTIES:
+        value = node.get(prop)
+        if _is_url(value):
+            yield value
+        elif isinstance(value, dict):
+            if prop == 'image' and _is_url(value.get('id')):
+                yield value['id']
+            else:
+                for url in referenced_urls(value):
+                    yield url
+
+
+class GraphPrefetcher(object):
+    def __init__(self, backend, expire_after=300, max_workers=4, max_documents=10, timeout=(3.05, 10)):
+        self.backend = backend
+        self.expire_after = expire_after
+        self.max_workers = max_workers
+        self.max_documents = max_documents
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests_cache.CachedSession(
+                backend=self.backend, expire_after=self.expire_after)
+        return session
+
+    def fetch(self, url):
+        """
+        :return: the parsed json document at url, or None if it isn't json or couldn't be fetched
+        """
+        try:
+            response = self._session().get(url, headers={'Accept': NODE_ACCEPT}, timeout=self.timeout)
+            return json.loads(response.text)
+        except (requests.RequestException, ValueError):
+            return None
+
+    def prefetch(self, urls=(), documents=()):
+        """
+        Fetch urls and everything they reference, plus the references of documents that are already in hand.
+
+        :return: the set of urls that were fetched
+        """
+        seen = set()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {}
+
+            def _submit(url):
+                if url not in seen and len(seen) < self.max_documents:
+                    seen.add(url)
+                    futures[pool.submit(self.fetch, url)] = url
+
+            for url in urls:
+                _submit(url)
+            for document in documents:
+                for url in referenced_urls(document):
+                    _submit(url)
+
+            while futures:
+                done, not_done = wait(list(futures.keys()), return_when=FIRST_COMPLETED)
+                for future in done:
+                    del futures[future]
+                    for url in referenced_urls(future.result()):
+                        _submit(url)
+        return seen
+
+
+def prefetch_badge_graph(badge_input):
+    """
+    Warm the shared verification cache for badge_input, a hosted assertion url or an assertion dict or json string.
+    Baked images are not prefetched.
+    """
+    options = BadgeCheckHelper.badgecheck_options()
+    max_workers = getattr(settings, 'BADGECHECK_PREFETCH_WORKERS', 4)
+    if not max_workers or not options.get('use_cache') or options.get('cache_backend') is None:
+        return set()
+
+    prefetcher = GraphPrefetcher(
+        options['cache_backend'],
+        expire_after=options.get('cache_expire_after', 300),
+        max_workers=max_workers,
+        max_documents=getattr(settings, 'BADGECHECK_PREFETCH_MAX_DOCUMENTS', 10),
+        timeout=getattr(settings, 'BADGECHECK_PREFETCH_TIMEOUT', (3.05, 10)))
+
+    if isinstance(badge_input, str):
+        if _is_url(badge_input):
+            return prefetcher.prefetch(urls=[badge_input])
+        try:
+            badge_input = json.loads(badge_input)
+        except ValueError:
+            return set()
+
+    if isinstance(badge_input, dict):
+        # badgecheck refetches hosted assertions from their id
+        verification = badge_input.get('verification') or {}
+        hosted = isinstance(verification, dict) and verification.get('type', 'hosted') in ('hosted', 'HostedBadge')
+        urls = [badge_input['id']] if hosted and _is_url(badge_input.get('id')) else []
+        return prefetcher.prefetch(urls=urls, documents=[badge_input])
+    return set()
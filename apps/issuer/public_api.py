@@ -27,7 +27,9 @@ from backpack.models import BackpackCollection
 from entity.api import VersionedObjectMixin
 from mainsite.models import BadgrApp
 from mainsite.utils import OriginSetting, set_url_query_params, first_node_match
+from .helpers import BadgeCheckHelper
 from .models import Issuer, BadgeClass, BadgeInstance
+from .prefetch import prefetch_badge_graph
 logger = badgrlog.BadgrLogger()
 
 
@@ -417,29 +419,17 @@ class BackpackCollectionJson(JSONComponentView):
     entity_id_field_name = 'share_hash'
 
     def get_context_data(self, **kwargs):
-        image_url = ''
-        if self.current_object.cached_badgeinstances().exists():
-            chosen_assertion = sorted(self.current_object.cached_badgeinstances(), key=lambda b: b.issued_on)[0]
-            image_url = "{}{}?type=png".format(
-                OriginSetting.HTTP,
-                reverse('badgeinstance_image', kwargs={'entity_id': chosen_assertion.entity_id})
-            )
-            if self.is_wide_bot():
-                image_url = "{}&fmt=wide".format(image_url)
-
-        return dict(
-            title=self.current_object.name,
-            description=self.current_object.description,
-            public_url=self.current_object.share_url,
-            image_url=image_url
-        )
+        context = dict(self.current_object.cached_preview())
+        if context['image_url'] and self.is_wide_bot():
+            context['image_url'] = "{}&fmt=wide".format(context['image_url'])
+        return context
 
     def get_json(self, request):
         expands = request.GET.getlist('expand', [])
         if not self.current_object.published:
             raise Http404
 
-        json = self.current_object.get_json(
+        json = self.current_object.get_cached_json(
             obi_version=self._get_request_obi_version(request),
             expand_badgeclass=('badges.badge' in expands),
             expand_issuer=('badges.badge.issuer' in expands)
@@ -586,13 +576,9 @@ class VerifyBadgeAPIEndpoint(JSONComponentView):
                 badge_instance.recipient_type: badge_instance.recipient_identifier
             }
 
-            badge_check_options = {
-                'include_original_json': True,
-                'use_cache': True,
-            }
-
+            prefetch_badge_graph(badge_instance.jsonld_id)
             try:
-                response = openbadges.verify(badge_instance.jsonld_id, recipient_profile=recipient_profile, **badge_check_options)
+                response = openbadges.verify(badge_instance.jsonld_id, recipient_profile=recipient_profile, **BadgeCheckHelper.badgecheck_options())
             except ValueError as e:
                 raise ValidationError([{'name': "INVALID_BADGE", 'description': str(e)}])
 
@@ -59,6 +59,7 @@ class IssuerSerializerV1(OriginalJsonSerializerMixin, serializers.Serializer):
 
     class Meta:
         apispec_definition = ('Issuer', {})
+        deferred_fields = ('old_json',)
 
     def validate_image(self, image):
         if image is not None:
@@ -169,6 +170,7 @@ class BadgeClassSerializerV1(OriginalJsonSerializerMixin, serializers.Serializer
 
     class Meta:
         apispec_definition = ('BadgeClass', {})
+        deferred_fields = ('old_json',)
 
     def to_internal_value(self, data):
         if 'expires' in data:
@@ -308,6 +310,7 @@ class BadgeInstanceSerializerV1(OriginalJsonSerializerMixin, serializers.Seriali
 
     class Meta:
         apispec_definition = ('Assertion', {})
+        deferred_fields = ('old_json',)
 
     def validate(self, data):
         recipient_type = data.get('recipient_type')
@@ -83,6 +83,7 @@ class IssuerSerializerV2(DetailSerializerV2, OriginalJsonSerializerMixin):
 
     class Meta(DetailSerializerV2.Meta):
         model = Issuer
+        deferred_fields = ('old_json',)
         apispec_definition = ('Issuer', {
             'properties': OrderedDict([
                 ('entityId', {
@@ -248,6 +249,7 @@ class BadgeClassSerializerV2(DetailSerializerV2, OriginalJsonSerializerMixin):
 
     class Meta(DetailSerializerV2.Meta):
         model = BadgeClass
+        deferred_fields = ('old_json',)
         apispec_definition = ('BadgeClass', {
             'properties': OrderedDict([
                 ('entityId', {
@@ -513,6 +515,7 @@ class BadgeInstanceSerializerV2(DetailSerializerV2, OriginalJsonSerializerMixin)
 
     class Meta(DetailSerializerV2.Meta):
         model = BadgeInstance
+        deferred_fields = ('old_json',)
         apispec_definition = ('Assertion', {
             'properties': OrderedDict([
                 ('entityId', {
@@ -1,16 +1,26 @@
 # encoding: utf-8
 
+import datetime
+from collections import OrderedDict
+
 import dateutil
 import itertools
+import time
+
 import requests
 from celery.utils.log import get_task_logger
 from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import get_connection
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
 from requests import ConnectionError
 
 import badgrlog
 from issuer.helpers import BadgeCheckHelper
 from issuer.managers import resolve_source_url_referencing_local_object
-from issuer.models import BadgeClass, BadgeInstance, Issuer
+from issuer.models import BadgeClass, BadgeInstance, EarnerNotification, Issuer, PendingBadgeRankNotification
 from issuer.utils import CURRENT_OBI_VERSION
 from mainsite.celery import app
 from mainsite.utils import OriginSetting
@@ -22,33 +32,108 @@ background_task_queue_name = getattr(settings, 'BACKGROUND_TASK_QUEUE_NAME', 'de
 badgerank_task_queue_name = getattr(settings, 'BADGERANK_TASK_QUEUE_NAME', 'default')
 
 
-@app.task(bind=True, queue=badgerank_task_queue_name, autoretry_for=(ConnectionError,), retry_backoff=True, max_retries=10)
-def notify_badgerank_of_badgeclass(self, badgeclass_pk):
-    badgerank_enabled = getattr(settings, 'BADGERANK_NOTIFY_ENABLED', True)
-    if not badgerank_enabled:
-        return {
-            'success': True,
-            'message': "skipping since BADGERANK_NOTIFY_ENABLED=False"
-        }
+BADGERANK_FLUSH_SCHEDULED_CACHE_KEY = 'badgerank_notify_flush_scheduled'
+
+_badgerank_session = None
+
+
+def badgerank_session():
+    global _badgerank_session
+    if _badgerank_session is None:
+        _badgerank_session = requests.Session()
+    return _badgerank_session
+
+
+def enqueue_badgerank_notification(badgeclass_pk):
+    """
+    Buffer a BadgeRank notification for a badgeclass. Buffered badgeclasses are submitted together by
+    flush_badgerank_notifications BADGERANK_NOTIFY_WINDOW seconds after the first of them arrives, and a badgeclass
+    that is already waiting is not buffered again.
+
+    :return: True if the badgeclass was added to the buffer
+    """
+    if not getattr(settings, 'BADGERANK_NOTIFY_ENABLED', True):
+        return False
 
     try:
-        badgeclass = BadgeClass.cached.get(pk=badgeclass_pk)
-    except BadgeClass.DoesNotExist:
-        return {
-            'success': False,
-            'error': "Unknown badgeclass pk={}".format(badgeclass_pk)
-        }
+        with transaction.atomic():
+            notification, created = PendingBadgeRankNotification.objects.get_or_create(badgeclass_id=badgeclass_pk)
+    except IntegrityError:
+        created = False  # a concurrent enqueue buffered the same badgeclass
+
+    # a lost flag only schedules an extra flush, and a flush that never ran is retried by the next enqueue after the
+    # flag expires; the buffer itself lives in the database
+    window = getattr(settings, 'BADGERANK_NOTIFY_WINDOW', 60)
+    if cache.add(BADGERANK_FLUSH_SCHEDULED_CACHE_KEY, True, timeout=window):
+        flush_badgerank_notifications.apply_async(countdown=window)
+    return created
+
+
+@app.task(bind=True, queue=badgerank_task_queue_name)
+def notify_badgerank_of_badgeclass(self, badgeclass_pk):
+    # kept so notifications queued before buffering was introduced are still delivered
+    return {
+        'success': True,
+        'buffered': enqueue_badgerank_notification(badgeclass_pk)
+    }
+
 
+@app.task(bind=True, queue=badgerank_task_queue_name)
+def flush_badgerank_notifications(self):
+    """
+    Submit every buffered badgeclass to BadgeRank, in batches of BADGERANK_NOTIFY_BATCH_SIZE.
+    """
+    pending = dict(PendingBadgeRankNotification.objects.values_list('pk', 'badgeclass_id'))
+
+    urls = [b.public_url for b in BadgeClass.objects.filter(pk__in=set(pending.values()))]
+    batch_size = getattr(settings, 'BADGERANK_NOTIFY_BATCH_SIZE', 50)
+    for i in range(0, len(urls), batch_size):
+        submit_badgerank_notifications.delay(urls=urls[i:i + batch_size])
+    # removed only once submitted, so a flush that dies part way submits some badgeclasses twice instead of dropping
+    # them
+    PendingBadgeRankNotification.objects.filter(pk__in=list(pending.keys())).delete()
+
+    return {
+        'success': True,
+        'count': len(urls)
+    }
+
+
+@app.task(bind=True, queue=badgerank_task_queue_name, max_retries=10,
+          rate_limit=getattr(settings, 'BADGERANK_NOTIFY_RATE_LIMIT', None))
+def submit_badgerank_notifications(self, urls):
+    """
+    Post each badgeclass url to BadgeRank over one pooled session. Urls that fail with a connection error or a server
+    error are retried with exponential backoff; the rest are not resent.
+    """
     badgerank_notify_url = getattr(settings, 'BADGERANK_NOTIFY_URL', 'https://api.badgerank.org/v1/badgeclass/submit')
-    response = requests.post(badgerank_notify_url, json=dict(url=badgeclass.public_url))
-    if response.status_code != 200:
-        return {
-            'success': False,
-            'status_code': response.status_code,
-            'response': response.content
-        }
+    interval = getattr(settings, 'BADGERANK_NOTIFY_INTERVAL', 0)
+    session = badgerank_session()
+
+    retry_urls = []
+    rejected = []
+    for i, url in enumerate(urls):
+        if interval and i > 0:
+            time.sleep(interval)
+        try:
+            response = session.post(badgerank_notify_url, json=dict(url=url), timeout=(3.05, 10))
+        except (ConnectionError, requests.Timeout):
+            retry_urls.append(url)
+            continue
+        if response.status_code >= 500 or response.status_code == 429:
+            retry_urls.append(url)
+        elif response.status_code != 200:
+            rejected.append({'url': url, 'status_code': response.status_code})
+
+    if retry_urls:
+        if self.request.retries < self.max_retries:
+            raise self.retry(kwargs={'urls': retry_urls}, countdown=2 ** self.request.retries)
+        rejected.extend({'url': url, 'status_code': None} for url in retry_urls)
+
     return {
-        'success': True
+        'success': not rejected,
+        'count': len(urls),
+        'rejected': rejected
     }
 
 
@@ -301,6 +386,138 @@ def remove_backpack_duplicate_issuer(self, issuer_entity_id=None, report_only=Fa
     }
 
 
+EARNER_NOTIFICATIONS_SCHEDULED_CACHE_KEY = 'earner_notifications_scheduled'
+
+
+def schedule_earner_notifications():
+    """
+    Make sure a send_earner_notifications run is scheduled, EARNER_NOTIFICATION_DELAY seconds out so notifications
+    queued in quick succession are sent together.
+    """
+    delay = getattr(settings, 'EARNER_NOTIFICATION_DELAY', 5)
+    if cache.add(EARNER_NOTIFICATIONS_SCHEDULED_CACHE_KEY, True, timeout=max(delay * 10, 60)):
+        send_earner_notifications.apply_async(countdown=delay)
+
+
+def _claim_earner_notifications(after_pk, batch_size):
+    now = timezone.now()
+    # a batch claimed by a worker that died before finishing it is picked up again
+    abandoned = now - datetime.timedelta(seconds=getattr(settings, 'EARNER_NOTIFICATION_CLAIM_TIMEOUT', 600))
+    pending = Q(status=EarnerNotification.STATUS_PENDING)
+    abandoned_claim = Q(status=EarnerNotification.STATUS_SENDING, claimed_at__lt=abandoned)
+    claimable = EarnerNotification.objects.filter(pk__gt=after_pk).filter(pending | abandoned_claim)
+    pks = list(claimable.order_by('pk').values_list('pk', flat=True)[:batch_size])
+    if not pks:
+        return []
+
+    claimable.filter(pk__in=pks).update(status=EarnerNotification.STATUS_SENDING, claimed_at=now)
+    return list(EarnerNotification.objects.filter(
+        pk__in=pks, status=EarnerNotification.STATUS_SENDING, claimed_at=now
+    ).select_related('badgeinstance__badgeclass', 'badgeinstance__issuer', 'badgr_app').order_by('pk'))
+
+
+def _send_earner_notification_batch(notifications):
+    from allauth.account.adapter import get_adapter
+    from badgeuser.models import CachedEmailAddress
+    from mainsite.models import BadgrApp, EmailBlacklist
+
+    emails = {n.badgeinstance.recipient_identifier for n in notifications}
+    blacklisted = EmailBlacklist.objects.blacklisted(emails)
+    verified = set(CachedEmailAddress.objects.filter(email__in=emails, verified=True).values_list('email', flat=True))
+
+    adapter = get_adapter()
+    badgr_apps = {}
+    groups = OrderedDict()
+    suppressed = []
+    failed = []
+    for notification in notifications:
+        badgeinstance = notification.badgeinstance
+        email = badgeinstance.recipient_identifier
+        if email in blacklisted:
+            badgrLogger.event(badgrlog.BlacklistEarnerNotNotifiedEvent(badgeinstance))
+            suppressed.append(notification.pk)
+            continue
+
+        badgr_app = notification.badgr_app
+        if badgr_app is None:
+            if badgeinstance.issuer_id not in badgr_apps:
+                badgr_apps[badgeinstance.issuer_id] = \
+                    badgeinstance.issuer.cached_badgrapp or BadgrApp.objects.get_current(None)
+            badgr_app = badgr_apps[badgeinstance.issuer_id]
+
+        try:
+            template_name, context = badgeinstance.get_earner_notification_email(
+                badgr_app, renotify=notification.renotify, recipient_verified=email in verified)
+            message = adapter.prepare_mail(template_name, email, context)
+        except Exception:
+            logger.exception("Unable to render earner notification {}".format(notification.pk))
+            failed.append(notification.pk)
+            continue
+        groups.setdefault((template_name, badgr_app.pk), []).append((notification.pk, message))
+
+    sent = []
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception:
+        # nothing can be sent; the whole batch goes back to the outbox for the next run
+        logger.exception("Unable to open a mail connection for earner notifications")
+        failed.extend(pk for group in list(groups.values()) for pk, message in group)
+    else:
+        try:
+            for group in list(groups.values()):
+                try:
+                    connection.send_messages([message for pk, message in group])
+                except Exception:
+                    logger.exception("Unable to send earner notifications")
+                    failed.extend(pk for pk, message in group)
+                else:
+                    sent.extend(pk for pk, message in group)
+        finally:
+            connection.close()
+
+    EarnerNotification.objects.filter(pk__in=sent).update(
+        status=EarnerNotification.STATUS_SENT, sent_at=timezone.now())
+    EarnerNotification.objects.filter(pk__in=suppressed).update(status=EarnerNotification.STATUS_SUPPRESSED)
+    max_attempts = getattr(settings, 'EARNER_NOTIFICATION_MAX_ATTEMPTS', 5)
+    EarnerNotification.objects.filter(pk__in=failed).update(attempts=F('attempts') + 1)
+    EarnerNotification.objects.filter(pk__in=failed, attempts__lt=max_attempts).update(
+        status=EarnerNotification.STATUS_PENDING)
+    EarnerNotification.objects.filter(pk__in=failed, attempts__gte=max_attempts).update(
+        status=EarnerNotification.STATUS_FAILED)
+    return len(sent), len(suppressed), len(failed)
+
+
+@app.task(bind=True, queue=background_task_queue_name)
+def send_earner_notifications(self):
+    """
+    Drain the earner notification outbox in batches of EARNER_NOTIFICATION_BATCH_SIZE. Each batch is rendered with
+    one account adapter, so templates are compiled once, and sent over one mail connection, grouped by template and
+    BadgrApp. Notifications that fail are left for the next run.
+    """
+    cache.delete(EARNER_NOTIFICATIONS_SCHEDULED_CACHE_KEY)
+
+    batch_size = getattr(settings, 'EARNER_NOTIFICATION_BATCH_SIZE', 200)
+    after_pk = 0
+    totals = [0, 0, 0]
+    while True:
+        notifications = _claim_earner_notifications(after_pk, batch_size)
+        if not notifications:
+            break
+        after_pk = notifications[-1].pk
+        totals = [t + c for t, c in zip(totals, _send_earner_notification_batch(notifications))]
+
+    if totals[2]:
+        schedule_earner_notifications()
+
+    return {
+        'success': not totals[2],
+        'sent': totals[0],
+        'suppressed': totals[1],
+        'failed': totals[2],
+    }
+
+
 @app.task(bind=True, queue=background_task_queue_name)
 def resend_notifications(self, badgeinstance_entity_ids):
     current = 0
@@ -14,14 +14,19 @@ import re
 from urllib.parse import quote_plus
 
 from django.core import mail
+from django.core.mail import get_connection
+from django.db import transaction
 from django.urls import reverse
 from django.utils import timezone
 from django.test import override_settings
 from oauth2_provider.models import Application
 
 from badgeuser.models import CachedEmailAddress, UserRecipientIdentifier
-from issuer.models import BadgeInstance, EmailBlacklist, IssuerStaff, Issuer
+from issuer.api import IssuerBadgeInstanceList
+from issuer.models import BadgeInstance, EarnerNotification, IssuerStaff, Issuer
+from issuer.serializers_v2 import BadgeInstanceSerializerV2
 from issuer.utils import parse_original_datetime
+from mainsite.models import EmailBlacklist
 from mainsite.tests import BadgrTestCase, SetupIssuerHelper, SetupOAuth2ApplicationHelper
 from mainsite.utils import OriginSetting, hash_for_image
 from rest_framework import serializers
@@ -560,6 +565,50 @@ class AssertionTests(SetupIssuerHelper, BadgrTestCase):
         instance.notify_earner(self.badgr_app)
         self.assertEqual(len(mail.outbox), 2)
 
+    @override_settings(GDPR_COMPLIANCE_NOTIFY_ON_FIRST_AWARD=False)
+    def test_earner_notifications_are_sent_in_one_batch(self):
+        test_user = self.setup_user(authenticate=True)
+        test_issuer = self.setup_issuer(owner=test_user)
+        test_badgeclass = self.setup_badgeclass(issuer=test_issuer)
+        instances = [test_badgeclass.issue(recipient_id='batch{}@example.com'.format(i)) for i in range(3)]
+        EmailBlacklist(email='batch2@example.com').save()
+        sent_before = len(mail.outbox)
+
+        with patch('issuer.tasks.get_connection', wraps=get_connection) as connections:
+            with transaction.atomic():
+                for instance in instances:
+                    instance.notify_earner(self.badgr_app)
+                # nothing is sent until the issuing transaction commits
+                self.assertEqual(len(mail.outbox), sent_before)
+
+        self.assertEqual(connections.call_count, 1)
+        self.assertEqual(len(mail.outbox), sent_before + 2)
+        self.assertEqual(EarnerNotification.objects.filter(
+            badgeinstance__in=instances, status=EarnerNotification.STATUS_SENT).count(), 2)
+        self.assertEqual(EarnerNotification.objects.get(
+            badgeinstance=instances[2]).status, EarnerNotification.STATUS_SUPPRESSED)
+
+    @override_settings(GDPR_COMPLIANCE_NOTIFY_ON_FIRST_AWARD=False)
+    def test_earner_notifications_return_to_the_outbox_when_mail_is_down(self):
+        from issuer.tasks import send_earner_notifications
+
+        test_user = self.setup_user(authenticate=True)
+        test_issuer = self.setup_issuer(owner=test_user)
+        test_badgeclass = self.setup_badgeclass(issuer=test_issuer)
+        instance = test_badgeclass.issue(recipient_id='unreachable@example.com')
+
+        with patch('issuer.tasks.send_earner_notifications.apply_async') as apply_async:
+            instance.notify_earner(self.badgr_app)
+            with patch('issuer.tasks.get_connection') as connection:
+                connection.return_value.open.side_effect = ConnectionRefusedError
+                send_earner_notifications.apply()
+
+        notification = EarnerNotification.objects.get(badgeinstance=instance)
+        self.assertEqual(notification.status, EarnerNotification.STATUS_PENDING)
+        self.assertEqual(notification.attempts, 1)
+        # once when the notification was queued, and again to retry it
+        self.assertEqual(apply_async.call_count, 2)
+
     def test_issue_badge_with_ob1_evidence(self):
         test_user = self.setup_user(authenticate=True)
         test_issuer = self.setup_issuer(owner=test_user)
@@ -1253,6 +1302,23 @@ class AssertionTests(SetupIssuerHelper, BadgrTestCase):
 
 
 class V2ApiAssertionTests(SetupIssuerHelper, BadgrTestCase):
+    def test_v2_paginated_assertion_list_defers_unread_columns(self):
+        test_user = self.setup_user(authenticate=True)
+        test_issuer = self.setup_issuer(owner=test_user)
+        test_badgeclass = self.setup_badgeclass(issuer=test_issuer)
+        test_badgeclass.issue(recipient_id='test3@example.com')
+
+        queryset = IssuerBadgeInstanceList().project_queryset(
+            BadgeInstance.objects.filter(issuer=test_issuer), serializer_class=BadgeInstanceSerializerV2)
+        instance = queryset.get()
+        self.assertIn('old_json', instance.get_deferred_fields())
+        self.assertNotIn('original_json', instance.get_deferred_fields())
+        self.assertEqual(instance.old_json, BadgeInstance.objects.get(pk=instance.pk).old_json)
+
+        response = self.client.get('/v2/issuers/{issuer}/assertions?num=10'.format(issuer=test_issuer.entity_id))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['result']), 1)
+
     def test_v2_issue_by_badgeclassOpenBadgeId(self):
         test_user = self.setup_user(authenticate=True)
         test_issuer = self.setup_issuer(owner=test_user)
@@ -5,11 +5,14 @@ import base64
 import json
 from urllib.parse import quote_plus
 
+import mock
+import responses
 from django.core.files.images import get_image_dimensions
 from django.urls import reverse
+from django.test import override_settings
 from django.utils import timezone
 
-from issuer.models import BadgeClass, IssuerStaff
+from issuer.models import BadgeClass, IssuerStaff, PendingBadgeRankNotification
 from mainsite.tests import BadgrTestCase, SetupIssuerHelper
 from mainsite.utils import OriginSetting
 
@@ -1200,3 +1203,27 @@ class BadgeClassesChangedApplicationTests(SetupIssuerHelper, BadgrTestCase):
         response = self.client.get('/v2/badgeclasses/changed?since={}'.format(quote_plus(timestamp)))
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(response.data['result']), 1)
+
+
+class BadgeRankNotificationTests(SetupIssuerHelper, BadgrTestCase):
+    @override_settings(BADGERANK_NOTIFY_URL='http://badgerank.example.com/submit')
+    @responses.activate
+    def test_notifications_are_coalesced(self):
+        from issuer.tasks import enqueue_badgerank_notification, flush_badgerank_notifications
+        responses.add(responses.POST, 'http://badgerank.example.com/submit', status=200)
+
+        with mock.patch('issuer.tasks.flush_badgerank_notifications.apply_async') as apply_async:
+            test_issuer = self.setup_issuer(owner=self.setup_user())
+            badgeclasses = list(self.setup_badgeclasses(issuer=test_issuer, how_many=2))
+            self.assertFalse(enqueue_badgerank_notification(badgeclasses[0].pk))
+        self.assertEqual(apply_async.call_count, 1)
+        self.assertEqual(len(responses.calls), 0)
+
+        flush_badgerank_notifications.apply()
+        submitted = {json.loads(call.request.body)['url'] for call in responses.calls}
+        self.assertEqual(submitted, {b.public_url for b in badgeclasses})
+        self.assertFalse(PendingBadgeRankNotification.objects.exists())
+
+        # once flushed, a badgeclass can be buffered again
+        with mock.patch('issuer.tasks.flush_badgerank_notifications.apply_async'):
+            self.assertTrue(enqueue_badgerank_notification(badgeclasses[0].pk))
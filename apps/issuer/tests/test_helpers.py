@@ -0,0 +1,114 @@
+# encoding: utf-8
+
+
+import datetime
+
+import requests_cache
+import responses
+from django.core.cache import cache
+from openbadges.verifier.openbadges_context import OPENBADGES_CONTEXT_V1_URI, OPENBADGES_CONTEXT_V2_URI, \
+    OPENBADGES_CONTEXT_V2_DICT
+
+from issuer.helpers import BadgeCheckHelper, DjangoCacheRequestsCacheBackend, OpenBadgesContextCache
+from issuer.prefetch import prefetch_badge_graph
+from mainsite.tests import BadgrTestCase
+
+
+class DjangoCacheRequestsCacheBackendTests(BadgrTestCase):
+    url = 'http://a.com/badgeclass'
+
+    def _session(self, backend):
+        return requests_cache.CachedSession(backend=backend, expire_after=300)
+
+    def _expire(self, backend):
+        key = backend._url_to_key(self.url)
+        response, created_at = cache.get(backend._cache_key('response', key))
+        cache.set(backend._cache_key('response', key), (response, created_at - datetime.timedelta(seconds=600)))
+
+    @responses.activate
+    def test_responses_are_shared_between_backend_instances(self):
+        responses.add(responses.GET, self.url, body='{"name": "shared"}')
+
+        first = self._session(DjangoCacheRequestsCacheBackend(namespace='test-requests-cache'))
+        second = self._session(DjangoCacheRequestsCacheBackend(namespace='test-requests-cache'))
+        self.assertFalse(first.get(self.url).from_cache)
+        response = second.get(self.url)
+        self.assertTrue(response.from_cache)
+        self.assertEqual(response.json(), {'name': 'shared'})
+        self.assertEqual(len(responses.calls), 1)
+
+        second.cache.clear()
+        self.assertFalse(first.get(self.url).from_cache)
+
+    @responses.activate
+    def test_expired_responses_are_revalidated(self):
+        responses.add(responses.GET, self.url, body='{"name": "v1"}', headers={'ETag': '"v1"'})
+        responses.add(responses.GET, self.url, status=304)
+        backend = DjangoCacheRequestsCacheBackend(namespace='test-requests-cache')
+        session = self._session(backend)
+
+        session.get(self.url)
+        self._expire(backend)
+        response = session.get(self.url)
+        self.assertTrue(response.from_cache)
+        self.assertEqual(response.json(), {'name': 'v1'})
+        self.assertEqual(len(responses.calls), 2)
+        self.assertEqual(responses.calls[1].request.headers['If-None-Match'], '"v1"')
+
+        # the 304 renewed the stored response
+        self.assertTrue(session.get(self.url).from_cache)
+        self.assertEqual(len(responses.calls), 2)
+
+    @responses.activate
+    def test_expired_responses_without_validators_are_refetched(self):
+        responses.add(responses.GET, self.url, body='{"name": "v1"}')
+        responses.add(responses.GET, self.url, body='{"name": "v2"}')
+        backend = DjangoCacheRequestsCacheBackend(namespace='test-requests-cache')
+        session = self._session(backend)
+
+        session.get(self.url)
+        self._expire(backend)
+        response = session.get(self.url)
+        self.assertFalse(response.from_cache)
+        self.assertEqual(response.json(), {'name': 'v2'})
+
+    @responses.activate
+    def test_bundled_contexts_are_not_fetched(self):
+        for backend in (DjangoCacheRequestsCacheBackend(namespace='test-requests-cache'), OpenBadgesContextCache()):
+            session = self._session(backend)
+            response = session.get(OPENBADGES_CONTEXT_V2_URI, headers={'Accept': 'application/ld+json, application/json'})
+            self.assertTrue(response.from_cache)
+            self.assertEqual(response.json(), OPENBADGES_CONTEXT_V2_DICT)
+            self.assertIn('@context', session.get(OPENBADGES_CONTEXT_V1_URI).json())
+        self.assertEqual(len(responses.calls), 0)
+
+
+class PrefetchBadgeGraphTests(BadgrTestCase):
+    @responses.activate
+    def test_prefetch_warms_the_verification_cache(self):
+        responses.add(responses.GET, 'http://a.com/assertion', json={
+            'id': 'http://a.com/assertion', 'badge': 'http://a.com/badgeclass', 'image': 'http://a.com/assertion.png',
+            'verification': {'type': 'hosted'}})
+        responses.add(responses.GET, 'http://a.com/badgeclass', json={
+            'id': 'http://a.com/badgeclass', 'issuer': 'http://a.com/issuer', 'image': {'id': 'http://a.com/badge.png'}})
+        responses.add(responses.GET, 'http://a.com/issuer', json={
+            'id': 'http://a.com/issuer', 'image': 'data:image/png;base64,AAAA'})
+        for image in ('http://a.com/assertion.png', 'http://a.com/badge.png'):
+            responses.add(responses.GET, image, body=b'PNG', content_type='image/png')
+
+        fetched = prefetch_badge_graph('http://a.com/assertion')
+        self.assertEqual(fetched, {
+            'http://a.com/assertion', 'http://a.com/badgeclass', 'http://a.com/issuer',
+            'http://a.com/assertion.png', 'http://a.com/badge.png'})
+        self.assertEqual(len(responses.calls), 5)
+
+        session = requests_cache.CachedSession(backend=BadgeCheckHelper.cache_instance(), expire_after=300)
+        for url in fetched:
+            self.assertTrue(session.get(url).from_cache)
+        self.assertEqual(len(responses.calls), 5)
+
+    @responses.activate
+    def test_prefetch_ignores_unreachable_documents(self):
+        responses.add(responses.GET, 'http://a.com/assertion', status=404)
+        self.assertEqual(prefetch_badge_graph('http://a.com/assertion'), {'http://a.com/assertion'})
+        self.assertEqual(prefetch_badge_graph('not a badge'), set())
@@ -216,6 +216,37 @@ class PublicAPITests(SetupIssuerHelper, BadgrTestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.data['entityId'], test_collection.entity_id)
 
+    def test_public_collection_json_is_cached_until_an_assertion_publishes(self):
+        test_user_email = 'test.user@email.test'
+
+        test_user = self.setup_user(authenticate=False, email=test_user_email)
+        test_issuer = self.setup_issuer(owner=test_user)
+        test_badgeclass = self.setup_badgeclass(issuer=test_issuer)
+        assertion = test_badgeclass.issue(recipient_id=test_user_email)
+
+        test_collection = BackpackCollection.objects.create(created_by=test_user, name='Test Collection',
+                                                            description="testing")
+        BackpackCollectionBadgeInstance.objects.create(collection=test_collection, badgeinstance=assertion,
+                                                       badgeuser=test_user)
+        test_collection.published = True
+        test_collection.save()
+        url = '/public/collections/{}?expand=badges.badge'.format(test_collection.share_hash)
+
+        response = self.client.get(url, header={'Accept': 'application/json'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['badges']), 1)
+        with self.assertNumQueries(0):
+            cached_response = self.client.get(url, header={'Accept': 'application/json'})
+        self.assertEqual(cached_response.data, response.data)
+
+        preview = test_collection.cached_preview()
+        self.assertIn(assertion.entity_id, preview['image_url'])
+
+        assertion.revoke('Revoked for testing')
+        response = self.client.get(url, header={'Accept': 'application/json'})
+        self.assertEqual(len(response.data['badges']), 0)
+        self.assertEqual(test_collection.cached_preview()['image_url'], '')
+
     def test_get_assertion_html_redirects_to_frontend(self):
         badgr_app = BadgrApp(
             cors='frontend.ui', is_default=True, signup_redirect='http://frontend.ui/signup', public_pages_redirect='http://frontend.ui/public'
@@ -9,6 +9,9 @@ from allauth.exceptions import ImmediateHttpResponse
 from django.conf import settings
 from django.contrib.auth.tokens import default_token_generator
 from django.contrib.sites.shortcuts import get_current_site
+from django.core.mail import EmailMessage, EmailMultiAlternatives
+from django.template import TemplateDoesNotExist
+from django.template.loader import get_template
 from django.urls import resolve, Resolver404, reverse
 
 from badgeuser.authcode import authcode_for_accesstoken
@@ -26,6 +29,13 @@ class BadgrAccountAdapter(DefaultAccountAdapter):
     EMAIL_FROM_STRING = ''
 
     def send_mail(self, template_prefix, email, context):
+        msg = self.prepare_mail(template_prefix, email, context)
+        msg.send()
+
+    def prepare_mail(self, template_prefix, email, context):
+        """
+        Render the message send_mail would send, without sending it.
+        """
         context['STATIC_URL'] = getattr(settings, 'STATIC_URL')
         context['HTTP_ORIGIN'] = getattr(settings, 'HTTP_ORIGIN')
         context['PRIVACY_POLICY_URL'] = getattr(settings, 'PRIVACY_POLICY_URL', None)
@@ -47,7 +57,46 @@ class BadgrAccountAdapter(DefaultAccountAdapter):
 
         msg = self.render_mail(template_prefix, email, context)
         logger.event(badgrlog.EmailRendered(msg))
-        msg.send()
+        return msg
+
+    def render_mail(self, template_prefix, email, context):
+        """
+        allauth's render_mail, keeping each compiled template on the adapter so rendering a batch of messages with one
+        adapter loads and parses every template once.
+        """
+        to = [email] if isinstance(email, str) else email
+        subject = self._render_template('{0}_subject.txt'.format(template_prefix), context)
+        subject = " ".join(subject.splitlines()).strip()
+        subject = self.format_email_subject(subject)
+        from_email = self.get_from_email()
+
+        bodies = {}
+        for ext in ['html', 'txt']:
+            try:
+                bodies[ext] = self._render_template('{0}_message.{1}'.format(template_prefix, ext), context).strip()
+            except TemplateDoesNotExist:
+                if ext == 'txt' and not bodies:
+                    # We need at least one body
+                    raise
+        if 'txt' in bodies:
+            msg = EmailMultiAlternatives(subject, bodies['txt'], from_email, to)
+            if 'html' in bodies:
+                msg.attach_alternative(bodies['html'], 'text/html')
+        else:
+            msg = EmailMessage(subject, bodies['html'], from_email, to)
+            msg.content_subtype = 'html'  # Main content is now text/html
+        return msg
+
+    def _render_template(self, template_name, context):
+        templates = self.__dict__.setdefault('_templates', {})
+        if template_name not in templates:
+            try:
+                templates[template_name] = get_template(template_name)
+            except TemplateDoesNotExist:
+                templates[template_name] = None
+        if templates[template_name] is None:
+            raise TemplateDoesNotExist(template_name)
+        return templates[template_name].render(context, getattr(self, 'request', None))
 
     def set_email_string(self, context):
         # site_name should not contain commas.
@@ -1,5 +1,6 @@
 from django.apps import AppConfig
 from django.conf import settings
+from django.db.models.signals import post_delete, post_save
 
 from corsheaders.signals import check_request_enabled
 
@@ -12,3 +13,12 @@ class BadgrConfig(AppConfig):
         if getattr(settings, 'BADGR_CORS_MODEL'):
             from mainsite.signals import cors_allowed_sites
             check_request_enabled.connect(cors_allowed_sites)
+
+        from mainsite.models import EmailBlacklist
+        from mainsite.signals import handle_email_blacklist_change
+        post_save.connect(handle_email_blacklist_change,
+                          sender=EmailBlacklist,
+                          dispatch_uid="email_blacklist_saved")
+        post_delete.connect(handle_email_blacklist_change,
+                            sender=EmailBlacklist,
+                            dispatch_uid="email_blacklist_deleted")
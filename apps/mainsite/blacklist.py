@@ -1,9 +1,64 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
 from hashlib import sha256
 
 import requests
-from requests.exceptions import ConnectionError
+import requests.adapters
+from requests.exceptions import RequestException
 
 from django.conf import settings
+from django.core.cache import cache
+
+
+SYNCED_HASHES_VERSION_CACHE_KEY = 'blacklist_synced_hashes_version'
+
+_session = None
+
+# this process's copy of the synced hash set: (version, hashes, time the version was last checked)
+_synced_hashes = (None, None, 0)
+
+
+def blacklist_session():
+    """
+    The requests.Session used to talk to the blacklist service, shared so its connections are reused.
+    """
+    global _session
+    if _session is None:
+        pool_size = getattr(settings, 'BADGR_BLACKLIST_POOL_MAXSIZE', 10)
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _session = session
+    return _session
+
+
+def _authorization_headers(blacklist_api_key):
+    return {
+        "Authorization": "BEARER {api_key}".format(
+            api_key=blacklist_api_key
+        ),
+    }
+
+
+def _timeout():
+    return getattr(settings, 'BADGR_BLACKLIST_TIMEOUT', (2, 5))
+
+
+def _cache_key(recipient_id_hash):
+    return 'blacklist_{}'.format(recipient_id_hash)
+
+
+def _cache_results(results):
+    """
+    Remember query results by recipient id hash; positive results are kept longer than negative ones
+    """
+    for in_blacklist, timeout in (
+            (True, getattr(settings, 'BADGR_BLACKLIST_POSITIVE_CACHE_TIMEOUT', 60 * 60)),
+            (False, getattr(settings, 'BADGR_BLACKLIST_NEGATIVE_CACHE_TIMEOUT', 60 * 5))):
+        values = {_cache_key(h): in_blacklist for h, result in list(results.items()) if result == in_blacklist}
+        if values:
+            cache.set_many(values, timeout=timeout)
 
 
 def api_submit_recipient_id(id_type, recipient_id):
@@ -13,15 +68,14 @@ def api_submit_recipient_id(id_type, recipient_id):
         recipient_id_hash = generate_hash(id_type, recipient_id)
 
         try:
-            response = requests.post(
-                blacklist_query_endpoint, json={"id": recipient_id_hash}, headers={
-                    "Authorization": "BEARER {api_key}".format(
-                        api_key=blacklist_api_key
-                    ),
-                })
-        except ConnectionError:
+            response = blacklist_session().post(
+                blacklist_query_endpoint, json={"id": recipient_id_hash},
+                headers=_authorization_headers(blacklist_api_key), timeout=_timeout())
+        except RequestException:
             return None
 
+        if response.status_code in (200, 201):
+            _cache_results({recipient_id_hash: True})
         return response
     else:
         return None
@@ -34,35 +88,134 @@ def api_query_recipient_id(id_type, recipient_id, blacklist_query_endpoint, blac
         recipient_id_hash=recipient_id_hash)
 
     try:
-        response = requests.get(request_query, headers={
-            "Authorization": "BEARER {api_key}".format(
-                api_key=blacklist_api_key
-            ),
-        })
-    except ConnectionError:
+        response = blacklist_session().get(
+            request_query, headers=_authorization_headers(blacklist_api_key), timeout=_timeout())
+    except RequestException:
         return None
 
     return response
 
 
+def sync_blacklist_hashes():
+    """
+    Download every blacklisted hash from BADGR_BLACKLIST_SYNC_ENDPOINT and share the set through the cache, so checks
+    can be answered without querying the blacklist service. Expects a json list of hashes or of {"id": hash} objects.
+
+    :return: the number of hashes synced, or None if the sync endpoint isn't configured or didn't answer
+    """
+    global _synced_hashes
+    blacklist_api_key = getattr(settings, 'BADGR_BLACKLIST_API_KEY', None)
+    blacklist_sync_endpoint = getattr(settings, 'BADGR_BLACKLIST_SYNC_ENDPOINT', None)
+    if not (blacklist_api_key and blacklist_sync_endpoint):
+        return None
+
+    try:
+        response = blacklist_session().get(
+            blacklist_sync_endpoint, headers=_authorization_headers(blacklist_api_key),
+            timeout=getattr(settings, 'BADGR_BLACKLIST_SYNC_TIMEOUT', (2, 30)))
+        entries = response.json() if response.status_code == 200 else None
+    except (RequestException, ValueError):
+        entries = None
+    if not isinstance(entries, list):
+        return None
+
+    hashes = frozenset(e.get('id') if isinstance(e, dict) else e for e in entries)
+    version = sha256(''.join(sorted(h for h in hashes if h)).encode('utf-8')).hexdigest()
+    # the synced set is only trusted while it is fresh; once it expires checks fall back to querying the service
+    max_age = getattr(settings, 'BADGR_BLACKLIST_SYNC_MAX_AGE', 60 * 60 * 24)
+    cache.set('blacklist_synced_hashes_{}'.format(version), hashes, timeout=max_age)
+    cache.set(SYNCED_HASHES_VERSION_CACHE_KEY, version, timeout=max_age)
+    _synced_hashes = (version, hashes, time.time())
+    return len(hashes)
+
+
+def synced_blacklist_hashes():
+    """
+    :return: the synced set of blacklisted hashes, or None if there isn't a fresh one
+    """
+    global _synced_hashes
+    if not getattr(settings, 'BADGR_BLACKLIST_SYNC_ENDPOINT', None):
+        return None
+
+    local_version, hashes, checked_at = _synced_hashes
+    if time.time() - checked_at < getattr(settings, 'BADGR_BLACKLIST_SYNC_LOCAL_TIMEOUT', 60):
+        return hashes
+
+    version = cache.get(SYNCED_HASHES_VERSION_CACHE_KEY)
+    if version is None:
+        hashes = None
+    elif version != local_version:
+        hashes = cache.get('blacklist_synced_hashes_{}'.format(version))
+    _synced_hashes = (version, hashes, time.time())
+    return hashes
+
+
 def api_query_is_in_blacklist(id_type, recipient_id):
+    return api_query_are_in_blacklist([(id_type, recipient_id)])[(id_type, recipient_id)]
+
+
+def api_query_are_in_blacklist(recipients):
+    """
+    Check many recipients at once, answering from the synced hash set and cached results where possible and querying
+    the blacklist service concurrently for the rest.
+
+    :param recipients: iterable of (id_type, recipient_id)
+    :return: dict of (id_type, recipient_id) -> whether the recipient is in the blacklist
+    """
+    recipients = set(recipients)
     blacklist_api_key = getattr(settings, 'BADGR_BLACKLIST_API_KEY', None)
     blacklist_query_endpoint = getattr(settings, 'BADGR_BLACKLIST_QUERY_ENDPOINT', None)
-    if blacklist_query_endpoint and blacklist_api_key:
-        response = api_query_recipient_id(id_type, recipient_id, blacklist_query_endpoint, blacklist_api_key)
-
-        if response and response.status_code == 200:
-            query = response.json()
-            if len(query) > 0:
-                return True
-            else:
-                return False
+    if not (blacklist_query_endpoint and blacklist_api_key):
+        return {r: False for r in recipients}
+
+    hashes = {r: generate_hash(*r) for r in recipients}
+    results = {}
+
+    synced_hashes = synced_blacklist_hashes()
+    if synced_hashes is not None:
+        for r in recipients:
+            if hashes[r] in synced_hashes:
+                results[r] = True
+
+    unresolved = [r for r in recipients if r not in results]
+    cached = cache.get_many([_cache_key(hashes[r]) for r in unresolved])
+    misses = []
+    for r in unresolved:
+        in_blacklist = cached.get(_cache_key(hashes[r]))
+        if in_blacklist is not None:
+            results[r] = in_blacklist
+        elif synced_hashes is not None:
+            # absent from a fresh synced set and not submitted since
+            results[r] = False
+        else:
+            misses.append(r)
+
+    def _query(recipient):
+        return api_query_recipient_id(recipient[0], recipient[1], blacklist_query_endpoint, blacklist_api_key)
+
+    if len(misses) == 1:
+        responses = [_query(misses[0])]
+    elif misses:
+        max_workers = min(len(misses), getattr(settings, 'BADGR_BLACKLIST_QUERY_WORKERS', 4))
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            responses = list(pool.map(_query, misses))
+    else:
+        responses = []
 
+    to_cache = {}
+    for r, response in zip(misses, responses):
         if response is None:
             raise Exception("Blacklist failed to respond")
 
-        return False
-    return False
+        if response.status_code == 200:
+            results[r] = to_cache[hashes[r]] = len(response.json()) > 0
+        else:
+            results[r] = False
+            if response.status_code == 404:
+                to_cache[hashes[r]] = False
+    _cache_results(to_cache)
+
+    return results
 
 
 def generate_hash(id_type, id_value):
@@ -0,0 +1,150 @@
+# encoding: utf-8
+"""
+Compact stand-ins for cached querysets.
+
+cachemodel's @cached_method pickles whatever the decorated method returns, which for a queryset means every row
+(including blobs like original_json and old_json). @cached_pk_list stores an ordered array of primary keys instead,
+and hydrates instances lazily, a page at a time, from the per-instance cache entries written by CacheModel.publish().
+"""
+
+
+from array import array
+from functools import wraps
+
+from cachemodel import CACHE_FOREVER_TIMEOUT
+from cachemodel.utils import generate_cache_key
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+
+
+class CachedPkList(object):
+    """
+    An ordered, read-only sequence of model instances backed by an array of primary keys.
+
+    Only the model label, a format version and the pk array are pickled, so the cached value stays small no matter
+    how many rows it references. Instances are fetched with a single cache.get_many() per batch, and any misses are
+    loaded with one in_bulk() query and written back to the cache.
+    """
+    VERSION = 1
+
+    def __init__(self, model, pks=()):
+        self.model = model
+        self.pks = array('q', pks)
+        self.version = self.VERSION
+        self._instances = {}
+
+    @classmethod
+    def from_queryset(cls, queryset):
+        return cls(queryset.model, queryset.values_list('pk', flat=True))
+
+    def __getstate__(self):
+        return {
+            'model': self.model._meta.label,
+            'version': self.version,
+            'pks': self.pks.tobytes(),
+        }
+
+    def __setstate__(self, state):
+        self.model = apps.get_model(state['model'])
+        self.version = state.get('version')
+        self.pks = array('q')
+        self.pks.frombytes(state['pks'])
+        self._instances = {}
+
+    @property
+    def is_current(self):
+        return self.version == self.VERSION
+
+    @property
+    def batch_size(self):
+        return getattr(settings, 'CACHED_PK_LIST_BATCH_SIZE', 100)
+
+    def instance_cache_key(self, pk):
+        # matches the key written by CacheModel.publish_by('pk') and read by Model.cached.get(pk=)
+        return generate_cache_key([self.model.__name__, "get"], pk=pk)
+
+    def hydrate(self, pks):
+        """
+        Return the instances for pks, in order, skipping any that no longer exist.
+        """
+        missing = [pk for pk in pks if pk not in self._instances]
+        if missing:
+            keys = {self.instance_cache_key(pk): pk for pk in missing}
+            for key, obj in list(cache.get_many(list(keys.keys())).items()):
+                self._instances[keys[key]] = obj
+
+            uncached = [pk for pk in missing if pk not in self._instances]
+            if uncached:
+                fetched = self.model.objects.in_bulk(uncached)
+                cache.set_many({self.instance_cache_key(pk): obj for pk, obj in list(fetched.items())},
+                               CACHE_FOREVER_TIMEOUT)
+                self._instances.update(fetched)
+
+        return [self._instances[pk] for pk in pks if pk in self._instances]
+
+    def __len__(self):
+        return len(self.pks)
+
+    def __bool__(self):
+        return len(self.pks) > 0
+
+    def __iter__(self):
+        batch_size = self.batch_size
+        for start in range(0, len(self.pks), batch_size):
+            for obj in self.hydrate(self.pks[start:start+batch_size]):
+                yield obj
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.hydrate(self.pks[index])
+        pk = self.pks[index]
+        hydrated = self.hydrate([pk])
+        if not hydrated:
+            raise IndexError("{} pk={} no longer exists".format(self.model.__name__, pk))
+        return hydrated[0]
+
+    def __contains__(self, item):
+        return getattr(item, 'pk', item) in self.pks
+
+    def __repr__(self):
+        return '<{}: {} {}>'.format(self.__class__.__name__, len(self.pks), self.model.__name__)
+
+    def count(self):
+        return len(self.pks)
+
+    def exists(self):
+        return len(self.pks) > 0
+
+
+def cached_pk_list(auto_publish=False):
+    """
+    A drop-in replacement for @cachemodel.cached_method on methods that return a queryset.
+
+    The queryset is reduced to a CachedPkList before it is cached. The wrapper carries the same attributes as
+    @cached_method, so CacheModel.publish() republishes it automatically when auto_publish=True.
+    """
+    def decorator(target):
+        @wraps(target)
+        def compact_target(self, *args, **kwargs):
+            return CachedPkList.from_queryset(target(self, *args, **kwargs))
+
+        @wraps(target)
+        def wrapper(self, *args, **kwargs):
+            key = generate_cache_key([self.__class__.__name__, target.__name__, self.pk], *args, **kwargs)
+            data = cache.get(key)
+            if data is None or not getattr(data, 'is_current', False):
+                data = compact_target(self, *args, **kwargs)
+                cache.set(key, data, CACHE_FOREVER_TIMEOUT)
+            return data
+        wrapper._cached_method = True
+        wrapper._cached_method_auto_publish = auto_publish
+        wrapper._cached_method_target = compact_target
+        return wrapper
+
+    if callable(auto_publish):
+        # used with no parens
+        func = auto_publish
+        auto_publish = False
+        return decorator(func)
+    return decorator
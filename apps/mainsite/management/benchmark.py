@@ -0,0 +1,16 @@
+# encoding: utf-8
+import timeit
+
+from django.core.management.base import BaseCommand
+
+
+class BenchmarkCommand(BaseCommand):
+    """
+    Base for management commands that time a few callables and print one line per measurement.
+    """
+    label_width = 40
+
+    def report(self, label, func, iterations):
+        elapsed = timeit.timeit(func, number=iterations)
+        self.stdout.write('{:<{width}} {:>10.3f} ms/call'.format(
+            label, elapsed * 1000.0 / iterations, width=self.label_width))
@@ -0,0 +1,79 @@
+# encoding: utf-8
+
+
+import datetime
+from collections import OrderedDict
+
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from entity.serializers import BaseSerializerV2
+from mainsite.management.benchmark import BenchmarkCommand
+from mainsite.renderers import FastJSONRenderer, dumps_json, native_json_available
+from mainsite.utils import generate_entity_uri
+
+
+def sample_assertion(index):
+    """an OrderedDict shaped like BadgeInstanceSerializerV2 output for an imported assertion"""
+    entity_id = generate_entity_uri()
+    issued_on = timezone.now() - datetime.timedelta(days=index)
+    return OrderedDict([
+        ('entityType', 'Assertion'),
+        ('entityId', entity_id),
+        ('openBadgeId', 'https://api.example.org/public/assertions/{}'.format(entity_id)),
+        ('createdAt', issued_on),
+        ('createdBy', generate_entity_uri()),
+        ('badgeclass', generate_entity_uri()),
+        ('badgeclassOpenBadgeId', 'https://api.example.org/public/badges/{}'.format(generate_entity_uri())),
+        ('issuer', generate_entity_uri()),
+        ('issuerOpenBadgeId', 'https://api.example.org/public/issuers/{}'.format(generate_entity_uri())),
+        ('image', 'https://media.example.org/uploads/badges/assertion-{}.png'.format(entity_id)),
+        ('recipient', OrderedDict([
+            ('identity', 'sha256$' + 'a1b2c3d4' * 8),
+            ('hashed', True),
+            ('type', 'email'),
+            ('plaintextIdentity', 'earner{}@example.org'.format(index)),
+            ('salt', 'c0ffee' * 5),
+        ])),
+        ('issuedOn', issued_on),
+        ('narrative', 'Completed every module of the course, including the capstone project. ' * 3),
+        ('evidence', [OrderedDict([('url', 'https://portfolio.example.org/{}'.format(index)),
+                                   ('narrative', 'Capstone write-up and code review notes.')])]),
+        ('revoked', False),
+        ('revocationReason', None),
+        ('acceptance', 'Unaccepted'),
+        ('expires', None),
+        ('extensions', {
+            'extensions:RecipientProfile': {
+                '@context': 'https://openbadgespec.org/extensions/recipientProfile/context.json',
+                'type': ['Extension', 'extensions:RecipientProfile'],
+                'name': 'Earner Number {} – Ünïcødé'.format(index),
+            },
+        }),
+    ])
+
+
+class Command(BenchmarkCommand):
+    help = 'Compare DRF\'s JSONRenderer with FastJSONRenderer on a v2 assertion list and a bake payload.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=500, help='assertions per list')
+        parser.add_argument('--iterations', type=int, default=20)
+
+    def handle(self, *args, **options):
+        count = options['count']
+        iterations = options['iterations']
+
+        envelope = BaseSerializerV2.response_envelope(
+            result=[sample_assertion(i) for i in range(count)], success=True, description='ok')
+        bake_payload = sample_assertion(0)
+
+        self.stdout.write('native JSON backend: {}'.format('orjson' if native_json_available() else 'unavailable'))
+        self.report('JSONRenderer, {} assertions'.format(count),
+                    lambda: JSONRenderer().render(envelope), iterations)
+        self.report('FastJSONRenderer, {} assertions'.format(count),
+                    lambda: FastJSONRenderer().render(envelope), iterations)
+        self.report('bake payload, stdlib json',
+                    lambda: JSONRenderer().render(bake_payload, 'application/json; indent=2'), iterations * count)
+        self.report('bake payload, dumps_json',
+                    lambda: dumps_json(bake_payload, indent=2), iterations * count)
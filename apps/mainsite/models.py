@@ -1,13 +1,16 @@
 import base64
 import re
+import time
 import urllib.parse
+import uuid
 
 from datetime import datetime, timedelta
-from hashlib import sha1
+from hashlib import sha1, sha256
 import hmac
 
 from basic_models.models import CreatedUpdatedBy, CreatedUpdatedAt, IsActive
 from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import ImproperlyConfigured, ValidationError
 from django.urls import reverse
 from django.db import models, transaction
@@ -26,9 +29,56 @@ from mainsite.utils import set_url_query_params
 AUTH_USER_MODEL = getattr(settings, 'AUTH_USER_MODEL', 'auth.User')
 
 
+class EmailBlacklistManager(models.Manager):
+    VERSION_CACHE_KEY = 'email_blacklist_version'
+
+    # this process's suppression set: (version it was loaded at, 64 bit hashes of the blacklisted emails, time loaded)
+    _suppression = (None, None, 0)
+
+    @staticmethod
+    def hash_email(email):
+        return int.from_bytes(sha256(email.lower().encode('utf-8')).digest()[:8], 'big')
+
+    def suppression_set(self):
+        """
+        The hashes of every blacklisted email, loaded once per process and reloaded when the shared version key
+        changes. Membership can be checked with hash_email() without querying the database.
+
+        The version key only reaches other processes through a shared cache, so the set is also reloaded once it is
+        EMAIL_BLACKLIST_LOCAL_MAX_AGE seconds old.
+        """
+        version = cache.get(self.VERSION_CACHE_KEY)
+        if version is None:
+            version = uuid.uuid4().hex
+            if not cache.add(self.VERSION_CACHE_KEY, version, timeout=None):
+                version = cache.get(self.VERSION_CACHE_KEY)
+
+        local_version, hashes, loaded_at = EmailBlacklistManager._suppression
+        max_age = getattr(settings, 'EMAIL_BLACKLIST_LOCAL_MAX_AGE', 60)
+        if hashes is None or version != local_version or time.time() - loaded_at >= max_age:
+            hashes = frozenset(self.hash_email(e) for e in self.values_list('email', flat=True).iterator())
+            EmailBlacklistManager._suppression = (version, hashes, time.time())
+        return hashes
+
+    def invalidate_suppression_set(self):
+        cache.set(self.VERSION_CACHE_KEY, uuid.uuid4().hex, timeout=None)
+
+    def is_blacklisted(self, email):
+        return self.hash_email(email) in self.suppression_set()
+
+    def blacklisted(self, emails):
+        """
+        :return: the set of emails that are blacklisted
+        """
+        suppression_set = self.suppression_set()
+        return {e for e in emails if self.hash_email(e) in suppression_set}
+
+
 class EmailBlacklist(models.Model):
     email = models.EmailField(unique=True)
 
+    objects = EmailBlacklistManager()
+
     class Meta:
         verbose_name = 'Blacklisted email'
         verbose_name_plural = 'Blacklisted emails'
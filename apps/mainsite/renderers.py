@@ -1,10 +1,65 @@
 from backports import csv
 import io
+import json
 
+from django.conf import settings
 from rest_framework import renderers
+from rest_framework.utils import encoders
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-class JSONLDRenderer(renderers.JSONRenderer):
+
+def native_json_available():
+    return orjson is not None and getattr(settings, 'JSON_RENDERER_BACKEND', 'orjson') == 'orjson'
+
+
+def _native_default(obj):
+    # types orjson doesn't handle natively (or that it formats differently than DRF, like datetimes)
+    return encoders.JSONEncoder().default(obj)
+
+
+def dumps_json(data, indent=None):
+    """
+    Serialize data to UTF-8 encoded JSON bytes using the backend configured by settings.JSON_RENDERER_BACKEND.
+
+    'orjson' (the default) is used when it is installed and indent is None or 2; otherwise the stdlib encoder is
+    used with DRF's JSONEncoder. Both produce the same document: compact separators without indent, ',' and ': '
+    with 2-space indentation, and non-ASCII characters left unescaped.
+    """
+    if native_json_available() and indent in (None, 2):
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, default=_native_default, option=option)
+
+    separators = None if indent else (',', ':')
+    return json.dumps(data, cls=encoders.JSONEncoder, indent=indent, separators=separators,
+                      ensure_ascii=False).encode('utf-8')
+
+
+class FastJSONRenderer(renderers.JSONRenderer):
+    """
+    A JSONRenderer that encodes with dumps_json() when the request allows it, and defers to JSONRenderer otherwise
+    (non-default indent, UNICODE_JSON or COMPACT_JSON turned off).
+    """
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        renderer_context = renderer_context or {}
+        indent = self.get_indent(accepted_media_type, renderer_context)
+        if not (native_json_available() and indent in (None, 2) and self.ensure_ascii is False and self.compact):
+            return super(FastJSONRenderer, self).render(data, accepted_media_type, renderer_context)
+
+        ret = dumps_json(data, indent=indent)
+        # match JSONRenderer, which escapes the javascript-incompatible line and paragraph separators
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class JSONLDRenderer(FastJSONRenderer):
     """
     A simple wrapper for JSONRenderer that declares that we're delivering LD.
     """
@@ -347,7 +347,7 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_RENDERER_CLASSES': (
         'mainsite.renderers.JSONLDRenderer',
-        'rest_framework.renderers.JSONRenderer',
+        'mainsite.renderers.FastJSONRenderer',
         'rest_framework.renderers.BrowsableAPIRenderer',
     ),
     'DEFAULT_AUTHENTICATION_CLASSES': (
@@ -364,6 +364,9 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 100,
 }
 
+# 'orjson' renders API responses and baked assertions with orjson when it is installed; 'json' always uses the stdlib
+JSON_RENDERER_BACKEND = 'orjson'
+
 
 ##
 #
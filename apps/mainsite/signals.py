@@ -2,8 +2,9 @@ from urllib.parse import urlparse
 
 from django.apps import apps
 from django.conf import settings
+from django.db import transaction
 
-from mainsite.models import AccessTokenScope
+from mainsite.models import AccessTokenScope, EmailBlacklist
 from mainsite.utils import netloc_to_domain
 
 
@@ -14,6 +15,11 @@ def handle_token_save(sender, instance=None, **kwargs):
         AccessTokenScope.objects.get_or_create(token=instance, scope=s)
 
 
+def handle_email_blacklist_change(sender, instance=None, **kwargs):
+    # wait for the change to be visible to other processes before telling them to reload
+    transaction.on_commit(EmailBlacklist.objects.invalidate_suppression_set)
+
+
 def cors_allowed_sites(sender, request, **kwargs):
     origin = netloc_to_domain(urlparse(request.META['HTTP_ORIGIN']).netloc)
     return CorsModel.objects.filter(cors=origin).exists()
@@ -0,0 +1,24 @@
+from celery.utils.log import get_task_logger
+from django.conf import settings
+
+from mainsite import blacklist
+from mainsite.celery import app
+
+logger = get_task_logger(__name__)
+
+background_task_queue_name = getattr(settings, 'BACKGROUND_TASK_QUEUE_NAME', 'default')
+
+
+@app.task(bind=True, queue=background_task_queue_name)
+def sync_blacklist(self):
+    """
+    Refresh the locally synced set of blacklisted recipient hashes. Schedule this more often than
+    BADGR_BLACKLIST_SYNC_MAX_AGE so blacklist checks rarely need to query the blacklist service.
+    """
+    count = blacklist.sync_blacklist_hashes()
+    if count is None:
+        logger.warning("Unable to sync the recipient blacklist")
+    return {
+        'success': count is not None,
+        'count': count,
+    }
@@ -1,8 +1,11 @@
+from collections import OrderedDict
 import hashlib
+import json
 from hashlib import sha256
 import mock
 from operator import attrgetter
 import os
+import pickle
 import pytz
 import re
 import responses
@@ -13,23 +16,32 @@ import warnings
 
 from django.core import mail
 from django.core.cache import cache, CacheKeyWarning
-from django.core.exceptions import ValidationError
+from django.core.exceptions import SuspiciousFileOperation, ValidationError
 from django.core.files.storage import default_storage
 from django.core.management import call_command
+from django.db import connection
 from django.test import override_settings, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import NoReverseMatch, reverse
 from django.utils import timezone
 
 from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
 from oauth2_provider.models import AccessToken, Application
 
+import badgrlog
 from badgeuser.models import BadgeUser, CachedEmailAddress
+from entity.serializers import BaseSerializerV2
 from issuer.models import BadgeClass, Issuer, BadgeInstance
-from mainsite.models import BadgrApp, AccessTokenProxy, AccessTokenScope
+from mainsite.cached_collections import CachedPkList
+from mainsite.models import BadgrApp, AccessTokenProxy, AccessTokenScope, EmailBlacklist
 from mainsite import TOP_DIR, blacklist
 from mainsite.serializers import DateTimeWithUtcZAtEndField
 from mainsite.tests import SetupIssuerHelper
 from mainsite.tests.base import BadgrTestCase
-from mainsite.utils import fetch_remote_file_to_storage, verify_svg
+from mainsite.renderers import FastJSONRenderer
+from mainsite.utils import (fetch_remote_file_to_storage, generate_entity_uri, FrozenJsonDict, FrozenJsonList,
+                            OriginSetting, PublicUrl, verify_svg)
 
 
 class TestDateSerialization(BadgrTestCase):
@@ -122,6 +134,101 @@ class TestCacheSettings(TransactionTestCase):
                 self.assertEqual(retrieved, "hello cached world")
 
 
+class TestCachedPkList(BadgrTestCase, SetupIssuerHelper):
+    def test_cached_badgeclasses_stores_pks(self):
+        test_user = self.setup_user(authenticate=False)
+        test_issuer = self.setup_issuer(owner=test_user)
+        badgeclasses = list(self.setup_badgeclasses(issuer=test_issuer, how_many=3))
+
+        cached = test_issuer.cached_badgeclasses()
+        self.assertIsInstance(cached, CachedPkList)
+        self.assertEqual(len(cached), 3)
+        self.assertEqual([bc.pk for bc in cached], [bc.pk for bc in badgeclasses])
+        self.assertEqual([bc.pk for bc in cached[1:]], [bc.pk for bc in badgeclasses[1:]])
+        self.assertIn(badgeclasses[0], cached)
+
+        restored = pickle.loads(pickle.dumps(cached))
+        self.assertEqual(list(restored.pks), [bc.pk for bc in badgeclasses])
+        self.assertEqual(restored._instances, {})
+
+    def test_hydrates_instances_missing_from_cache(self):
+        test_user = self.setup_user(authenticate=False)
+        test_issuer = self.setup_issuer(owner=test_user)
+        badgeclass = self.setup_badgeclass(issuer=test_issuer)
+
+        cached = test_issuer.cached_badgeclasses()
+        cache.delete(cached.instance_cache_key(badgeclass.pk))
+        self.assertEqual(cached[0].entity_id, badgeclass.entity_id)
+        self.assertIsNotNone(cache.get(cached.instance_cache_key(badgeclass.pk)))
+
+
+class TestParsedOriginalJson(BadgrTestCase, SetupIssuerHelper):
+    def test_original_json_is_parsed_once_and_read_only(self):
+        test_user = self.setup_user(authenticate=False)
+        test_issuer = self.setup_issuer(owner=test_user)
+        badgeclass = self.setup_badgeclass(issuer=test_issuer)
+        badgeclass.original_json = json.dumps({'image': {'id': 'http://example.com/image', 'author': 'Someone'}})
+
+        parsed = badgeclass.get_original_json()
+        self.assertIs(badgeclass.get_original_json(), parsed)
+        with self.assertRaises(TypeError):
+            parsed['image']['author'] = 'Someone else'
+
+        self.assertEqual(badgeclass.get_json()['image']['author'], 'Someone')
+        self.assertNotIn('_parsed_original_json', pickle.loads(pickle.dumps(badgeclass)).__dict__)
+
+        badgeclass.original_json = json.dumps({'image': {'author': 'Someone else'}})
+        self.assertEqual(badgeclass.get_original_json()['image']['author'], 'Someone else')
+
+    def test_extension_payloads_are_reparsed_when_changed(self):
+        test_user = self.setup_user(authenticate=False)
+        test_issuer = self.setup_issuer(owner=test_user)
+        badgeclass = self.setup_badgeclass(issuer=test_issuer)
+        badgeclass.extension_items = {'extensions:ExampleExtension': {'exampleProperty': 'one'}}
+
+        self.assertEqual(badgeclass.get_json()['extensions:ExampleExtension']['exampleProperty'], 'one')
+        badgeclass.extension_items = {'extensions:ExampleExtension': {'exampleProperty': 'two'}}
+        self.assertEqual(badgeclass.extension_items['extensions:ExampleExtension']['exampleProperty'], 'two')
+
+
+class TestPublicUrlTemplates(BadgrTestCase):
+    def test_templates_match_reverse(self):
+        for entity_id in (generate_entity_uri(), 'abc-DEF_123', 'with space', 'dotted.id'):
+            for name in PublicUrl.ROUTES:
+                try:
+                    expected = reverse(name, kwargs={'entity_id': entity_id})
+                except NoReverseMatch:
+                    continue
+                self.assertEqual(PublicUrl.path(name, entity_id), expected)
+                self.assertEqual(PublicUrl.url(name, entity_id), OriginSetting.HTTP + expected)
+
+    def test_origin_follows_settings(self):
+        entity_id = generate_entity_uri()
+        with override_settings(HTTP_ORIGIN='http://other.testserver'):
+            self.assertEqual(
+                PublicUrl.url('badgeinstance_json', entity_id),
+                'http://other.testserver' + reverse('badgeinstance_json', kwargs={'entity_id': entity_id}))
+        self.assertEqual(
+            PublicUrl.url('badgeinstance_json', entity_id),
+            OriginSetting.HTTP + reverse('badgeinstance_json', kwargs={'entity_id': entity_id}))
+
+
+class TestFastJSONRenderer(BadgrTestCase):
+    def test_matches_drf_json_renderer(self):
+        data = BaseSerializerV2.response_envelope(result=[OrderedDict([
+            ('entityId', generate_entity_uri()),
+            ('issuedOn', timezone.now()),
+            ('narrative', 'Ünïcødé\u2028text'),
+            ('extensions', FrozenJsonDict(count=3, tags=FrozenJsonList(['a', 'b']))),
+        ])], success=True, description='ok')
+
+        expected = JSONRenderer().render(data)
+        self.assertEqual(json.loads(FastJSONRenderer().render(data).decode('utf-8')), json.loads(expected.decode('utf-8')))
+        self.assertNotIn(b'\xe2\x80\xa8', FastJSONRenderer().render(data))
+        with override_settings(JSON_RENDERER_BACKEND='json'):
+            self.assertEqual(FastJSONRenderer().render(data), expected)
+
+
 class TestUtils(BadgrTestCase, SetupIssuerHelper):
     def test_svg_verify(self):
         with open(self.get_test_svg_image_path(), 'rb') as svg_badge_image:
@@ -317,6 +424,44 @@ class TestBlacklist(BadgrTestCase):
             with self.assertRaises(Exception):
                 blacklist.api_query_is_in_blacklist(id_type, id_value)
 
+    @override_settings(
+        BADGR_BLACKLIST_API_KEY='123',
+        BADGR_BLACKLIST_QUERY_ENDPOINT='http://example.com',
+    )
+    @responses.activate
+    def test_blacklist_batch_query_caches_results(self):
+        for (id_type, id_value), status in zip(self.Inputs, (200, 404, 404)):
+            responses.add(
+                responses.GET, 'http://example.com?id='+blacklist.generate_hash(id_type, id_value),
+                body="[{\"id\": \"x\"}]" if status == 200 else "[]", status=status, match_querystring=True
+            )
+
+        results = blacklist.api_query_are_in_blacklist(self.Inputs)
+        self.assertEqual(results, {self.Inputs[0]: True, self.Inputs[1]: False, self.Inputs[2]: False})
+        self.assertEqual(len(responses.calls), 3)
+
+        self.assertTrue(blacklist.api_query_is_in_blacklist(*self.Inputs[0]))
+        self.assertFalse(blacklist.api_query_is_in_blacklist(*self.Inputs[1]))
+        self.assertEqual(len(responses.calls), 3)
+
+    @override_settings(
+        BADGR_BLACKLIST_API_KEY='123',
+        BADGR_BLACKLIST_QUERY_ENDPOINT='http://example.com',
+        BADGR_BLACKLIST_SYNC_ENDPOINT='http://example.com/all',
+    )
+    @responses.activate
+    def test_blacklist_synced_hashes_answer_locally(self):
+        id_type, id_value = self.Inputs[0]
+        responses.add(
+            responses.GET, 'http://example.com/all',
+            json=[{"id": blacklist.generate_hash(id_type, id_value)}], status=200
+        )
+
+        self.assertEqual(blacklist.sync_blacklist_hashes(), 1)
+        self.assertTrue(blacklist.api_query_is_in_blacklist(id_type, id_value))
+        self.assertFalse(blacklist.api_query_is_in_blacklist(*self.Inputs[1]))
+        self.assertEqual(len(responses.calls), 1)
+
     @override_settings(
         BADGR_BLACKLIST_API_KEY='123',
         BADGR_BLACKLIST_QUERY_ENDPOINT='http://example.com',
@@ -329,6 +474,71 @@ class TestBlacklist(BadgrTestCase):
             self.assertEqual(got, expected)
 
 
+class TestEmailBlacklistSuppression(BadgrTestCase):
+    def test_suppression_set_answers_without_queries(self):
+        EmailBlacklist.objects.create(email='unsubscribed@example.com')
+        emails = ['unsubscribed@example.com', 'Unsubscribed@Example.com', 'subscribed@example.com']
+
+        self.assertEqual(EmailBlacklist.objects.blacklisted(emails), set(emails[:2]))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(EmailBlacklist.objects.is_blacklisted('unsubscribed@example.com'))
+            self.assertFalse(EmailBlacklist.objects.is_blacklisted('subscribed@example.com'))
+        self.assertEqual(len(queries), 0)
+
+        # adding an entry changes the version, so the set is reloaded
+        EmailBlacklist.objects.create(email='subscribed@example.com')
+        self.assertTrue(EmailBlacklist.objects.is_blacklisted('subscribed@example.com'))
+
+        EmailBlacklist.objects.filter(email='unsubscribed@example.com').delete()
+        self.assertFalse(EmailBlacklist.objects.is_blacklisted('unsubscribed@example.com'))
+
+    def test_suppression_set_is_reloaded_when_it_gets_old(self):
+        self.assertFalse(EmailBlacklist.objects.is_blacklisted('missed@example.com'))
+
+        # bulk_create skips the signal that changes the version, like a change whose version key never reached us
+        EmailBlacklist.objects.bulk_create([EmailBlacklist(email='missed@example.com')])
+        self.assertFalse(EmailBlacklist.objects.is_blacklisted('missed@example.com'))
+        with override_settings(EMAIL_BLACKLIST_LOCAL_MAX_AGE=0):
+            self.assertTrue(EmailBlacklist.objects.is_blacklisted('missed@example.com'))
+
+
+class CollectingSink(object):
+    records = []
+
+    def write(self, records):
+        CollectingSink.records.extend(records)
+
+
+class TestBadgrLogPipeline(BadgrTestCase):
+    @override_settings(
+        BADGRLOG_PIPELINE={
+            'SINK': 'mainsite.tests.test_misc.CollectingSink',
+            'BUFFER_SIZE': 2,
+            'FLUSH_INTERVAL': 3600,
+        },
+        BADGRLOG_SAMPLE_RATES={'BlacklistUnsubscribeRequestSuccessEvent': 0.0},
+    )
+    def test_events_are_buffered_and_flushed_by_the_pipeline(self):
+        CollectingSink.records = []
+        logger = badgrlog.BadgrLogger()
+        with mock.patch.object(logger.logger, 'info') as info:
+            for email in ('first@example.com', 'second@example.com', 'third@example.com'):
+                logger.event(badgrlog.BlacklistUnsubscribeInvalidLinkEvent(email))
+            logger.event(badgrlog.BlacklistUnsubscribeRequestSuccessEvent('first@example.com'))
+        self.assertFalse(info.called)
+
+        stats = badgrlog.pipeline_stats()
+        self.assertEqual(stats['emitted'], 3)
+        self.assertEqual(stats['dropped'], 1)
+        self.assertEqual(stats['sampled_out'], 1)
+        self.assertEqual(stats['buffered'], 2)
+
+        badgrlog.pipeline.get_event_pipeline().flush()
+        self.assertEqual([data['email'] for name, data in CollectingSink.records],
+                         ['second@example.com', 'third@example.com'])
+        self.assertEqual(badgrlog.pipeline_stats()['written'], 2)
+
+
 class TestRemoteFileToStorage(SetupIssuerHelper, BadgrTestCase):
     mime_types = ['image/png', 'image/svg+xml', 'image/jpeg']
     test_uploaded_path = os.path.join('testfiles')
@@ -348,6 +558,39 @@ class TestRemoteFileToStorage(SetupIssuerHelper, BadgrTestCase):
     def mimic_hashed_file_name(self, name, ext=''):
         return hashlib.md5(name.encode('utf-8')).hexdigest() + ext
 
+    @responses.activate
+    def test_identical_content_is_stored_once(self):
+        png = open(self.get_test_png_image_path(), 'rb').read()
+        other_url = 'http://other.example.com/same.png'
+        for url in (self.test_url, other_url):
+            responses.add(responses.GET, url, body=png, status=200)
+
+        storage_names = [fetch_remote_file_to_storage(
+            url,
+            upload_to=self.test_uploaded_path,
+            allowed_mime_types=self.mime_types
+        )[1] for url in (self.test_url, other_url)]
+
+        self.assertEqual(storage_names[0], storage_names[1])
+        self.assertTrue(storage_names[0].endswith(sha256(png).hexdigest() + '.png'))
+
+    @responses.activate
+    def test_remote_file_size_is_capped(self):
+        responses.add(
+            responses.GET,
+            self.test_url,
+            body=open(self.get_test_png_image_path(), 'rb').read(),
+            status=200
+        )
+
+        with override_settings(REMOTE_FILE_MAX_SIZE=512):
+            with self.assertRaises(SuspiciousFileOperation):
+                fetch_remote_file_to_storage(
+                    self.test_url,
+                    upload_to=self.test_uploaded_path,
+                    allowed_mime_types=self.mime_types
+                )
+
     @responses.activate
     def test_remote_url_is_data_uri(self):
         data_uri_as_url = open(self.get_test_image_data_uri()).read()
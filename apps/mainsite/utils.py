@@ -9,8 +9,10 @@ import datetime
 import hashlib
 import json
 import re
+import tempfile
 import puremagic
 import requests
+import requests.adapters
 import urllib.request, urllib.parse, urllib.error
 import urllib.parse
 import uuid
@@ -21,7 +23,8 @@ from django.conf import settings
 from django.core.cache import cache
 from django.core.exceptions import SuspiciousFileOperation
 from django.core.files.storage import DefaultStorage
-from django.urls import get_callable
+from django.core.signals import setting_changed
+from django.urls import get_callable, get_script_prefix, reverse
 from django.http import HttpResponse
 from django.utils import timezone
 from rest_framework.status import HTTP_429_TOO_MANY_REQUESTS
@@ -66,6 +69,13 @@ def client_ip_from_request(request):
     return ip
 
 
+def respond_async_requested(request):
+    """Returns True if the request asked to be answered before its work is done, with `Prefer: respond-async` (RFC 7240).
+    """
+    preferences = request.META.get('HTTP_PREFER', '')
+    return any(p.split(';')[0].strip().lower() == 'respond-async' for p in preferences.split(','))
+
+
 def backoff_cache_key(username=None, client_ip=None):
     client_descriptor = username if username else client_ip
     return "failed_token_backoff_{}".format(client_descriptor)
@@ -86,6 +96,70 @@ class OriginSettingsObject(object):
 OriginSetting = OriginSettingsObject()
 
 
+class PublicUrlTemplates(object):
+    """
+    Builds public urls for entity_id routes without calling reverse() on every render.
+
+    Each route is reversed once (per script prefix) with a placeholder entity_id and split into a prefix and suffix,
+    so building a url is a string concatenation. Ids containing characters reverse() would quote, or that the route
+    would not match, fall back to reverse(). The compiled templates and origin are dropped when HTTP_ORIGIN or
+    ROOT_URLCONF change.
+    """
+    PLACEHOLDER = 'ENTITYIDPLACEHOLDER'
+    SAFE_ENTITY_ID = re.compile(r'^[A-Za-z0-9_~-]+$')
+    ROUTES = (
+        'issuer_json',
+        'issuer_image',
+        'badgeclass_json',
+        'badgeclass_image',
+        'badgeclass_criteria',
+        'badgeinstance_json',
+        'badgeinstance_image',
+        'collection_json',
+    )
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._templates = {}
+        self._origin = None
+
+    @property
+    def origin(self):
+        if self._origin is None:
+            self._origin = OriginSetting.HTTP
+        return self._origin
+
+    def _template(self, name):
+        key = (name, get_script_prefix())
+        template = self._templates.get(key)
+        if template is None:
+            path = reverse(name, kwargs={'entity_id': self.PLACEHOLDER})
+            template = self._templates[key] = tuple(path.split(self.PLACEHOLDER, 1))
+        return template
+
+    def path(self, name, entity_id):
+        if name in self.ROUTES and self.SAFE_ENTITY_ID.match(entity_id or ''):
+            prefix, suffix = self._template(name)
+            return prefix + entity_id + suffix
+        return reverse(name, kwargs={'entity_id': entity_id})
+
+    def url(self, name, entity_id):
+        return self.origin + self.path(name, entity_id)
+
+
+PublicUrl = PublicUrlTemplates()
+
+
+def _clear_public_url_templates(setting, **kwargs):
+    if setting in ('HTTP_ORIGIN', 'ROOT_URLCONF'):
+        PublicUrl.clear()
+
+
+setting_changed.connect(_clear_public_url_templates)
+
+
 """
 Cache Utilities
 """
@@ -147,9 +221,47 @@ def scrubSvgElementTree(svg_elem):
     return svg_elem
 
 
+REMOTE_FILE_SNIFF_SIZE = 1024
+
+_remote_file_session = None
+
+
+def remote_file_session():
+    """
+    The requests.Session used to fetch remote files, shared so connections to the same host are reused.
+    """
+    global _remote_file_session
+    if _remote_file_session is None:
+        pool_size = getattr(settings, 'REMOTE_FILE_POOL_MAXSIZE', 10)
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _remote_file_session = session
+    return _remote_file_session
+
+
+def _sniff_mime_type(head, allowed_mime_types):
+    """
+    :return: (mime_type, extension) identified from the first bytes of a file, or (None, None)
+    """
+    try:
+        magic_strings = puremagic.magic_string(head)
+    except puremagic.PureError:
+        magic_strings = []
+    for magic_string in magic_strings:
+        if getattr(magic_string, 'mime_type', None) in allowed_mime_types:
+            return getattr(magic_string, 'mime_type', None), getattr(magic_string, 'extension', None)
+    return None, None
+
+
+def _remote_file_too_large(max_size):
+    return SuspiciousFileOperation("remote file is larger than the {} byte limit".format(max_size))
+
+
 def fetch_remote_file_to_storage(remote_url, upload_to='', allowed_mime_types=()):
     """
-    Fetches a remote url, and stores it in DefaultStorage
+    Fetches a remote url, and stores it in DefaultStorage named by the sha256 of its content
     :return: (status_code, new_storage_name)
     """
     SVG_MIME_TYPE = 'image/svg+xml'
@@ -157,46 +269,71 @@ def fetch_remote_file_to_storage(remote_url, upload_to='', allowed_mime_types=()
     if not allowed_mime_types:
         raise SuspiciousFileOperation("allowed mime types must be passed in")
 
-    magic_strings = None
-    content = None
-    status_code = None
+    max_size = getattr(settings, 'REMOTE_FILE_MAX_SIZE', 10 * 1024 * 1024)
+    digest = hashlib.sha256()
+    head = b''
+    size = 0
 
     if _is_data_uri(remote_url):
         # data:[<MIME-type>][;charset=<encoding>][;base64],<data>
         # finds the end of the substring 'base64' adds one more to get the comma as well.
         base64_image_from_data_uri = remote_url[(re.search('base64', remote_url).end())+1:]
-        content = decoded_test = base64.b64decode(base64_image_from_data_uri)
-        magic_strings = puremagic.magic_string(decoded_test)
+        content = base64.b64decode(base64_image_from_data_uri)
+        if len(content) > max_size:
+            raise _remote_file_too_large(max_size)
+        digest.update(content)
+        head = content[:REMOTE_FILE_SNIFF_SIZE]
+        size = len(content)
         status_code = 200
-
-    store = DefaultStorage()
-
-    if magic_strings is None:
-        r = requests.get(remote_url, stream=True)
-        if r.status_code == 200:
-            magic_strings = puremagic.magic_string(r.content)
-            content = r.content
+        f = io.BytesIO(content)
+    else:
+        r = remote_file_session().get(
+            remote_url, stream=True, timeout=getattr(settings, 'REMOTE_FILE_FETCH_TIMEOUT', (3.05, 10)))
+        with r:
             status_code = r.status_code
-
-    if magic_strings and content:
-        derived_mime_type = None
-        derived_ext = None
-        stripped_svg_string = None
-
-        for magic_string in magic_strings:
-            if getattr(magic_string, 'mime_type', None) in allowed_mime_types:
-                derived_mime_type = getattr(magic_string, 'mime_type', None)
-                derived_ext = getattr(magic_string, 'extension', None)
-                break
-
-        if not derived_mime_type and re.search(b'<svg', content[:1024]) and content.strip()[-6:] == b'</svg>':
-            derived_mime_type = SVG_MIME_TYPE
-            derived_ext = '.svg'
+            if status_code != 200:
+                return status_code, None
+            content_length = r.headers.get('Content-Length', '')
+            if content_length.isdigit() and int(content_length) > max_size:
+                raise _remote_file_too_large(max_size)
+
+            f = tempfile.SpooledTemporaryFile(max_size=getattr(settings, 'REMOTE_FILE_SPOOL_SIZE', 1024 * 1024))
+            try:
+                for chunk in r.iter_content(chunk_size=64 * 1024):
+                    size += len(chunk)
+                    if size > max_size:
+                        raise _remote_file_too_large(max_size)
+                    if len(head) < REMOTE_FILE_SNIFF_SIZE:
+                        head = (head + chunk)[:REMOTE_FILE_SNIFF_SIZE]
+                        # give up on a disallowed file as soon as there is enough of it to identify
+                        if len(head) == REMOTE_FILE_SNIFF_SIZE and \
+                                _sniff_mime_type(head, allowed_mime_types)[0] is None and not re.search(b'<svg', head):
+                            raise SuspiciousFileOperation("remote file is not an allowed mime type for upload")
+                    digest.update(chunk)
+                    f.write(chunk)
+            except Exception:
+                f.close()
+                raise
+
+    with f:
+        if not size:
+            return status_code, None
+
+        derived_mime_type, derived_ext = _sniff_mime_type(head, allowed_mime_types)
+
+        if not derived_mime_type and re.search(b'<svg', head):
+            f.seek(max(0, size - REMOTE_FILE_SNIFF_SIZE))
+            if f.read().strip()[-6:] == b'</svg>':
+                derived_mime_type = SVG_MIME_TYPE
+                derived_ext = '.svg'
 
         if derived_mime_type == SVG_MIME_TYPE:
-            stripped_svg_element = ET.fromstring(content)
+            f.seek(0)
+            stripped_svg_element = ET.fromstring(f.read())
             scrubSvgElementTree(stripped_svg_element)
             stripped_svg_string = ET.tostring(stripped_svg_element)
+            digest = hashlib.sha256(stripped_svg_string)
+            f = io.BytesIO(stripped_svg_string)
 
         if derived_mime_type not in allowed_mime_types:
             raise SuspiciousFileOperation("{} is not an allowed mime type for upload".format(derived_mime_type))
@@ -206,16 +343,19 @@ def fetch_remote_file_to_storage(remote_url, upload_to='', allowed_mime_types=()
 
         storage_name = '{upload_to}/cached/{filename}{ext}'.format(
             upload_to=upload_to,
-            filename=hashlib.md5(remote_url.encode('utf-8')).hexdigest(),
+            filename=digest.hexdigest(),
             ext=derived_ext)
 
-        string_to_write_to_file = stripped_svg_string or content
-
-        if not store.exists(storage_name):
-            buf = io.BytesIO(string_to_write_to_file)
-            store.save(storage_name, buf)
+        # the same content fetched from any url maps to one storage name, so remember which names are already stored
+        # rather than asking the storage backend every time
+        exists_cache_key = 'remote_file_stored:{}'.format(storage_name)
+        if not cache.get(exists_cache_key):
+            store = DefaultStorage()
+            if not store.exists(storage_name):
+                f.seek(0)
+                store.save(storage_name, f)
+            cache.set(exists_cache_key, True, timeout=getattr(settings, 'REMOTE_FILE_EXISTS_CACHE_TIMEOUT', 60 * 60 * 24))
         return status_code, storage_name
-    return status_code, None
 
 
 def _is_data_uri(value):
@@ -369,3 +509,60 @@ def hash_for_image(imageFileField):
         return file_hash.hexdigest()
     except:
         return ''
+
+
+class FrozenJsonDict(dict):
+    """
+    A read-only dict of parsed JSON that can be shared between callers. copy.deepcopy() returns a mutable copy.
+    """
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("'{}' object does not support mutation".format(self.__class__.__name__))
+
+    __setitem__ = __delitem__ = __ior__ = clear = pop = popitem = setdefault = update = _immutable
+
+    def __reduce__(self):
+        return self.__class__, (dict(self),)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return thaw_json(self)
+
+
+class FrozenJsonList(list):
+    """
+    A read-only list of parsed JSON that can be shared between callers. copy.deepcopy() returns a mutable copy.
+    """
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("'{}' object does not support mutation".format(self.__class__.__name__))
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _immutable
+    append = clear = extend = insert = pop = remove = reverse = sort = _immutable
+
+    def __reduce__(self):
+        return self.__class__, (list(self),)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return thaw_json(self)
+
+
+def freeze_json(value):
+    """return value, as parsed by json.loads(), with every dict and list replaced by a read-only equivalent"""
+    if isinstance(value, dict):
+        return FrozenJsonDict((k, freeze_json(v)) for k, v in value.items())
+    elif isinstance(value, list):
+        return FrozenJsonList(freeze_json(v) for v in value)
+    return value
+
+
+def thaw_json(value):
+    """return a mutable deep copy of a value produced by freeze_json()"""
+    if isinstance(value, dict):
+        return {k: thaw_json(v) for k, v in value.items()}
+    elif isinstance(value, list):
+        return [thaw_json(v) for v in value]
+    return value
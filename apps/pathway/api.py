@@ -1,4 +1,7 @@
 # Created by wiggins@concentricsky.com on 3/30/16.
+import itertools
+
+from django.http import StreamingHttpResponse
 from rest_framework import status
 from rest_framework.exceptions import PermissionDenied
 from rest_framework.response import Response
@@ -6,7 +9,9 @@ from rest_framework.status import HTTP_201_CREATED
 
 from issuer.api_v1 import AbstractIssuerAPIEndpoint
 from issuer.models import Issuer
+from mainsite.renderers import dumps_json
 from mainsite.utils import ObjectView
+from pathway.completion import cohort_completions
 from pathway.models import Pathway, PathwayElement
 from pathway.serializers import PathwaySerializer, PathwayListSerializer, PathwayElementSerializer, \
     PathwayElementCompletionSerializer
@@ -396,3 +401,63 @@ class PathwayCompletionDetail(PathwayElementAPIEndpoint):
         }))
 
         return Response(serializer.data)
+
+
+class PathwayGroupProgress(PathwayAPIEndpoint):
+    # members serialized per chunk of the streamed response
+    chunk_size = 200
+
+    def get(self, request, issuer_slug, pathway_slug, group_slug, **kwargs):
+        """
+        Stream a summary of every Recipient Group member's progress through a pathway
+        ---
+        """
+        issuer, pathway = self._get_issuer_and_pathway(issuer_slug, pathway_slug)
+        if issuer is None or pathway is None:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            group = RecipientGroup.cached.get(entity_id=group_slug)
+        except RecipientGroup.DoesNotExist:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        if group.issuer_id != issuer.pk or not group.is_active:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+
+        tree = pathway.cached_element_tree()
+        if tree is None:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+
+        index = tree.completion_index
+        members, member_completions = cohort_completions(index, group)
+        header = dumps_json({
+            "@context": "https://badgr.io/public/contexts/pathways",
+            "@type": "PathwayGroupProgressReport",
+            "pathway": {'@id': pathway.jsonld_id, 'slug': pathway.slug},
+            "recipientGroup": {'@id': group.jsonld_id, 'slug': group.entity_id},
+            "elementCount": len(index.nodes),
+            "memberCount": len(members),
+        })
+
+        def _summary(member, completed):
+            recipient_identifier, entity_id, name = member
+            return dumps_json({
+                'recipient': {'@id': 'mailto:{}'.format(recipient_identifier), 'slug': entity_id},
+                'name': name,
+                'completed': index.root.index in completed,
+                'completedElementCount': len(completed),
+                'completedElements': [index.nodes[i].slug for i in completed],
+            })
+
+        def _stream():
+            # splice the members array into the header document
+            yield header[:-1] + b',"members":['
+            summaries = map(_summary, members, member_completions)
+            separator = b''
+            chunk = list(itertools.islice(summaries, self.chunk_size))
+            while chunk:
+                yield separator + b','.join(chunk)
+                separator = b','
+                chunk = list(itertools.islice(summaries, self.chunk_size))
+            yield b']}'
+
+        return StreamingHttpResponse(_stream(), content_type='application/json')
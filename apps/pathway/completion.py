@@ -0,0 +1,274 @@
+# encoding: utf-8
+"""
+Incremental pathway completion.
+
+A CompiledPathwayIndex flattens a pathway's compiled element tree into a list of requirement nodes (children before
+their parents) and keeps an inverted index from badgeclass pk to the BadgeJunction nodes that reference it.
+Per-recipient completion state (the relevant badgeclasses earned and the nodes completed) is kept in the cache, so a
+new assertion only re-evaluates the nodes that reference its badgeclass and their ancestors.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+from pathway.completionspec import CompletionRequirementSpecFactory
+
+
+class PathwayIndexNode(object):
+    __slots__ = ('index', 'element_id', 'slug', 'depth', 'parent', 'children', 'completion_type', 'conjunction',
+                 'required_number', 'required_badgeclasses', 'unresolved_badges', 'required_children',
+                 'completion_badgeclass_id')
+
+    def __init__(self, **kwargs):
+        for attr in self.__slots__:
+            setattr(self, attr, kwargs.get(attr, None))
+
+    def __getstate__(self):
+        return {attr: getattr(self, attr) for attr in self.__slots__}
+
+    def __setstate__(self, state):
+        for attr in self.__slots__:
+            setattr(self, attr, state.get(attr, None))
+
+
+class CompiledPathwayIndex(object):
+    """
+    The requirement DAG of one pathway, flattened so that every node comes after all of its children.
+    """
+    def __init__(self, pathway_id, nodes):
+        self.pathway_id = pathway_id
+        self.nodes = nodes
+        self.badgeclass_nodes = {}
+        for node in nodes:
+            for badgeclass_id in node.required_badgeclasses:
+                self.badgeclass_nodes.setdefault(badgeclass_id, []).append(node.index)
+        self.version = self._compute_version()
+
+    @classmethod
+    def from_element_tree(cls, tree):
+        """
+        Build the index from a pathway.element_tree.CompiledElementTree. The tree is in pre-order, so reversing it puts
+        every node after all of its children.
+        """
+        last = len(tree.nodes) - 1
+        nodes = []
+        for compiled in reversed(tree.nodes):
+            spec = compiled.spec
+            children = tuple(last - c for c in compiled.children)
+
+            required_badgeclasses = frozenset()
+            unresolved_badges = 0
+            required_children = ()
+            if spec is None:
+                spec_type, conjunction, required_number = None, False, 0
+            else:
+                spec_type = spec.completion_type
+                conjunction = spec.junction_type == CompletionRequirementSpecFactory.JUNCTION_TYPE_CONJUNCTION
+                required_number = spec.required_number
+                if spec_type == CompletionRequirementSpecFactory.BADGE_JUNCTION:
+                    badgeclass_ids = dict(compiled.badges)
+                    required_badgeclasses = frozenset(badgeclass_ids[b] for b in spec.badges if b in badgeclass_ids)
+                    unresolved_badges = len([b for b in spec.badges if b not in badgeclass_ids])
+                elif spec_type == CompletionRequirementSpecFactory.ELEMENT_JUNCTION:
+                    required_children = tuple(c for c in children if nodes[c].element_id in spec.elements)
+
+            nodes.append(PathwayIndexNode(
+                index=len(nodes),
+                element_id=compiled.element_id,
+                slug=compiled.slug,
+                depth=compiled.depth,
+                parent=None if compiled.parent is None else last - compiled.parent,
+                children=children,
+                completion_type=spec_type,
+                conjunction=conjunction,
+                required_number=required_number,
+                required_badgeclasses=required_badgeclasses,
+                unresolved_badges=unresolved_badges,
+                required_children=required_children,
+                completion_badgeclass_id=compiled.completion_badgeclass_id))
+        return cls(tree.pathway_id, nodes)
+
+    def _compute_version(self):
+        digest = hashlib.sha1()
+        for node in self.nodes:
+            digest.update(repr((
+                node.element_id, node.parent, node.children, node.completion_type, node.conjunction,
+                node.required_number, sorted(node.required_badgeclasses), node.unresolved_badges,
+                node.required_children, node.completion_badgeclass_id,
+            )).encode('utf-8'))
+        return digest.hexdigest()[:16]
+
+    @property
+    def root(self):
+        return self.nodes[-1] if self.nodes else None
+
+    def affected_nodes(self, badgeclass_ids):
+        """
+        Return the indices of the nodes referencing badgeclass_ids and all of their ancestors, children first.
+        """
+        affected = set()
+        for badgeclass_id in badgeclass_ids:
+            for index in self.badgeclass_nodes.get(badgeclass_id, ()):
+                while index is not None and index not in affected:
+                    affected.add(index)
+                    index = self.nodes[index].parent
+        return sorted(affected)
+
+    def is_node_completed(self, node, earned, completed):
+        if node.completion_type == CompletionRequirementSpecFactory.BADGE_JUNCTION:
+            earned_count = len(node.required_badgeclasses & earned)
+            if node.conjunction:
+                return node.unresolved_badges == 0 and earned_count == len(node.required_badgeclasses)
+            return earned_count >= node.required_number
+        elif node.completion_type == CompletionRequirementSpecFactory.ELEMENT_JUNCTION:
+            completed_count = len([c for c in node.required_children if c in completed])
+            return completed_count >= node.required_number
+        return False
+
+    def evaluate(self, earned, completed=frozenset(), indices=None):
+        """
+        Re-evaluate the nodes at indices (every node if None, children before parents) and return the new set of
+        completed node indices.
+        """
+        completed = set(completed)
+        for index in (range(len(self.nodes)) if indices is None else indices):
+            node = self.nodes[index]
+            if self.is_node_completed(node, earned, completed):
+                completed.add(index)
+            else:
+                completed.discard(index)
+        return frozenset(completed)
+
+    def evaluate_cohort(self, member_count, earners):
+        """
+        Evaluate every node for a whole cohort in one pass. Each result is a bitset over member positions (bit i set
+        when member i completed the node), so a junction costs a few big-integer operations however many members
+        there are.
+
+        :param earners: {badgeclass pk: iterable of the positions of the members who hold it}
+        :return: a list of member bitsets, one per node
+        """
+        everyone = (1 << member_count) - 1
+        holders = {badgeclass_id: member_bitset(positions, member_count)
+                   for badgeclass_id, positions in earners.items()}
+
+        results = []
+        for node in self.nodes:
+            if node.completion_type == CompletionRequirementSpecFactory.BADGE_JUNCTION:
+                bitsets = [holders.get(b, 0) for b in node.required_badgeclasses]
+                if node.conjunction:
+                    completed = everyone if node.unresolved_badges == 0 else 0
+                    for bitset in bitsets:
+                        completed &= bitset
+                else:
+                    completed = at_least(bitsets, node.required_number, everyone)
+            elif node.completion_type == CompletionRequirementSpecFactory.ELEMENT_JUNCTION:
+                completed = at_least([results[c] for c in node.required_children], node.required_number, everyone)
+            else:
+                completed = 0
+            results.append(completed)
+        return results
+
+    def iter_member_completions(self, member_count, node_bitsets):
+        """
+        Transpose evaluate_cohort()'s result, yielding the list of completed node indices of each member in order.
+        """
+        size = (member_count + 7) // 8
+        node_bytes = [(index, bitset.to_bytes(size, 'little')) for index, bitset in enumerate(node_bitsets) if bitset]
+        for position in range(member_count):
+            byte, bit = position >> 3, 1 << (position & 7)
+            yield [index for index, bits in node_bytes if bits[byte] & bit]
+
+
+def member_bitset(positions, member_count):
+    bits = bytearray((member_count + 7) // 8)
+    for position in positions:
+        bits[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(bytes(bits), 'little')
+
+
+def at_least(bitsets, required_number, everyone):
+    """
+    Return the bitset of members set in at least required_number of bitsets.
+    """
+    if required_number <= 0:
+        return everyone
+    # reached[j] holds the members found in at least j of the bitsets seen so far
+    reached = [everyone] + [0] * required_number
+    for bitset in bitsets:
+        for j in range(required_number, 0, -1):
+            reached[j] |= reached[j - 1] & bitset
+    return reached[required_number]
+
+
+def cohort_completions(index, recipient_group):
+    """
+    Evaluate index for every member of recipient_group, with one query for the memberships and one for the relevant
+    unrevoked assertions of all members.
+
+    :return: a list of (recipient_identifier, recipient entity_id, membership_name) and a generator of the completed
+    node indices of each of them, in the same order
+    """
+    from issuer.models import BadgeInstance
+    from recipient.models import RecipientGroupMembership
+
+    memberships = RecipientGroupMembership.objects.filter(recipient_group_id=recipient_group.pk)
+    members = list(memberships.order_by('pk').values_list(
+        'recipient_profile__recipient_identifier', 'recipient_profile__entity_id', 'membership_name'))
+    positions = {}
+    for position, (recipient_identifier, entity_id, name) in enumerate(members):
+        positions.setdefault(recipient_identifier.lower(), []).append(position)
+
+    earners = {}
+    if members and index.badgeclass_nodes:
+        earned = BadgeInstance.objects.filter(
+            recipient_identifier__in=memberships.values('recipient_profile__recipient_identifier'),
+            badgeclass_id__in=list(index.badgeclass_nodes.keys()),
+            revoked=False
+        ).order_by('recipient_identifier').values_list('recipient_identifier', 'badgeclass_id').distinct()
+        for recipient_identifier, badgeclass_id in earned:
+            earners.setdefault(badgeclass_id, []).extend(positions.get(recipient_identifier.lower(), ()))
+
+    node_bitsets = index.evaluate_cohort(len(members), earners)
+    return members, index.iter_member_completions(len(members), node_bitsets)
+
+
+def completion_state_cache_key(pathway_id, recipient_identifier):
+    digest = hashlib.sha1(recipient_identifier.lower().encode('utf-8')).hexdigest()
+    return "pathway_completion_state_{}_{}".format(pathway_id, digest)
+
+
+def clear_completion_state(pathway_id, recipient_identifier):
+    cache.delete(completion_state_cache_key(pathway_id, recipient_identifier))
+
+
+def update_recipient_completion(index, recipient_identifier, badgeclass_ids=()):
+    """
+    Record that recipient_identifier earned badgeclass_ids and re-evaluate the affected part of the pathway.
+
+    When there is no stored state for the recipient, or it was computed against a different version of the index,
+    the state is rebuilt from the recipient's unrevoked assertions with a single query.
+
+    :return: (set of completed node indices, set of node indices that became completed)
+    """
+    from issuer.models import BadgeInstance
+
+    key = completion_state_cache_key(index.pathway_id, recipient_identifier)
+    state = cache.get(key)
+    if state is None or state.get('version') != index.version:
+        earned = frozenset(BadgeInstance.objects.filter(
+            recipient_identifier=recipient_identifier,
+            revoked=False,
+            badgeclass_id__in=list(index.badgeclass_nodes.keys())
+        ).values_list('badgeclass_id', flat=True).distinct())
+        previous = frozenset()
+        completed = index.evaluate(earned)
+    else:
+        earned = state['earned'] | frozenset(b for b in badgeclass_ids if b in index.badgeclass_nodes)
+        previous = state['completed']
+        completed = index.evaluate(earned, previous, index.affected_nodes(badgeclass_ids))
+
+    cache.set(key, {'version': index.version, 'earned': earned, 'completed': completed},
+              getattr(settings, 'PATHWAY_COMPLETION_STATE_TIMEOUT', 60*60*24*30))
+    return completed, completed - previous
@@ -44,69 +44,29 @@ class ElementJunctionCompletionRequirementSpec(CompletionRequirementSpec):
     def handle_json(self, json_obj):
         self.elements = set(json_obj.get('elements'))
 
-    def check_completion(self, completion, completions, req_number=None):
+    def check_completion(self, completion, completions, req_number=None, completed_ids=None):
+        """
+        :param completed_ids: the set of element ids completed in completions, if the caller already tracks it
+        """
+        if completed_ids is None:
+            completed_ids = set(c['element']['@id'] for c in completions if c['completed'])
+
         completion.update({
             'completedElements': [],
             'completedRequirementCount': 0
         })
 
         for element_id in self.elements:
-            for completion_report in completions:
-                if element_id == completion_report['element']['@id'] and completion_report['completed']:
-                    # not using PathwayElement.cached.get_by_slug_or_id to lookup the slug here to improve performance
-                    completion['completedElements'].append({'@id': element_id})
-                    completion['completedRequirementCount'] += 1
+            if element_id in completed_ids:
+                # not using PathwayElement.cached.get_by_slug_or_id to lookup the slug here to improve performance
+                completion['completedElements'].append({'@id': element_id})
+                completion['completedRequirementCount'] += 1
 
         if completion['completedRequirementCount'] >= self.required_number:
             completion['completed'] = True
 
         return completion
 
-    def check_completions(self, tree, instances):
-        completions = []
-
-        def _completion_base(node):
-            completion = {
-                "element": {
-                    '@id': node['element'].jsonld_id,
-                    'slug': node['element'].slug,
-                },
-                "completed": False,
-            }
-            if node['element'].completion_badgeclass:
-                completion['completionBadge'] = {
-                    '@id': node['element'].completion_badgeclass.jsonld_id,
-                    'slug': node['element'].completion_badgeclass.entity_id,
-                }
-            return completion
-
-
-        def _recurse(node):
-            node_completion = _completion_base(node)
-
-            if node['element'].completion_requirements:
-                completion_spec = CompletionRequirementSpecFactory.parse_obj(
-                    node['element'].completion_requirements
-                )
-
-                if completion_spec.completion_type == CompletionRequirementSpecFactory.ELEMENT_JUNCTION:
-                    for element_id in completion_spec.elements:
-                        child = node['children'].get(element_id, None)
-                        if child:
-                            _recurse(child)
-                    # check optional children
-                    for element_id in set(node['children'].keys()) - set(completion_spec.elements):
-                        child = node['children'].get(element_id, None)
-                        if child:
-                            _recurse(child)
-                    node_completion.update(completion_spec.check_completion(node_completion, completions))
-                elif completion_spec.completion_type == CompletionRequirementSpecFactory.BADGE_JUNCTION:
-                    node_completion.update(completion_spec.check_completion(node_completion, instances))
-            completions.append(node_completion)
-        _recurse(tree)
-
-        return completions
-
 
 class BadgeJunctionCompletionRequirementSpec(CompletionRequirementSpec):
     def __init__(self, *args, **kwargs):
@@ -124,15 +84,37 @@ class BadgeJunctionCompletionRequirementSpec(CompletionRequirementSpec):
     def handle_json(self, json_obj):
         self.badges = set(json_obj.get('badges'))
 
-    def check_completion(self, completion, instances=()):
-        completion['completedBadges'] = []
-        for i in instances:
-            if i.cached_badgeclass.json['id'] in self.badges:
-                completion['completedBadges'].append({
-                    '@id': i.cached_badgeclass.jsonld_id,
-                    'slug': i.cached_badgeclass.entity_id,
-                    'assertion': i.jsonld_id,
-                })
+    @staticmethod
+    def index_instances(instances):
+        """
+        Group instances by their badgeclass's jsonld_id, looking each badgeclass up once. Comparing jsonld_id avoids
+        building the badgeclass's full json document just to read its id.
+
+        :return: {badgeclass jsonld_id: [(position in instances, instance, badgeclass)]}
+        """
+        badgeclasses = {}
+        indexed = {}
+        for position, i in enumerate(instances):
+            badgeclass = badgeclasses.get(i.badgeclass_id)
+            if badgeclass is None:
+                badgeclass = badgeclasses[i.badgeclass_id] = i.cached_badgeclass
+            indexed.setdefault(badgeclass.jsonld_id, []).append((position, i, badgeclass))
+        return indexed
+
+    def check_completion(self, completion, instances=(), instances_by_badge=None):
+        """
+        :param instances_by_badge: index_instances(instances), if the caller already built it
+        """
+        if instances_by_badge is None:
+            instances_by_badge = self.index_instances(instances)
+
+        earned = sorted((entry for badge_id in self.badges for entry in instances_by_badge.get(badge_id, ())),
+                        key=lambda entry: entry[0])
+        completion['completedBadges'] = [{
+            '@id': badgeclass.jsonld_id,
+            'slug': badgeclass.entity_id,
+            'assertion': i.jsonld_id,
+        } for position, i, badgeclass in earned]
         completion['completedRequirementCount'] = len(completion['completedBadges'])
 
         if self.junction_type == CompletionRequirementSpecFactory.JUNCTION_TYPE_DISJUNCTION:
@@ -0,0 +1,174 @@
+# encoding: utf-8
+"""
+Compiled pathway element trees.
+
+Pathway.build_element_tree walks cached_children() down from the root element on every call. A CompiledElementTree is
+the result of one such walk, flattened into a tuple of immutable nodes in pre-order (every parent before its children)
+with parent and child indices and each element's completion requirements already parsed. It is cached per pathway by
+Pathway.cached_element_tree() and discarded whenever the pathway or one of its elements is published, so requests only
+read it. Nothing here may be mutated in place; compile a new tree instead.
+"""
+import hashlib
+from collections import namedtuple
+
+from issuer.models import BadgeClass
+from pathway.completion import CompiledPathwayIndex
+from pathway.completionspec import CompletionRequirementSpecFactory, ElementJunctionCompletionRequirementSpec, \
+    BadgeJunctionCompletionRequirementSpec
+
+
+CompiledElementNode = namedtuple('CompiledElementNode', (
+    'index',                     # position in CompiledElementTree.nodes
+    'element_pk',
+    'element_id',                # PathwayElement.jsonld_id
+    'slug',
+    'depth',
+    'parent',                    # index of the parent node, None for the root
+    'children',                  # tuple of child indices, in cached_children() order
+    'spec',                      # parsed CompletionRequirementSpec, or None
+    'badges',                    # BadgeJunction only: tuple of (badgeclass jsonld_id, badgeclass pk)
+    'completion_badgeclass_id',
+))
+
+
+def _frozen_spec(spec):
+    if spec is not None:
+        if hasattr(spec, 'elements'):
+            spec.elements = frozenset(spec.elements)
+        if hasattr(spec, 'badges'):
+            spec.badges = frozenset(spec.badges)
+    return spec
+
+
+def _spec_key(spec):
+    if spec is None:
+        return None
+    return (spec.completion_type, spec.junction_type, spec.required_number,
+            sorted(getattr(spec, 'elements', getattr(spec, 'badges', ()))))
+
+
+class CompiledElementTree(object):
+    # bump when the layout of CompiledElementTree or CompiledElementNode changes, so stale pickles are not read back
+    FORMAT_VERSION = 1
+
+    def __init__(self, pathway_id, nodes):
+        self.pathway_id = pathway_id
+        self.nodes = tuple(nodes)
+        self.index_by_id = {node.element_id: node.index for node in self.nodes}
+        self.badgeclass_ids = frozenset(pk for node in self.nodes for jsonld_id, pk in node.badges)
+        self.version = self._compute_version()
+        self.completion_index = CompiledPathwayIndex.from_element_tree(self)
+
+    @classmethod
+    def from_pathway(cls, pathway):
+        return cls.from_element_tree(pathway.pk, pathway.build_element_tree())
+
+    @classmethod
+    def from_element_tree(cls, pathway_id, element_tree):
+        """
+        :param element_tree: the dict-based structure returned by Pathway.build_element_tree
+        """
+        nodes = []
+
+        def _compile(tree_node, parent, depth):
+            index = len(nodes)
+            nodes.append(None)
+            element = tree_node['element']
+            children = tuple(_compile(child, index, depth + 1) for child in list(tree_node['children'].values()))
+
+            spec = CompletionRequirementSpecFactory.parse_element(element)
+            if spec is None and parent is None:
+                # if the root has no completionspec, infer an elementjunction of all of its children
+                spec = ElementJunctionCompletionRequirementSpec(
+                    junction_type=CompletionRequirementSpecFactory.JUNCTION_TYPE_CONJUNCTION,
+                    required_number=len(children),
+                    elements=[nodes[c].element_id for c in children])
+
+            badges = ()
+            if spec is not None and spec.completion_type == CompletionRequirementSpecFactory.BADGE_JUNCTION:
+                badges = tuple((pb.cached_badgeclass.jsonld_id, pb.badgeclass_id) for pb in element.cached_badges())
+
+            nodes[index] = CompiledElementNode(
+                index=index,
+                element_pk=element.pk,
+                element_id=element.jsonld_id,
+                slug=element.slug,
+                depth=depth,
+                parent=parent,
+                children=children,
+                spec=_frozen_spec(spec),
+                badges=badges,
+                completion_badgeclass_id=element.completion_badgeclass_id)
+            return index
+
+        _compile(element_tree, None, 0)
+        return cls(pathway_id, nodes)
+
+    def _compute_version(self):
+        digest = hashlib.sha1()
+        for node in self.nodes:
+            digest.update(repr((
+                node.element_id, node.slug, node.parent, node.children, _spec_key(node.spec), node.badges,
+                node.completion_badgeclass_id,
+            )).encode('utf-8'))
+        return digest.hexdigest()[:16]
+
+    @property
+    def root(self):
+        return self.nodes[0] if self.nodes else None
+
+    def get_node(self, element_id):
+        index = self.index_by_id.get(element_id)
+        return self.nodes[index] if index is not None else None
+
+    def children_of(self, node):
+        return [self.nodes[c] for c in node.children]
+
+    def _completion_base(self, node):
+        completion = {
+            "element": {
+                '@id': node.element_id,
+                'slug': node.slug,
+            },
+            "completed": False,
+        }
+        if node.completion_badgeclass_id:
+            completion_badgeclass = BadgeClass.cached.get(pk=node.completion_badgeclass_id)
+            completion['completionBadge'] = {
+                '@id': completion_badgeclass.jsonld_id,
+                'slug': completion_badgeclass.entity_id,
+            }
+        return completion
+
+    def check_completions(self, instances):
+        """
+        Report the completion of every element reachable through a completionspec for a recipient holding instances.
+
+        :return: a list of completion dicts, children before their parents
+        """
+        root = self.root
+        if root is None or root.spec is None:
+            return []
+
+        completions = []
+        completed_ids = set()
+        instances_by_badge = BadgeJunctionCompletionRequirementSpec.index_instances(instances)
+
+        def _recurse(node):
+            node_completion = self._completion_base(node)
+            spec = node.spec
+
+            if spec is not None and spec.completion_type == CompletionRequirementSpecFactory.ELEMENT_JUNCTION:
+                # required children first, then optional ones
+                for child in sorted(self.children_of(node), key=lambda c: c.element_id not in spec.elements):
+                    _recurse(child)
+                spec.check_completion(node_completion, completions, completed_ids=completed_ids)
+            elif spec is not None and spec.completion_type == CompletionRequirementSpecFactory.BADGE_JUNCTION:
+                spec.check_completion(node_completion, instances, instances_by_badge=instances_by_badge)
+
+            completions.append(node_completion)
+            if node_completion['completed']:
+                completed_ids.add(node.element_id)
+
+        _recurse(root)
+        return completions
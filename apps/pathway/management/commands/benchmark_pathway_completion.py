@@ -0,0 +1,106 @@
+import random
+
+from mainsite.management.benchmark import BenchmarkCommand
+from pathway.completionspec import CompletionRequirementSpecFactory
+from pathway.element_tree import CompiledElementTree
+
+
+class StubBadgeClass(object):
+    def __init__(self, pk):
+        self.pk = pk
+        self.entity_id = 'badgeclass{}'.format(pk)
+        self.jsonld_id = 'https://api.example.org/public/badges/{}'.format(self.entity_id)
+
+
+class StubElementBadge(object):
+    def __init__(self, badgeclass):
+        self.badgeclass_id = badgeclass.pk
+        self.cached_badgeclass = badgeclass
+
+
+class StubElement(object):
+    def __init__(self, slug, completion_requirements=None, badgeclasses=()):
+        self.pk = slug
+        self.slug = slug
+        self.jsonld_id = 'https://api.example.org/v2/issuers/issuer/pathways/pathway/elements/{}'.format(slug)
+        self.completion_requirements = completion_requirements
+        self.completion_badgeclass_id = None
+        self._badges = [StubElementBadge(b) for b in badgeclasses]
+
+    def cached_badges(self):
+        return self._badges
+
+
+class StubInstance(object):
+    def __init__(self, pk, badgeclass):
+        self.badgeclass_id = badgeclass.pk
+        self.cached_badgeclass = badgeclass
+        self.jsonld_id = 'https://api.example.org/public/assertions/assertion{}'.format(pk)
+
+
+def junction(completion_type, junction_type, required_number, **ids):
+    requirements = {
+        '@type': completion_type,
+        'junctionConfig': {'@type': junction_type, 'requiredNumber': required_number},
+    }
+    requirements.update(ids)
+    return requirements
+
+
+def build_pathway(groups, leaves_per_group, badgeclasses):
+    """root -> groups -> leaves; each leaf is a 1-of-3 BadgeJunction, each group needs half of its leaves"""
+    group_nodes = {}
+    for g in range(groups):
+        leaf_nodes = {}
+        for leaf_index in range(leaves_per_group):
+            leaf_badgeclasses = random.sample(badgeclasses, 3)
+            leaf = StubElement('leaf-{}-{}'.format(g, leaf_index), junction(
+                CompletionRequirementSpecFactory.BADGE_JUNCTION, CompletionRequirementSpecFactory.JUNCTION_TYPE_DISJUNCTION,
+                1, badges=[b.jsonld_id for b in leaf_badgeclasses]), leaf_badgeclasses)
+            leaf_nodes[leaf.jsonld_id] = {'element': leaf, 'children': {}}
+        group = StubElement('group-{}'.format(g), junction(
+            CompletionRequirementSpecFactory.ELEMENT_JUNCTION, CompletionRequirementSpecFactory.JUNCTION_TYPE_DISJUNCTION,
+            leaves_per_group // 2, elements=list(leaf_nodes.keys())))
+        group_nodes[group.jsonld_id] = {'element': group, 'children': leaf_nodes}
+
+    root = StubElement('root', junction(
+        CompletionRequirementSpecFactory.ELEMENT_JUNCTION, CompletionRequirementSpecFactory.JUNCTION_TYPE_CONJUNCTION,
+        groups, elements=list(group_nodes.keys())))
+    return {'element': root, 'children': group_nodes}
+
+
+class Command(BenchmarkCommand):
+    help = 'Time pathway completion checks on a synthetic pathway without touching the database.'
+    label_width = 48
+
+    def add_arguments(self, parser):
+        parser.add_argument('--groups', type=int, default=50)
+        parser.add_argument('--leaves', type=int, default=9, help='leaf elements per group')
+        parser.add_argument('--badgeclasses', type=int, default=2000)
+        parser.add_argument('--instances', type=int, default=5000, help='badges held by the recipient')
+        parser.add_argument('--iterations', type=int, default=20)
+
+    def handle(self, *args, **options):
+        random.seed(0)
+        iterations = options['iterations']
+        badgeclasses = [StubBadgeClass(pk) for pk in range(1, options['badgeclasses'] + 1)]
+        tree = build_pathway(options['groups'], options['leaves'], badgeclasses)
+        instances = [StubInstance(pk, random.choice(badgeclasses)) for pk in range(options['instances'])]
+        earned = frozenset(i.badgeclass_id for i in instances)
+
+        compiled = CompiledElementTree.from_element_tree(1, tree)
+        index = compiled.completion_index
+        completed = index.evaluate(earned)
+        new_badgeclass = random.choice(badgeclasses).pk
+
+        self.stdout.write('{} elements, {} badgeclasses, recipient holds {} badges'.format(
+            len(index.nodes), len(badgeclasses), len(instances)))
+        self.report('compile element tree',
+                    lambda: CompiledElementTree.from_element_tree(1, tree), iterations)
+        self.report('CompiledElementTree.check_completions',
+                    lambda: compiled.check_completions(instances), iterations)
+        self.report('CompiledPathwayIndex.evaluate (all nodes)',
+                    lambda: index.evaluate(earned), iterations)
+        self.report('CompiledPathwayIndex.evaluate (one new badge)',
+                    lambda: index.evaluate(earned | {new_badgeclass}, completed,
+                                           index.affected_nodes([new_badgeclass])), iterations * 100)
@@ -0,0 +1,27 @@
+# Generated by Django 2.2.14 on 2026-10-19 12:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('issuer', '0056_auto_20200817_1352'),
+        ('pathway', '0009_auto_20200608_0452'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingCompletionCheck',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recipient_identifier', models.CharField(max_length=768)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('badgeclass', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='issuer.BadgeClass')),
+            ],
+            options={
+                'unique_together': {('recipient_identifier', 'badgeclass')},
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.14 on 2026-10-19 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pathway', '0010_pendingcompletioncheck'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pendingcompletioncheck',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='pendingcompletioncheck',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='pendingcompletioncheck',
+            name='status',
+            field=models.CharField(choices=[('Pending', 'Pending'), ('Checking', 'Checking'), ('Failed', 'Failed')], db_index=True, default='Pending', max_length=254),
+        ),
+    ]
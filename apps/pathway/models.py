@@ -7,6 +7,7 @@ import itertools
 from autoslug import AutoSlugField
 from basic_models.models import IsActive, CreatedUpdatedAt, CreatedUpdatedBy
 from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.urls import reverse, resolve, Resolver404
 from django.db import models
@@ -33,6 +34,7 @@ class Pathway(cachemodel.CacheModel, IsActive):
     def publish(self):
         super(Pathway, self).publish()
         self.publish_by('slug')
+        self.invalidate_element_tree()
         self.issuer.publish(publish_staff=False)
 
     def delete(self, *args, **kwargs):
@@ -73,6 +75,36 @@ class Pathway(cachemodel.CacheModel, IsActive):
     def cached_elements(self):
         return self.pathwayelement_set.filter(is_active=True)
 
+    @property
+    def element_tree_cache_key(self):
+        from pathway.element_tree import CompiledElementTree
+        return "pathway_element_tree_{}_v{}".format(self.pk, CompiledElementTree.FORMAT_VERSION)
+
+    def cached_element_tree(self):
+        """
+        The pathway.element_tree.CompiledElementTree of this pathway, compiled on first use after the pathway or one of
+        its elements was last published.
+        """
+        if self.root_element_id is None:
+            return None
+        tree = cache.get(self.element_tree_cache_key)
+        if tree is None:
+            return self.publish_element_tree()
+        return tree
+
+    def publish_element_tree(self):
+        from pathway.element_tree import CompiledElementTree
+        tree = CompiledElementTree.from_pathway(self)
+        cache.set(self.element_tree_cache_key, tree, timeout=None)
+        return tree
+
+    def invalidate_element_tree(self):
+        cache.delete(self.element_tree_cache_key)
+
+    def cached_completion_index(self):
+        tree = self.cached_element_tree()
+        return tree.completion_index if tree is not None else None
+
     @property
     def groups(self):
         return self.recipient_groups.all()
@@ -94,13 +126,6 @@ class Pathway(cachemodel.CacheModel, IsActive):
             self.name_hint = name_hint
         return super(Pathway, self).save(*args, **kwargs)
 
-    @property
-    def element_tree(self):
-        # memoized to improve tree iteration performance
-        if not hasattr(self, '_element_tree'):
-            self._element_tree = self.build_element_tree()
-        return self._element_tree
-
     def build_element_tree(self, tree_root_element=None):
         """
         Returns a python dict-based structure of nodes and their children
@@ -176,6 +201,7 @@ class PathwayElement(cachemodel.CacheModel, CreatedUpdatedAt, CreatedUpdatedBy,
     def publish(self):
         super(PathwayElement, self).publish()
         self.publish_by('slug')
+        # also discards the pathway's compiled element tree
         self.cached_pathway.publish()
         if self.parent_element:
             self.parent_element.publish()
@@ -316,3 +342,33 @@ class PathwayElementBadge(cachemodel.CacheModel):
     @property
     def cached_badgeclass(self):
         return BadgeClass.cached.get(pk=self.badgeclass_id)
+
+
+class PendingCompletionCheck(models.Model):
+    """
+    A recipient whose pathway completions need re-evaluating because they earned badgeclass. Rows are unique per
+    (recipient_identifier, badgeclass), so repeated issuance collapses into a single pending check; see
+    pathway.tasks.enqueue_completion_check.
+
+    A drain claims a check by marking it Checking and deletes it once it has been evaluated. Checks that keep failing
+    are set aside as Failed until the recipient earns the badgeclass again.
+    """
+    STATUS_PENDING = 'Pending'
+    STATUS_CHECKING = 'Checking'
+    STATUS_FAILED = 'Failed'
+    STATUS_CHOICES = (
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_CHECKING, 'Checking'),
+        (STATUS_FAILED, 'Failed'),
+    )
+
+    recipient_identifier = models.CharField(max_length=768)
+    badgeclass = models.ForeignKey('issuer.BadgeClass',
+                                   on_delete=models.CASCADE)
+    status = models.CharField(max_length=254, choices=STATUS_CHOICES, default=STATUS_PENDING, db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    claimed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        unique_together = ('recipient_identifier', 'badgeclass')
@@ -2,11 +2,11 @@
 
 
 from rest_framework import status
-from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 
 import badgrlog
 from issuer.public_api import JSONComponentView
+from mainsite.renderers import FastJSONRenderer
 from pathway.models import PathwayElement
 from pathway.renderers import PathwayElementHTMLRenderer
 from pathway.serializers import PathwayElementSerializer
@@ -19,7 +19,7 @@ class PathwayElementJson(JSONComponentView):
     GET the actual OBI badge object for a pathway element
     """
     model = PathwayElement
-    renderer_classes = (JSONRenderer, PathwayElementHTMLRenderer,)
+    renderer_classes = (FastJSONRenderer, PathwayElementHTMLRenderer,)
     html_renderer_class = PathwayElementHTMLRenderer
 
     def get(self, request, pathway_slug, element_slug, **kwargs):
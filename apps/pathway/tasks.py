@@ -1,9 +1,15 @@
 # Created by notto@concentricsky and wiggins@concentricsky.com on 5/25/16.
-import itertools
+import datetime
+import uuid
+from collections import OrderedDict
+
 from celery.utils.log import get_task_logger
 from django.conf import settings
 from django.core.cache import cache
 from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
 
 import badgrlog
 from mainsite.celery import app
@@ -15,74 +21,232 @@ badgrLogger = badgrlog.BadgrLogger()
 pathways_task_queue_name = getattr(settings, 'PATHWAYS_TASK_QUEUE_NAME', 'default')
 
 
+DRAIN_LOCK_KEY = '_task_lock_pathway_completion_drain'
+DRAIN_SCHEDULED_KEY = '_task_pathway_completion_drain_scheduled'
+
+
+def enqueue_completion_check(recipient_identifier, badgeclass_id):
+    """
+    Record that recipient_identifier earned badgeclass_id, and make sure a drain_completion_checks task will run.
+
+    Pending checks are unique per (recipient, badgeclass), and only one drain task is scheduled no matter how many
+    checks are enqueued before it starts, so a batch issuance to one cohort becomes a single drain.
+    """
+    from pathway.models import PendingCompletionCheck
+
+    try:
+        with transaction.atomic():
+            check, created = PendingCompletionCheck.objects.get_or_create(
+                recipient_identifier=recipient_identifier, badgeclass_id=badgeclass_id)
+    except IntegrityError:
+        created = False  # a concurrent enqueue created the same check
+
+    if not created:
+        # a check a drain is already evaluating may have read the recipient's badges before this one was issued, and
+        # a failed check deserves another try now that something changed
+        PendingCompletionCheck.objects.filter(
+            recipient_identifier=recipient_identifier, badgeclass_id=badgeclass_id
+        ).exclude(status=PendingCompletionCheck.STATUS_PENDING).update(
+            status=PendingCompletionCheck.STATUS_PENDING, claimed_at=None, attempts=0)
+
+    schedule_completion_drain()
+
+
+def schedule_completion_drain(countdown=None):
+    if cache.add(DRAIN_SCHEDULED_KEY, True, getattr(settings, 'PATHWAY_COMPLETION_DRAIN_SCHEDULE_TIMEOUT', 60*5)):
+        # a short countdown lets a burst of issuance collect into one drain
+        if countdown is None:
+            countdown = getattr(settings, 'PATHWAY_COMPLETION_DRAIN_COUNTDOWN', 5)
+        drain_completion_checks.apply_async(countdown=countdown)
+
+
 @app.task(bind=True, queue=pathways_task_queue_name)
-def award_badges_for_pathway_completion(self, badgeinstance_pk):
-    from issuer.models import BadgeInstance, BadgeClass
+def drain_completion_checks(self):
+    """
+    Evaluate pending completion checks in batches, once per recipient per batch, until none are left.
+
+    Only one drain runs at a time. A drain that can't get the lock returns without losing anything: the running drain
+    looks for claimable checks again after releasing the lock and schedules another drain if there are any.
+    """
+    from pathway.models import PendingCompletionCheck
 
-    lock_key = "_task_lock_completion_trigger_{}".format(badgeinstance_pk)
+    cache.delete(DRAIN_SCHEDULED_KEY)
+    batch_size = getattr(settings, 'PATHWAY_COMPLETION_BATCH_SIZE', 100)
+    max_attempts = getattr(settings, 'PATHWAY_COMPLETION_MAX_ATTEMPTS', 5)
+    lock_token = self.request.id or uuid.uuid4().hex
     awards = []
-    completions = []
+    failures = 0
+
+    if not _claimable_completion_checks().exists():
+        return {'status': 'done', 'awards': awards}
+    if not _acquire_lock(DRAIN_LOCK_KEY, lock_token):
+        return {'locked': True, 'resume': _lock_resume(DRAIN_LOCK_KEY)}
+    try:
+        after_pk = 0
+        while True:
+            # each batch has to finish within the lock timeout; a drain that lost its lock leaves the rest to the
+            # drain that took it over
+            if not _refresh_lock(DRAIN_LOCK_KEY, lock_token):
+                return {'locked': True, 'resume': _lock_resume(DRAIN_LOCK_KEY)}
+            batch = _claim_completion_checks(after_pk, batch_size)
+            if not batch:
+                break
+            after_pk = batch[-1].pk
+
+            pending = OrderedDict()
+            for check in batch:
+                pending.setdefault(check.recipient_identifier, []).append(check)
+
+            finished = []
+            for recipient_identifier, checks in list(pending.items()):
+                try:
+                    awards.extend(award_badges_for_recipient(
+                        recipient_identifier, {check.badgeclass_id for check in checks}))
+                except Exception:
+                    logger.exception("Pathway completion check for {} failed".format(recipient_identifier))
+                    failures += 1
+                    _release_failed_checks(checks, max_attempts)
+                else:
+                    finished.extend(checks)
+
+            # a check enqueued again while it was being evaluated is back to Pending and isn't deleted
+            PendingCompletionCheck.objects.filter(
+                pk__in=[check.pk for check in finished],
+                status=PendingCompletionCheck.STATUS_CHECKING,
+                claimed_at=batch[0].claimed_at
+            ).delete()
+    finally:
+        _release_lock(DRAIN_LOCK_KEY, lock_token)
+
+    # failed checks, and checks enqueued again behind this drain's position, are left for the next drain
+    if _claimable_completion_checks().exists():
+        schedule_completion_drain(
+            countdown=getattr(settings, 'PATHWAY_COMPLETION_RETRY_DELAY', 60) if failures else None)
 
-    if _acquire_lock(lock_key, self.request.id):
-        try:
-            # lock acquired
-
-            try:
-                badgeinstance = BadgeInstance.cached.get(pk=badgeinstance_pk)
-            except BadgeInstance.DoesNotExist:
-                return {'status': 'error', 'error': 'BadgeInstance {} not found'.format(badgeinstance_pk)}
-
-            badgeclass = badgeinstance.cached_badgeclass
-
-            recipient_profile = badgeinstance.cached_recipient_profile
-            if not recipient_profile:
-                return {'status': 'error', 'awards': [], 'error': 'RecipientProfile not found.'}
-
-            completable_elements = badgeclass.cached_pathway_elements()
-            pathways = set([ce.cached_pathway for ce in completable_elements])
-            if not pathways:
-                return {'status': 'done', 'awards': awards}
-
-            completions = list(itertools.chain.from_iterable([recipient_profile.cached_completions(p) for p in pathways]))
-            for completion in completions:
-                completion_badgeclass = None
-                if 'element' in completion and hasattr(completion['element'], 'completion_badgeclass'):
-                    completion_badgeclass = completion['element'].completion_badgeclass
-                elif 'completionBadge' in completion:
-                    try:
-                        completion_badgeclass = BadgeClass.cached.get(entity_id=completion.get('completionBadge').get('slug'))
-                    except BadgeClass.DoesNotExist:
-                        # got an erroneous badgeclass for a completionBadge
-                        pass
-                    
-                if completion_badgeclass:
-                    try:
-                        awarded_badge = BadgeInstance.objects.get(
-                            recipient_identifier=recipient_profile.recipient_identifier,
-                            badgeclass=completion_badgeclass)
-                        # badge was already awarded
-                    except BadgeInstance.DoesNotExist:
-                        # need to award badge
-                        awarded_badge = completion_badgeclass.issue(
-                            recipient_profile.recipient_identifier,
-                            notify=getattr(settings, 'ISSUER_NOTIFY_DEFAULT', True),
-                            created_by=None
-                        )
-                    awards.append(awarded_badge)
-
-        finally:
-            _release_lock(lock_key)
-
-        return {
-            'status': 'done',
-            'awards': awards
-        }
     return {
-        'locked': True,
-        'resume': _lock_resume(lock_key)
+        'status': 'done',
+        'awards': awards
     }
 
 
+def _claimable_completion_checks(now=None):
+    from pathway.models import PendingCompletionCheck
+
+    # a batch claimed by a drain that died before finishing it is picked up again
+    abandoned = (now or timezone.now()) - datetime.timedelta(
+        seconds=getattr(settings, 'PATHWAY_COMPLETION_CLAIM_TIMEOUT', 60*10))
+    pending = Q(status=PendingCompletionCheck.STATUS_PENDING)
+    abandoned_claim = Q(status=PendingCompletionCheck.STATUS_CHECKING, claimed_at__lt=abandoned)
+    return PendingCompletionCheck.objects.filter(pending | abandoned_claim)
+
+
+def _claim_completion_checks(after_pk, batch_size):
+    from pathway.models import PendingCompletionCheck
+
+    now = timezone.now()
+    claimable = _claimable_completion_checks(now).filter(pk__gt=after_pk)
+    pks = list(claimable.order_by('pk').values_list('pk', flat=True)[:batch_size])
+    if not pks:
+        return []
+
+    claimable.filter(pk__in=pks).update(status=PendingCompletionCheck.STATUS_CHECKING, claimed_at=now)
+    return list(PendingCompletionCheck.objects.filter(
+        pk__in=pks, status=PendingCompletionCheck.STATUS_CHECKING, claimed_at=now).order_by('pk'))
+
+
+def _release_failed_checks(checks, max_attempts):
+    from pathway.models import PendingCompletionCheck
+
+    for check in checks:
+        attempts = check.attempts + 1
+        if attempts >= max_attempts:
+            logger.error("Giving up on pathway completion check for {} after {} attempts".format(
+                check.recipient_identifier, attempts))
+            status = PendingCompletionCheck.STATUS_FAILED
+        else:
+            status = PendingCompletionCheck.STATUS_PENDING
+        PendingCompletionCheck.objects.filter(
+            pk=check.pk, status=PendingCompletionCheck.STATUS_CHECKING, claimed_at=check.claimed_at
+        ).update(status=status, attempts=attempts, claimed_at=None)
+
+
+def award_badges_for_recipient(recipient_identifier, badgeclass_ids):
+    """
+    Re-evaluate the pathways containing badgeclass_ids for recipient_identifier and award the completion badges of
+    any elements that became complete.
+    """
+    from issuer.models import BadgeInstance, BadgeClass
+    from pathway.completion import update_recipient_completion
+    from recipient.models import RecipientProfile
+
+    try:
+        RecipientProfile.cached.get(recipient_identifier=recipient_identifier)
+    except RecipientProfile.MultipleObjectsReturned:
+        pass
+    except RecipientProfile.DoesNotExist:
+        # completions are only tracked for recipients with a profile
+        return []
+
+    pathways = {}
+    for badgeclass_id in badgeclass_ids:
+        try:
+            badgeclass = BadgeClass.cached.get(pk=badgeclass_id)
+        except BadgeClass.DoesNotExist:
+            continue
+        for element in badgeclass.cached_pathway_elements():
+            pathways.setdefault(element.pathway_id, element.cached_pathway)
+
+    completions = []
+    for pathway in list(pathways.values()):
+        index = pathway.cached_completion_index()
+        if index is None:
+            continue
+        completed, newly_completed = update_recipient_completion(
+            index, recipient_identifier, badgeclass_ids=badgeclass_ids)
+        completions.extend(index.nodes[i] for i in sorted(newly_completed))
+
+    awards = []
+    for node in completions:
+        if not node.completion_badgeclass_id:
+            continue
+        try:
+            completion_badgeclass = BadgeClass.cached.get(pk=node.completion_badgeclass_id)
+        except BadgeClass.DoesNotExist:
+            # got an erroneous badgeclass for a completionBadge
+            continue
+
+        try:
+            awarded_badge = BadgeInstance.objects.get(
+                recipient_identifier=recipient_identifier,
+                badgeclass=completion_badgeclass)
+            # badge was already awarded
+        except BadgeInstance.DoesNotExist:
+            # need to award badge
+            awarded_badge = completion_badgeclass.issue(
+                recipient_identifier,
+                notify=getattr(settings, 'ISSUER_NOTIFY_DEFAULT', True),
+                created_by=None
+            )
+        awards.append(awarded_badge)
+    return awards
+
+
+@app.task(bind=True, queue=pathways_task_queue_name)
+def award_badges_for_pathway_completion(self, badgeinstance_pk):
+    """
+    Kept so tasks queued before the completion check queue existed are still processed.
+    """
+    from issuer.models import BadgeInstance
+
+    try:
+        badgeinstance = BadgeInstance.cached.get(pk=badgeinstance_pk)
+    except BadgeInstance.DoesNotExist:
+        return {'status': 'error', 'error': 'BadgeInstance {} not found'.format(badgeinstance_pk)}
+
+    enqueue_completion_check(badgeinstance.recipient_identifier, badgeinstance.badgeclass_id)
+    return {'status': 'queued'}
+
+
 @app.task(queue=pathways_task_queue_name)
 def resave_all_elements():
     from pathway.models import PathwayElement
@@ -94,13 +258,26 @@ def resave_all_elements():
             pass
 
 
-def _acquire_lock(key, taskId, expiration=60*5):
-    return cache.add(key, taskId, expiration)
+def _lock_timeout():
+    return getattr(settings, 'PATHWAY_COMPLETION_DRAIN_LOCK_TIMEOUT', 60*5)
+
+
+def _acquire_lock(key, taskId, expiration=None):
+    return cache.add(key, taskId, expiration or _lock_timeout())
+
+
+def _refresh_lock(key, taskId, expiration=None):
+    # the cache has no compare-and-set; the window between get and set is far shorter than the lock's expiration
+    if cache.get(key) != taskId:
+        return False
+    cache.set(key, taskId, expiration or _lock_timeout())
+    return True
 
 
 def _lock_resume(key):
     return cache.get(key)
 
 
-def _release_lock(key):
-    return cache.delete(key)
\ No newline at end of file
+def _release_lock(key, taskId):
+    if cache.get(key) == taskId:
+        cache.delete(key)
\ No newline at end of file
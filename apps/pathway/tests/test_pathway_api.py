@@ -1,6 +1,7 @@
 # Created by wiggins@concentricsky.com on 4/16/16.
 import json
 
+import mock
 import os
 from django.contrib.auth.models import Permission
 from django.core.cache import cache
@@ -15,9 +16,11 @@ from issuer.serializers_v1 import BadgeInstanceSerializerV1
 from mainsite.models import BadgrApp
 from mainsite.tests.base import BadgrTestCase, SetupIssuerHelper
 from mainsite.utils import OriginSetting
+from pathway.completion import update_recipient_completion
 from pathway.completionspec import CompletionRequirementSpecFactory
-from pathway.models import PathwayElement
+from pathway.models import PathwayElement, PendingCompletionCheck
 from pathway.serializers import PathwaySerializer, PathwayElementSerializer
+from pathway.tasks import drain_completion_checks, enqueue_completion_check
 from recipient.models import RecipientProfile, RecipientGroupMembership, RecipientGroup
 
 
@@ -480,6 +483,133 @@ class PathwayCompletionTests(SetupIssuerHelper, BadgrTestCase):
         except BadgeInstance.DoesNotExist:
             self.fail("Completion Badge was not awarded")
 
+    def test_completion_index_reevaluates_only_affected_nodes(self):
+        pathway = self.build_pathway(creator=self.test_user)
+        other_badgeclass = self.setup_badgeclass(issuer=self.test_issuer)
+        recipient = 'testrecipient3@example.com'
+
+        index = pathway.cached_completion_index()
+        self.assertEqual(len(index.nodes), 4)
+        self.assertEqual(index.root.element_id, pathway.root_element.jsonld_id)
+        self.assertEqual(len(index.badgeclass_nodes[self.test_badgeclass.pk]), 3)
+        self.assertEqual(index.affected_nodes([other_badgeclass.pk]), [])
+
+        completed, newly_completed = update_recipient_completion(index, recipient)
+        self.assertEqual(completed, frozenset())
+
+        with self.assertNumQueries(0):
+            completed, newly_completed = update_recipient_completion(
+                index, recipient, badgeclass_ids=[self.test_badgeclass.pk])
+        self.assertEqual(completed, frozenset(range(4)))
+        self.assertEqual(newly_completed, completed)
+
+        with self.assertNumQueries(0):
+            completed, newly_completed = update_recipient_completion(
+                index, recipient, badgeclass_ids=[other_badgeclass.pk])
+        self.assertEqual(newly_completed, frozenset())
+
+    def test_completion_checks_are_coalesced_per_recipient(self):
+        pathway = self.build_pathway(creator=self.test_user)
+        completed_badgeclass = self.setup_badgeclass(issuer=self.test_issuer)
+        pathway.root_element.completion_badgeclass = completed_badgeclass
+        pathway.root_element.save()
+        recipient = 'testrecipient4@example.com'
+        RecipientProfile.cached.get_or_create(recipient_identifier=recipient)
+
+        with mock.patch('pathway.tasks.drain_completion_checks.apply_async') as apply_async:
+            for _ in range(3):
+                self.test_badgeclass.issue(recipient, created_by=self.test_user)
+            enqueue_completion_check('other@example.com', self.test_badgeclass.pk)
+        self.assertEqual(apply_async.call_count, 1)
+        self.assertEqual(PendingCompletionCheck.objects.count(), 2)
+
+        drain_completion_checks.apply()
+        self.assertFalse(PendingCompletionCheck.objects.exists())
+        self.assertTrue(BadgeInstance.objects.filter(
+            badgeclass=completed_badgeclass, recipient_identifier=recipient).exists())
+
+    def test_failing_completion_checks_are_set_aside(self):
+        recipient = 'testrecipient5@example.com'
+        with mock.patch('pathway.tasks.drain_completion_checks.apply_async'):
+            enqueue_completion_check(recipient, self.test_badgeclass.pk)
+
+        with override_settings(PATHWAY_COMPLETION_MAX_ATTEMPTS=2), \
+                mock.patch('pathway.tasks.award_badges_for_recipient', side_effect=ValueError), \
+                mock.patch('pathway.tasks.drain_completion_checks.apply_async') as apply_async:
+            drain_completion_checks.apply()
+            check = PendingCompletionCheck.objects.get()
+            self.assertEqual(check.status, PendingCompletionCheck.STATUS_PENDING)
+            self.assertEqual(check.attempts, 1)
+            self.assertEqual(apply_async.call_count, 1)
+
+            drain_completion_checks.apply()
+            check = PendingCompletionCheck.objects.get()
+            self.assertEqual(check.status, PendingCompletionCheck.STATUS_FAILED)
+            self.assertEqual(check.attempts, 2)
+            self.assertEqual(apply_async.call_count, 1)
+
+        with mock.patch('pathway.tasks.drain_completion_checks.apply_async'):
+            enqueue_completion_check(recipient, self.test_badgeclass.pk)
+        check = PendingCompletionCheck.objects.get()
+        self.assertEqual(check.status, PendingCompletionCheck.STATUS_PENDING)
+        self.assertEqual(check.attempts, 0)
+
+    def test_compiled_element_tree_is_cached_until_an_element_is_published(self):
+        pathway = self.build_pathway(creator=self.test_user)
+        pathway.root_element.completion_requirements = None
+        pathway.root_element.save()
+
+        tree = pathway.cached_element_tree()
+        self.assertEqual(len(tree.nodes), 4)
+        self.assertEqual(tree.root.element_id, pathway.root_element.jsonld_id)
+        self.assertEqual(tree.root.parent, None)
+        self.assertEqual(len(tree.root.children), 3)
+        self.assertTrue(all(tree.nodes[c].parent == 0 for c in tree.root.children))
+        # the inferred root requirement lives on the compiled node, not on the element
+        self.assertEqual(tree.root.spec.required_number, 3)
+        self.assertIsNone(PathwayElement.cached.get(pk=pathway.root_element_id).completion_requirements)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(pathway.cached_element_tree().version, tree.version)
+
+        first_child = tree.nodes[tree.root.children[0]]
+        element = PathwayElement.objects.get(pk=first_child.element_pk)
+        element.completion_requirements = None
+        element.save(update_badges=False)
+        recompiled = pathway.cached_element_tree()
+        self.assertNotEqual(recompiled.version, tree.version)
+        self.assertIsNone(recompiled.get_node(first_child.element_id).spec)
+
+    def test_group_progress_report(self):
+        pathway = self.build_pathway(creator=self.test_user)
+        self.create_group()
+        recipient_group = RecipientGroup.objects.first()
+        recipients = ['earner{}@example.com'.format(i) for i in range(3)]
+        for recipient in recipients:
+            profile, _ = RecipientProfile.cached.get_or_create(recipient_identifier=recipient)
+            RecipientGroupMembership.objects.create(
+                recipient_group=recipient_group, recipient_profile=profile, membership_name=recipient)
+        self.test_badgeclass.issue(recipients[1], created_by=self.test_user)
+        url = reverse('pathway_group_progress', kwargs={
+            'issuer_slug': self.test_issuer.entity_id,
+            'pathway_slug': pathway.slug,
+            'group_slug': recipient_group.entity_id,
+        })
+        b''.join(self.client.get(url).streaming_content)  # warm the issuer, group and pathway caches
+
+        # memberships and assertions
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            report = json.loads(b''.join(response.streaming_content).decode('utf-8'))
+
+        self.assertEqual(report['memberCount'], 3)
+        self.assertEqual(report['elementCount'], 4)
+        self.assertEqual([m['name'] for m in report['members']], recipients)
+        self.assertEqual([m['completed'] for m in report['members']], [False, True, False])
+        self.assertEqual(report['members'][1]['completedElementCount'], 4)
+        self.assertIn(pathway.root_element.slug, report['members'][1]['completedElements'])
+
     def test_cannot_delete_required_badgeclass(self):
         pathway = self.build_single_element_pathway(creator=self.test_user)
 
@@ -1,15 +1,20 @@
 # Created by wiggins@concentricsky.com on 3/31/16.
+from collections import OrderedDict
+
 import basic_models
 import cachemodel
 from basic_models.models import CreatedUpdatedAt, IsActive, CreatedUpdatedBy
+from cachemodel.utils import generate_cache_key
+from django.conf import settings
+from django.core.cache import cache
 from django.urls import reverse
 from django.db import models, transaction
 
 from entity.models import BaseVersionedEntity
 from issuer.models import BadgeInstance, BaseAuditedModel, Issuer
+from mainsite.cached_collections import cached_pk_list
 from mainsite.managers import SlugOrJsonIdCacheModelManager
-from mainsite.utils import OriginSetting
-from pathway.completionspec import CompletionRequirementSpecFactory, ElementJunctionCompletionRequirementSpec
+from mainsite.utils import OriginSetting, generate_entity_uri
 
 
 class RecipientProfile(BaseVersionedEntity, CreatedUpdatedAt, CreatedUpdatedBy, IsActive):
@@ -34,35 +39,20 @@ class RecipientProfile(BaseVersionedEntity, CreatedUpdatedAt, CreatedUpdatedBy,
         return 'mailto:{}'.format(self.recipient_identifier)
 
     def cached_completions(self, pathway):
-        # get recipients instances that are aligned to this pathway
-        badgeclasses = pathway.cached_badgeclasses()
-        instances = [i for i in self.cached_badge_instances() if not i.revoked and i.cached_badgeclass in badgeclasses]
-
-        # recurse the tree to build completions
-        tree = pathway.element_tree
-        completion_spec = CompletionRequirementSpecFactory.parse_element(tree['element'])
-
-        if not completion_spec:
-            # if there is no completionspec, infer one of elementjunction of all children elements
-            completion_spec = ElementJunctionCompletionRequirementSpec(
-                junction_type=CompletionRequirementSpecFactory.JUNCTION_TYPE_CONJUNCTION,
-                required_number=len(tree['children']),
-                elements=(c['element'].jsonld_id for c in list(tree['children'].values())))
-            tree['element'].completion_requirements = completion_spec.serialize()
-
-        if completion_spec.completion_type == CompletionRequirementSpecFactory.BADGE_JUNCTION:
-            return [completion_spec.check_completion(tree, instances)]
-        elif completion_spec.completion_type == CompletionRequirementSpecFactory.ELEMENT_JUNCTION:
-            return completion_spec.check_completions(tree, instances)
-        else:
-            # unsupported completion_type
+        tree = pathway.cached_element_tree()
+        if tree is None:
             return []
 
+        # get recipients instances that are aligned to this pathway
+        instances = [i for i in self.cached_badge_instances()
+                     if not i.revoked and i.badgeclass_id in tree.badgeclass_ids]
+        return tree.check_completions(instances)
+
     @cachemodel.cached_method(auto_publish=True)
     def cached_group_memberships(self):
         return RecipientGroupMembership.objects.filter(recipient_profile=self)
 
-    @cachemodel.cached_method(auto_publish=True)
+    @cached_pk_list(auto_publish=True)
     def cached_badge_instances(self):
         return BadgeInstance.objects.filter(revoked=False, recipient_identifier=self.recipient_identifier)
 
@@ -108,33 +98,71 @@ class RecipientGroup(BaseAuditedModel, BaseVersionedEntity, IsActive):
     def membership_items(self, value):
         """
         Update this groups RecipientGroupMembmership from a list of RecipientGroupMembershipSerializerV2 data
+
+        The roster is synced as a diff: missing profiles and memberships are bulk created, renamed memberships bulk
+        updated and removed memberships deleted in one statement, then the group is published once.
         """
-        existing_members_idx = {s.recipient_identifier: s for s in self.membership_items}
-        new_members_idx = {s['recipient']['identifier']: s for s in value}
+        batch_size = getattr(settings, 'RECIPIENT_GROUP_SYNC_BATCH_SIZE', 1000)
+        names = OrderedDict()
+        for membership_data in value:
+            names.setdefault(membership_data['recipient']['identifier'].lower(),
+                             (membership_data['recipient']['identifier'], membership_data['name']))
+
+        def _chunks(items):
+            items = list(items)
+            for start in range(0, len(items), batch_size):
+                yield items[start:start + batch_size]
 
         with transaction.atomic():
-            # add missing memberships
-            for membership_data in value:
-                recipient_identifer = membership_data['recipient']['identifier']
-                if recipient_identifer not in existing_members_idx:
-                    profile, profile_created = RecipientProfile.cached.get_or_create(
-                        recipient_identifier=recipient_identifer
-                    )
-                    membership, created = RecipientGroupMembership.cached.get_or_create(
-                        recipient_group=self,
-                        recipient_profile=profile,
-                        defaults={
-                            'membership_name': membership_data['name']
-                        }
-                    )
-                    if not created:
-                        membership.membershi_name = membership_data['name']
-                        membership.save()
-
-            # remove old memberships
-            for membership in self.membership_items:
-                if membership.recipient_identifier not in new_members_idx:
-                    membership.delete()
+            existing = {}
+            for membership in RecipientGroupMembership.objects.filter(recipient_group=self) \
+                    .select_related('recipient_profile').order_by('pk'):
+                existing.setdefault(membership.recipient_profile.recipient_identifier.lower(), membership)
+
+            # resolve the profiles of new members, creating the ones that don't exist yet
+            missing = [key for key in names if key not in existing]
+            profiles = {}
+            for chunk in _chunks(names[key][0] for key in missing):
+                for profile in RecipientProfile.objects.filter(recipient_identifier__in=chunk).order_by('pk'):
+                    profiles.setdefault(profile.recipient_identifier.lower(), profile)
+            new_profiles = [RecipientProfile(recipient_identifier=names[key][0], entity_id=generate_entity_uri())
+                            for key in missing if key not in profiles]
+            RecipientProfile.objects.bulk_create(new_profiles, batch_size=batch_size)
+            for chunk in _chunks(p.entity_id for p in new_profiles):
+                for profile in RecipientProfile.objects.filter(entity_id__in=chunk):
+                    profiles[profile.recipient_identifier.lower()] = profile
+
+            RecipientGroupMembership.objects.bulk_create([
+                RecipientGroupMembership(
+                    recipient_group=self,
+                    recipient_profile_id=profiles[key].pk,
+                    membership_name=names[key][1],
+                    entity_id=generate_entity_uri()
+                ) for key in missing
+            ], batch_size=batch_size)
+
+            renamed = []
+            for key, membership in existing.items():
+                if key in names and membership.membership_name != names[key][1]:
+                    membership.membership_name = names[key][1]
+                    membership.entity_version += 1
+                    renamed.append(membership)
+            RecipientGroupMembership.objects.bulk_update(
+                renamed, ['membership_name', 'entity_version'], batch_size=batch_size)
+
+            removed = [membership for key, membership in existing.items() if key not in names]
+            if removed:
+                RecipientGroupMembership.objects.filter(pk__in=[m.pk for m in removed]).delete()
+
+        # bulk operations skip CacheModel.publish; drop what the per-membership publish would have refreshed
+        stale_keys = []
+        for membership in renamed + removed:
+            stale_keys.extend([membership.publish_key('pk'), membership.publish_key('entity_id')])
+        changed_profile_ids = [m.recipient_profile_id for m in removed] + [profiles[key].pk for key in missing]
+        stale_keys.extend(generate_cache_key([RecipientProfile.__name__, 'cached_group_memberships', pk])
+                          for pk in changed_profile_ids)
+        cache.delete_many(stale_keys)
+        self.publish()
 
     def member_count(self):
         return len(self.cached_members())
@@ -1,4 +1,6 @@
 from django.contrib.auth.models import Permission
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 from badgeuser.models import BadgeUser, CachedEmailAddress
 from issuer.models import Issuer
@@ -117,6 +119,31 @@ class RecipientApiTests(SetupIssuerHelper, BadgrTestCase):
         self.assertEqual(len(group.cached_members()), 2)
         self.assertTrue(sammi in [m.recipient_profile for m in group.cached_members()])
 
+    def test_membership_sync_is_set_based(self):
+        small_group = RecipientGroup.cached.get(entity_id=self.create_group().data.get('slug'))
+        group = RecipientGroup.cached.get(entity_id=self.create_group().data.get('slug'))
+        RecipientProfile.objects.create(recipient_identifier='member0@example.com', entity_id='existing-profile')
+
+        def _roster(count, name='Member'):
+            return [{'recipient': {'identifier': 'member{}@example.com'.format(i)}, 'name': '{} {}'.format(name, i)}
+                    for i in range(count)]
+
+        # the number of queries does not depend on the size of the roster
+        with CaptureQueriesContext(connection) as small_sync:
+            small_group.membership_items = _roster(2)
+        with CaptureQueriesContext(connection) as large_sync:
+            group.membership_items = _roster(40)
+        self.assertEqual(len(large_sync.captured_queries), len(small_sync.captured_queries))
+        self.assertEqual(group.member_count(), 40)
+        self.assertEqual(RecipientProfile.objects.filter(recipient_identifier='member0@example.com').count(), 1)
+        self.assertTrue(all(m.entity_id for m in group.cached_members()))
+
+        group.membership_items = _roster(30, name='Renamed')
+        members = {m.recipient_identifier: m.membership_name for m in group.cached_members()}
+        self.assertEqual(len(members), 30)
+        self.assertEqual(members['member29@example.com'], 'Renamed 29')
+        self.assertNotIn('member30@example.com', members)
+
     def test_subscribe_group_to_pathway(self):
         group_response = self.create_group()
         group_slug = group_response.data.get('slug')